@@ -12,6 +12,7 @@ from src.routes.auth import auth_bp
 from src.routes.price import price_bp
 from src.routes.coupon import coupon_bp
 from src.routes.notification import notification_bp
+from src.routes.alert import alert_bp
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
@@ -19,6 +20,18 @@ app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 # Enable database
 app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://{os.getenv('DB_USERNAME', 'root')}:{os.getenv('DB_PASSWORD', 'password')}@{os.getenv('DB_HOST', 'localhost')}:{os.getenv('DB_PORT', '3306')}/{os.getenv('DB_NAME', 'mydb')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['PRICE_BATCH_CHUNK_SIZE'] = int(os.getenv('PRICE_BATCH_CHUNK_SIZE', '500'))
+app.config['NOTIFICATION_BROKER_URL'] = os.getenv('NOTIFICATION_BROKER_URL', 'memory://')
+app.config['NOTIFICATION_STREAM_HEARTBEAT'] = float(os.getenv('NOTIFICATION_STREAM_HEARTBEAT', '15'))
+app.config['NOTIFICATION_COALESCE_WINDOW'] = int(os.getenv('NOTIFICATION_COALESCE_WINDOW', '0'))
+app.config['NOTIFICATION_DIGEST_WINDOW'] = int(os.getenv('NOTIFICATION_DIGEST_WINDOW', '3600'))
+app.config['NOTIFICATION_OUTBOX'] = os.getenv('NOTIFICATION_OUTBOX', 'false').lower() in ('1', 'true', 'yes')
+app.config['NOTIFICATION_ARCHIVE_AFTER_DAYS'] = int(os.getenv('NOTIFICATION_ARCHIVE_AFTER_DAYS', '30'))
+app.config['NOTIFICATION_DELETE_AFTER_DAYS'] = int(os.getenv('NOTIFICATION_DELETE_AFTER_DAYS', '365'))
+app.config['COUPON_EXPIRY_NOTICE_HOURS'] = float(os.getenv('COUPON_EXPIRY_NOTICE_HOURS', '0'))
+app.config['EFFECTIVE_PRICE_CACHE_TTL'] = float(os.getenv('EFFECTIVE_PRICE_CACHE_TTL', '60'))
+app.config['SEARCH_BACKEND'] = os.getenv('SEARCH_BACKEND', 'auto')
+app.config['SUMMARY_CACHE_TTL'] = float(os.getenv('SUMMARY_CACHE_TTL', '300'))
 db.init_app(app)
 
 # Register blueprints
@@ -29,6 +42,7 @@ app.register_blueprint(category_bp, url_prefix='/api/categories')
 app.register_blueprint(price_bp, url_prefix='/api/prices')
 app.register_blueprint(coupon_bp, url_prefix='/api/coupons')
 app.register_blueprint(notification_bp, url_prefix='/api/notifications')
+app.register_blueprint(alert_bp, url_prefix='/api/alerts')
 
 # Create database tables
 with app.app_context():
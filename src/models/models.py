@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.hybrid import hybrid_method
 from datetime import datetime
 import enum
 
@@ -9,12 +10,17 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
+    notification_digest = db.Column(db.Boolean, default=False)  # Collapse notifications into periodic digests
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     wishlists = db.relationship('WishlistItem', backref='user', lazy=True, cascade="all, delete-orphan")
-    
+    alert_rules = db.relationship('AlertRule', backref='user', lazy=True, cascade="all, delete-orphan")
+    notification_counter = db.relationship('NotificationCounter', uselist=False, lazy=True, cascade="all, delete-orphan")
+    archived_notifications = db.relationship('ArchivedNotification', lazy=True, cascade="all, delete-orphan")
+    change_watermark = db.relationship('ChangeWatermark', uselist=False, lazy=True, cascade="all, delete-orphan")
+
     def __repr__(self):
         return f'<User {self.username}>'
 
@@ -23,6 +29,7 @@ class User(db.Model):
             'id': self.id,
             'username': self.username,
             'email': self.email,
+            'notification_digest': self.notification_digest,
             'created_at': self.created_at,
             'updated_at': self.updated_at
         }
@@ -34,10 +41,10 @@ class Category(db.Model):
     
     # Relationships
     items = db.relationship('WishlistItem', backref='category', lazy=True)
-    
+
     def __repr__(self):
         return f'<Category {self.name}>'
-    
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -46,6 +53,15 @@ class Category(db.Model):
         }
 
 class WishlistItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_wishlist_item_user_drop', 'user_id', 'price_drop_pct'),
+        db.Index('ix_wishlist_item_drop', 'price_drop_pct'),
+        db.Index('ix_wishlist_item_user_created', 'user_id', 'created_at'),
+        db.Index('ix_wishlist_item_user_priority', 'user_id', 'priority'),
+        # Native full-text search on MySQL; SQLite gets an FTS5 table instead (see services/search.py)
+        db.Index('ix_wishlist_item_fulltext', 'name', 'description', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
@@ -55,8 +71,11 @@ class WishlistItem(db.Model):
     initial_price = db.Column(db.Float)
     lowest_price = db.Column(db.Float)
     highest_price = db.Column(db.Float)
+    price_drop_pct = db.Column(db.Float, default=0)  # Kept in sync with price_drop_percentage() on flush
     priority = db.Column(db.Integer, default=0)  # 0=low, 1=medium, 2=high
     is_purchased = db.Column(db.Boolean, default=False)
+    price_checked_at = db.Column(db.DateTime)  # Last time a price was observed, changed or not
+    price_check_failed_at = db.Column(db.DateTime)  # Last time the refresher failed to read a price
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -67,10 +86,12 @@ class WishlistItem(db.Model):
     # Relationships
     price_history = db.relationship('PriceHistory', backref='item', lazy=True, cascade="all, delete-orphan")
     coupons = db.relationship('Coupon', backref='item', lazy=True, cascade="all, delete-orphan")
-    
+    price_rollups = db.relationship('PriceRollup', backref='item', lazy=True, cascade="all, delete-orphan")
+    alert_rules = db.relationship('AlertRule', backref='item', lazy=True, cascade="all, delete-orphan")
+
     def __repr__(self):
         return f'<WishlistItem {self.name}>'
-    
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -84,40 +105,99 @@ class WishlistItem(db.Model):
             'highest_price': self.highest_price,
             'priority': self.priority,
             'is_purchased': self.is_purchased,
+            'price_checked_at': self.price_checked_at,
             'created_at': self.created_at,
             'updated_at': self.updated_at,
             'user_id': self.user_id,
             'category_id': self.category_id
         }
-    
+
     def has_price_drop(self):
         """Check if the current price is lower than the initial price"""
         if self.current_price and self.initial_price:
             return self.current_price < self.initial_price
         return False
-    
+
     def price_drop_percentage(self):
         """Calculate the percentage of price drop"""
         if self.current_price and self.initial_price and self.initial_price > 0:
             return ((self.initial_price - self.current_price) / self.initial_price) * 100
         return 0
 
+    @classmethod
+    def price_drop_expression(cls):
+        """SQL equivalent of price_drop_percentage(), floored at zero like has_price_drop()"""
+        return db.case(
+            (db.and_(cls.current_price > 0, cls.initial_price > 0, cls.current_price < cls.initial_price),
+             (cls.initial_price - cls.current_price) / cls.initial_price * 100),
+            else_=0
+        )
+
+@db.event.listens_for(WishlistItem, 'before_insert')
+@db.event.listens_for(WishlistItem, 'before_update')
+def _sync_price_drop(mapper, connection, target):
+    target.price_drop_pct = max(target.price_drop_percentage(), 0)
+
 class PriceHistory(db.Model):
+    __table_args__ = (
+        db.Index('ix_price_history_item_recorded', 'item_id', 'recorded_at'),
+    )
+    
+    # Each row is a run of identical observations: recorded_at is when the
+    # price was first seen, last_seen when it was last re-checked unchanged
     id = db.Column(db.Integer, primary_key=True)
     price = db.Column(db.Float, nullable=False)
     recorded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime)
+    observation_count = db.Column(db.Integer, nullable=False, default=1)
     
     # Foreign keys
     item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'), nullable=False)
-    
+
     def __repr__(self):
         return f'<PriceHistory {self.price} at {self.recorded_at}>'
-    
+
     def to_dict(self):
         return {
             'id': self.id,
             'price': self.price,
             'recorded_at': self.recorded_at,
+            'first_seen': self.recorded_at,
+            'last_seen': self.last_seen or self.recorded_at,
+            'observation_count': self.observation_count,
+            'item_id': self.item_id
+        }
+
+class PriceRollup(db.Model):
+    """Open/high/low/close summary of the price observations in one time bucket"""
+    __table_args__ = (
+        db.UniqueConstraint('item_id', 'resolution', 'bucket_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.String(10), nullable=False)  # 'hour', 'day' or 'week'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    open_price = db.Column(db.Float, nullable=False)
+    high_price = db.Column(db.Float, nullable=False)
+    low_price = db.Column(db.Float, nullable=False)
+    close_price = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    # Foreign keys
+    item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'), nullable=False)
+
+    def __repr__(self):
+        return f'<PriceRollup {self.resolution} {self.bucket_start} for {self.item_id}>'
+
+    def to_dict(self):
+        return {
+            'bucket_start': self.bucket_start,
+            'resolution': self.resolution,
+            'open': self.open_price,
+            'high': self.high_price,
+            'low': self.low_price,
+            'close': self.close_price,
+            'count': self.count,
             'item_id': self.item_id
         }
 
@@ -127,6 +207,10 @@ class CouponStatus(enum.Enum):
     USED = "used"
 
 class Coupon(db.Model):
+    __table_args__ = (
+        db.Index('ix_coupon_item_status_until', 'item_id', 'status', 'valid_until'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(100))
     description = db.Column(db.String(255))
@@ -135,14 +219,15 @@ class Coupon(db.Model):
     status = db.Column(db.Enum(CouponStatus), default=CouponStatus.ACTIVE)
     valid_from = db.Column(db.DateTime, default=datetime.utcnow)
     valid_until = db.Column(db.DateTime)
+    expiry_notified_at = db.Column(db.DateTime)  # When the expiring-soon notification went out
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Foreign keys
     item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'), nullable=False)
-    
+
     def __repr__(self):
         return f'<Coupon {self.code}>'
-    
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -156,39 +241,199 @@ class Coupon(db.Model):
             'created_at': self.created_at,
             'item_id': self.item_id
         }
-    
-    def is_active(self):
+
+    @hybrid_method
+    def is_active(self, now=None):
         """Check if the coupon is currently active"""
-        now = datetime.utcnow()
+        now = now or datetime.utcnow()
         return (self.status == CouponStatus.ACTIVE and 
-                self.valid_from <= now and 
+                self.valid_from is not None and self.valid_from <= now and 
                 (self.valid_until is None or self.valid_until >= now))
 
+    @is_active.expression
+    def is_active(cls, now=None):
+        """SQL form of is_active(), served by the (item_id, status, valid_until) index"""
+        now = now or datetime.utcnow()
+        return db.and_(cls.status == CouponStatus.ACTIVE,
+                       cls.valid_from <= now,
+                       db.or_(cls.valid_until.is_(None), cls.valid_until >= now))
+
 class Notification(db.Model):
+    __table_args__ = (
+        db.Index('ix_notification_user_read_created', 'user_id', 'is_read', 'created_at'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    type = db.Column(db.String(50), nullable=False)  # 'price_drop', 'coupon', etc.
+    type = db.Column(db.String(50), nullable=False)  # 'price_drop', 'coupon', 'digest', etc.
     message = db.Column(db.Text, nullable=False)
     is_read = db.Column(db.Boolean, default=False)
+    occurrences = db.Column(db.Integer, nullable=False, default=1)  # Events coalesced into this row
+    reference_price = db.Column(db.Float)  # Price before the first coalesced drop
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime)  # Last time another event was coalesced in
     
     # Foreign keys
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'))  # Empty for digests
     
     # Relationships
     user = db.relationship('User', backref=db.backref('notifications', lazy=True))
     item = db.relationship('WishlistItem')
-    
+
     def __repr__(self):
         return f'<Notification {self.type} for {self.item_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.type,
+            'message': self.message,
+            'is_read': self.is_read,
+            'occurrences': self.occurrences,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at or self.created_at,
+            'user_id': self.user_id,
+            'item_id': self.item_id
+        }
+
+class ArchivedNotification(db.Model):
+    """Read notification moved out of the live table by the retention job"""
+    __table_args__ = (
+        db.Index('ix_archived_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_archived_notification_created', 'created_at'),
+    )
     
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Same id as the live notification
+    type = db.Column(db.String(50), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    is_read = db.Column(db.Boolean, default=True)
+    occurrences = db.Column(db.Integer, nullable=False, default=1)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Foreign keys
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    item_id = db.Column(db.Integer)  # Kept as a plain value, the item may be deleted since
+
+    def __repr__(self):
+        return f'<ArchivedNotification {self.type} for {self.item_id}>'
+
     def to_dict(self):
         return {
             'id': self.id,
             'type': self.type,
             'message': self.message,
             'is_read': self.is_read,
+            'occurrences': self.occurrences,
             'created_at': self.created_at,
+            'updated_at': self.updated_at or self.created_at,
+            'archived_at': self.archived_at,
             'user_id': self.user_id,
             'item_id': self.item_id
         }
+
+class AlertRuleType(enum.Enum):
+    BELOW = "below"                # price falls below threshold
+    DROP_PERCENTAGE = "drop_pct"   # a single drop of at least threshold percent
+    ALL_TIME_LOW = "all_time_low"  # price goes under the lowest price seen so far
+
+class AlertRule(db.Model):
+    """Price alert for one item, or for every item of a user when item_id is empty"""
+    __table_args__ = (
+        db.Index('ix_alert_rule_item', 'item_id', 'is_active'),
+        db.Index('ix_alert_rule_user', 'user_id', 'is_active'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    rule_type = db.Column(db.Enum(AlertRuleType), nullable=False)
+    threshold = db.Column(db.Float)  # Unused for all-time-low rules
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Foreign keys
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    item_id = db.Column(db.Integer, db.ForeignKey('wishlist_item.id'))
+
+    def __repr__(self):
+        return f'<AlertRule {self.rule_type.value} {self.threshold}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'rule_type': self.rule_type.value,
+            'threshold': self.threshold,
+            'is_active': self.is_active,
+            'created_at': self.created_at,
+            'user_id': self.user_id,
+            'item_id': self.item_id
+        }
+
+class NotificationCounter(db.Model):
+    """Cached number of unread notifications per user, repaired by the reconcile job"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<NotificationCounter {self.unread_count} for {self.user_id}>'
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'unread_count': self.unread_count,
+            'updated_at': self.updated_at
+        }
+
+class ChangeWatermark(db.Model):
+    """Per-user version bumped by every committed write to the user's data, used for conditional GETs"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeWatermark {self.version} for {self.user_id}>'
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'version': self.version,
+            'updated_at': self.updated_at
+        }
+
+class OutboxStatus(enum.Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+class OutboxEvent(db.Model):
+    """Side effect recorded in the same transaction as the write that caused it, run later by the outbox worker"""
+    __table_args__ = (
+        db.Index('ix_outbox_event_status_available', 'status', 'available_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.Enum(OutboxStatus), nullable=False, default=OutboxStatus.PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    available_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.event_type} {self.status.value}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'event_type': self.event_type,
+            'status': self.status.value,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'available_at': self.available_at,
+            'created_at': self.created_at,
+            'processed_at': self.processed_at
+        }
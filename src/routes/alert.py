@@ -0,0 +1,130 @@
+from flask import Blueprint, request, jsonify
+from src.models.models import db, AlertRule, AlertRuleType, WishlistItem, User
+
+alert_bp = Blueprint('alert', __name__)
+
+def _parse_rule_type(value):
+    try:
+        return AlertRuleType(value)
+    except ValueError:
+        return None
+
+def _parse_threshold(value):
+    """The threshold as a float, None when absent; raises ValueError when it is not a number"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError('Threshold must be a number')
+
+@alert_bp.route('/', methods=['GET'])
+def get_alert_rules():
+    """Get all alert rules for a user, optionally for one item"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    query = AlertRule.query.filter_by(user_id=user_id)
+    
+    item_id = request.args.get('item_id')
+    if item_id:
+        query = query.filter_by(item_id=item_id)
+    
+    rules = query.order_by(AlertRule.created_at.desc()).all()
+    
+    return jsonify({
+        'alert_rules': [rule.to_dict() for rule in rules]
+    }), 200
+
+@alert_bp.route('/', methods=['POST'])
+def create_alert_rule():
+    """Create an alert rule for an item or for all items of a user"""
+    data = request.get_json()
+    
+    # Validate required fields
+    if not all(k in data for k in ['user_id', 'rule_type']):
+        return jsonify({'error': 'User ID and rule type are required'}), 400
+    
+    rule_type = _parse_rule_type(data['rule_type'])
+    if rule_type is None:
+        return jsonify({'error': f"Invalid rule type. Must be one of: {[t.value for t in AlertRuleType]}"}), 400
+    
+    try:
+        threshold = _parse_threshold(data.get('threshold'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if rule_type != AlertRuleType.ALL_TIME_LOW and threshold is None:
+        return jsonify({'error': 'Threshold is required for this rule type'}), 400
+    
+    # Verify user exists
+    user = User.query.get(data['user_id'])
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    # Verify item exists and belongs to the user if provided
+    item_id = data.get('item_id')
+    if item_id:
+        item = WishlistItem.query.get(item_id)
+        if not item or item.user_id != user.id:
+            return jsonify({'error': 'Item not found'}), 404
+    
+    new_rule = AlertRule(
+        rule_type=rule_type,
+        threshold=threshold,
+        is_active=data.get('is_active', True),
+        user_id=user.id,
+        item_id=item_id
+    )
+    
+    db.session.add(new_rule)
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Alert rule created successfully',
+        'alert_rule': new_rule.to_dict()
+    }), 201
+
+@alert_bp.route('/<int:rule_id>', methods=['PUT'])
+def update_alert_rule(rule_id):
+    """Update an existing alert rule"""
+    rule = AlertRule.query.get_or_404(rule_id)
+    data = request.get_json()
+    
+    if 'rule_type' in data:
+        rule_type = _parse_rule_type(data['rule_type'])
+        if rule_type is None:
+            return jsonify({'error': f"Invalid rule type. Must be one of: {[t.value for t in AlertRuleType]}"}), 400
+        rule.rule_type = rule_type
+    
+    if 'threshold' in data:
+        try:
+            rule.threshold = _parse_threshold(data['threshold'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    if 'is_active' in data:
+        rule.is_active = data['is_active']
+    
+    if rule.rule_type != AlertRuleType.ALL_TIME_LOW and rule.threshold is None:
+        return jsonify({'error': 'Threshold is required for this rule type'}), 400
+    
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Alert rule updated successfully',
+        'alert_rule': rule.to_dict()
+    }), 200
+
+@alert_bp.route('/<int:rule_id>', methods=['DELETE'])
+def delete_alert_rule(rule_id):
+    """Delete an alert rule"""
+    rule = AlertRule.query.get_or_404(rule_id)
+    
+    db.session.delete(rule)
+    db.session.commit()
+    
+    return jsonify({
+        'message': 'Alert rule deleted successfully'
+    }), 200
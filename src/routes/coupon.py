@@ -1,10 +1,19 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from src.models.models import db, Coupon, WishlistItem, Notification, User, CouponStatus
+from src.services.notifications import notify
+from src.services.pagination import parse_limit, encode_cursor, decode_cursor, cursor_value
+from src.services.coupons import sweep_coupons, best_prices, DEFAULT_CHUNK_SIZE
+from src.services.coupon_import import import_coupons, read_coupon_file
+from src.services.feed_import import open_feed
+from src.services.watermarks import conditional_on_user
 from datetime import datetime
+import click
+import json
 
 coupon_bp = Blueprint('coupon', __name__)
 
 @coupon_bp.route('/', methods=['GET'])
+@conditional_on_user
 def get_all_coupons():
     """Get all coupons for a specific item or user"""
     item_id = request.args.get('item_id')
@@ -12,25 +21,83 @@ def get_all_coupons():
     
     if item_id:
         # Get coupons for specific item
-        coupons = Coupon.query.filter_by(item_id=item_id).all()
+        query = Coupon.query.filter(Coupon.item_id == item_id)
     elif user_id:
-        # Get coupons for all items of a user
-        items = WishlistItem.query.filter_by(user_id=user_id).all()
-        item_ids = [item.id for item in items]
-        coupons = Coupon.query.filter(Coupon.item_id.in_(item_ids)).all()
+        # Get coupons for all items of a user in one join
+        query = Coupon.query.join(WishlistItem, WishlistItem.id == Coupon.item_id).filter(
+            WishlistItem.user_id == user_id
+        )
     else:
         return jsonify({'error': 'Either item_id or user_id is required'}), 400
     
+    try:
+        limit = parse_limit(request.args)
+        after = request.args.get('after')
+        if after:
+            (last_id,) = decode_cursor(after, 1)
+            last_id = cursor_value(last_id, int)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     # Filter active coupons if requested
     active_only = request.args.get('active_only', 'false').lower() == 'true'
     if active_only:
-        now = datetime.utcnow()
-        coupons = [c for c in coupons if c.status == CouponStatus.ACTIVE and 
-                  c.valid_from <= now and 
-                  (c.valid_until is None or c.valid_until >= now)]
+        query = query.filter(Coupon.is_active(datetime.utcnow()))
+    
+    # Continue after the last coupon of the previous page
+    if after:
+        query = query.filter(Coupon.id > last_id)
+    
+    query = query.order_by(Coupon.id)
+    coupons = query.limit(limit + 1).all() if limit else query.all()
+    
+    next_cursor = None
+    if limit and len(coupons) > limit:
+        coupons = coupons[:limit]
+        next_cursor = encode_cursor(coupons[-1].id)
+    
+    return jsonify({
+        'coupons': [coupon.to_dict() for coupon in coupons],
+        'next_cursor': next_cursor
+    }), 200
+
+@coupon_bp.route('/best', methods=['GET'])
+def get_best_prices():
+    """Get the best coupon and what the user would actually pay for each item"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    prices = sorted(best_prices(user_id=user.id).values(), key=lambda price: price['item_id'])
+    priced = [price for price in prices if price['current_price'] is not None]
+    
+    return jsonify({
+        'items': prices,
+        'total_current_price': round(sum(price['current_price'] for price in priced), 2),
+        'total_effective_price': round(sum(price['effective_price'] for price in priced), 2),
+        'total_savings': round(sum(price['savings'] for price in priced), 2)
+    }), 200
+
+@coupon_bp.route('/import', methods=['POST'])
+def import_coupon_list():
+    """Import coupons matched to tracked items by URL, URL prefix or domain"""
+    data = request.get_json()
+    entries = data.get('coupons') if isinstance(data, dict) else data
+    
+    if not isinstance(entries, list):
+        return jsonify({'error': 'A list of coupons is required'}), 400
+    
+    summary = import_coupons(entries)
     
     return jsonify({
-        'coupons': [coupon.to_dict() for coupon in coupons]
+        'message': f"Imported {summary['created']} coupons",
+        'summary': summary
     }), 200
 
 @coupon_bp.route('/<int:coupon_id>', methods=['GET'])
@@ -70,13 +137,7 @@ def create_coupon():
     db.session.add(new_coupon)
     
     # Create notification for the user
-    notification = Notification(
-        type='coupon',
-        message=f"New coupon available for {item.name}: {new_coupon.code}",
-        user_id=item.user_id,
-        item_id=item.id
-    )
-    db.session.add(notification)
+    notify(item.user_id, item.id, 'coupon', f"New coupon available for {item.name}: {new_coupon.code}")
     
     db.session.commit()
     
@@ -111,7 +172,19 @@ def update_coupon(coupon_id):
             return jsonify({'error': f"Invalid status. Must be one of: {[s.value for s in CouponStatus]}"}), 400
     
     if 'valid_until' in data:
-        coupon.valid_until = data['valid_until']
+        valid_until = data['valid_until']
+        if valid_until is not None:
+            try:
+                valid_until = datetime.fromisoformat(valid_until)
+            except (TypeError, ValueError):
+                return jsonify({'error': "Invalid 'valid_until' timestamp, expected ISO 8601"}), 400
+        coupon.valid_until = valid_until
+        # A new expiry date deserves a new reminder
+        coupon.expiry_notified_at = None
+        # and revives a coupon the sweeper expired, unless a status was given
+        if ('status' not in data and coupon.status == CouponStatus.EXPIRED
+                and (valid_until is None or valid_until > datetime.utcnow())):
+            coupon.status = CouponStatus.ACTIVE
     
     db.session.commit()
     
@@ -157,13 +230,7 @@ def simulate_coupon(item_id):
     db.session.add(new_coupon)
     
     # Create notification
-    notification = Notification(
-        type='coupon',
-        message=f"New coupon available for {item.name}: {code}",
-        user_id=item.user_id,
-        item_id=item.id
-    )
-    db.session.add(notification)
+    notify(item.user_id, item.id, 'coupon', f"New coupon available for {item.name}: {code}")
     
     db.session.commit()
     
@@ -171,3 +238,23 @@ def simulate_coupon(item_id):
         'message': 'Coupon simulated successfully',
         'coupon': new_coupon.to_dict()
     }), 201
+
+@coupon_bp.cli.command('expire')
+@click.option('--notify-within-hours', type=float, help='Also notify about coupons expiring this soon; defaults to COUPON_EXPIRY_NOTICE_HOURS')
+@click.option('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, show_default=True)
+def expire_coupons_command(notify_within_hours, chunk_size):
+    """Mark past-due coupons as expired and warn about the ones expiring soon"""
+    if notify_within_hours is None:
+        notify_within_hours = current_app.config.get('COUPON_EXPIRY_NOTICE_HOURS', 0)
+    summary = sweep_coupons(notify_within_hours * 3600, chunk_size=chunk_size)
+    click.echo(json.dumps(summary))
+
+@coupon_bp.cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_coupons_command(path):
+    """Import a JSON or NDJSON coupon file (optionally gzipped) matched by item URL or domain"""
+    with open(path, 'rb') as stream:
+        entries = read_coupon_file(open_feed(stream))
+    
+    summary = import_coupons(entries)
+    click.echo(json.dumps(summary))
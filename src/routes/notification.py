@@ -1,9 +1,20 @@
-from flask import Blueprint, request, jsonify
-from src.models.models import db, Notification, User, WishlistItem
+from flask import Blueprint, Response, request, jsonify, current_app
+from sqlalchemy import and_, or_, update
+from src.models.models import db, Notification, ArchivedNotification, User, WishlistItem
+from src.services.pagination import DEFAULT_LIMIT, parse_limit, encode_cursor, decode_keyset_cursor
+from src.services.notifications import adjust_unread, unread_count, reconcile_unread_counts
+from src.services.broker import get_broker
+from src.services.outbox import drain_outbox, outbox_stats, DEFAULT_BATCH_SIZE, DEFAULT_MAX_ATTEMPTS
+from src.services.retention import apply_retention, DEFAULT_CHUNK_SIZE
+from src.services.watermarks import conditional_on_user, touch_users
+import click
+import json
+import time
 
 notification_bp = Blueprint('notification', __name__)
 
 @notification_bp.route('/', methods=['GET'])
+@conditional_on_user
 def get_notifications():
     """Get all notifications for a user"""
     user_id = request.args.get('user_id')
@@ -20,38 +31,167 @@ def get_notifications():
     unread_only = request.args.get('unread_only', 'false').lower() == 'true'
     notification_type = request.args.get('type')
     
-    # Build query
-    query = Notification.query.filter_by(user_id=user_id)
+    try:
+        limit = parse_limit(request.args)
+        before = request.args.get('before')
+        if before:
+            created_at, last_id = decode_keyset_cursor(before)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Build one query that also brings the item details along
+    query = db.session.query(Notification, WishlistItem.name, WishlistItem.image_url).outerjoin(
+        WishlistItem, WishlistItem.id == Notification.item_id
+    ).filter(Notification.user_id == user_id)
     
     if unread_only:
-        query = query.filter_by(is_read=False)
+        query = query.filter(Notification.is_read.is_(False))
     
     if notification_type:
-        query = query.filter_by(type=notification_type)
+        query = query.filter(Notification.type == notification_type)
+    
+    # Continue after the last notification of the previous page
+    if before:
+        query = query.filter(
+            Notification.created_at <= created_at,
+            or_(Notification.created_at < created_at,
+                and_(Notification.created_at == created_at, Notification.id < last_id))
+        )
     
     # Execute query with ordering by most recent first
-    notifications = query.order_by(Notification.created_at.desc()).all()
+    query = query.order_by(Notification.created_at.desc(), Notification.id.desc())
+    rows = query.limit(limit + 1).all() if limit else query.all()
+    
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0].created_at, rows[-1][0].id)
     
     # Prepare response with item details
     result = []
-    for notification in notifications:
+    for notification, item_name, item_image in rows:
         notif_dict = notification.to_dict()
-        item = WishlistItem.query.get(notification.item_id)
-        if item:
-            notif_dict['item_name'] = item.name
-            notif_dict['item_image'] = item.image_url
+        if item_name is not None:
+            notif_dict['item_name'] = item_name
+            notif_dict['item_image'] = item_image
         result.append(notif_dict)
     
     return jsonify({
-        'notifications': result
+        'notifications': result,
+        'next_cursor': next_cursor
     }), 200
 
+@notification_bp.route('/archive', methods=['GET'])
+def get_archived_notifications():
+    """Get the archived notifications of a user, most recent first"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    try:
+        limit = parse_limit(request.args, default=DEFAULT_LIMIT)
+        before = request.args.get('before')
+        if before:
+            created_at, last_id = decode_keyset_cursor(before)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query = ArchivedNotification.query.filter(ArchivedNotification.user_id == user_id)
+    
+    notification_type = request.args.get('type')
+    if notification_type:
+        query = query.filter(ArchivedNotification.type == notification_type)
+    
+    # Continue after the last notification of the previous page
+    if before:
+        query = query.filter(
+            ArchivedNotification.created_at <= created_at,
+            or_(ArchivedNotification.created_at < created_at,
+                and_(ArchivedNotification.created_at == created_at, ArchivedNotification.id < last_id))
+        )
+    
+    query = query.order_by(ArchivedNotification.created_at.desc(), ArchivedNotification.id.desc())
+    notifications = query.limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(notifications) > limit:
+        notifications = notifications[:limit]
+        next_cursor = encode_cursor(notifications[-1].created_at, notifications[-1].id)
+    
+    return jsonify({
+        'notifications': [notification.to_dict() for notification in notifications],
+        'next_cursor': next_cursor
+    }), 200
+
+@notification_bp.route('/unread-count', methods=['GET'])
+def get_unread_count():
+    """Get the number of unread notifications for a user"""
+    user_id = request.args.get('user_id', type=int)
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    return jsonify({
+        'user_id': user_id,
+        'unread_count': unread_count(user_id)
+    }), 200
+
+@notification_bp.route('/stream', methods=['GET'])
+def stream_notifications():
+    """Push new notifications for a user as Server-Sent Events"""
+    user_id = request.args.get('user_id', type=int)
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    # Resume after the last event the client saw, if it is reconnecting
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    heartbeat = current_app.config.get('NOTIFICATION_STREAM_HEARTBEAT', 15)
+    subscription = get_broker().subscribe(user_id, last_event_id)
+
+    def generate():
+        try:
+            yield f'retry: {int(heartbeat * 1000)}\n\n'
+            while not getattr(subscription, 'closed', False):
+                events = subscription.get(timeout=heartbeat)
+                if not events:
+                    # Comment line keeps proxies from timing out idle connections
+                    yield ': heartbeat\n\n'
+                    continue
+                for event_id, payload in events:
+                    yield f'id: {event_id}\nevent: notification\ndata: {json.dumps(payload)}\n\n'
+        finally:
+            subscription.close()
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @notification_bp.route('/<int:notification_id>/read', methods=['PUT'])
 def mark_as_read(notification_id):
     """Mark a notification as read"""
     notification = Notification.query.get_or_404(notification_id)
     
-    notification.is_read = True
+    if not notification.is_read:
+        notification.is_read = True
+        adjust_unread({notification.user_id: -1})
     db.session.commit()
     
     return jsonify({
@@ -62,21 +202,25 @@ def mark_as_read(notification_id):
 @notification_bp.route('/read-all', methods=['PUT'])
 def mark_all_as_read():
     """Mark all notifications as read for a user"""
-    user_id = request.args.get('user_id')
+    user_id = request.args.get('user_id', type=int)
     
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
     
-    # Update all unread notifications for the user
-    notifications = Notification.query.filter_by(user_id=user_id, is_read=False).all()
-    
-    for notification in notifications:
-        notification.is_read = True
-    
+    # Update all unread notifications for the user in a single statement
+    result = db.session.execute(
+        update(Notification)
+        .where(Notification.user_id == user_id, Notification.is_read.is_(False))
+        .values(is_read=True)
+        .execution_options(synchronize_session=False)
+    )
+    adjust_unread({user_id: -result.rowcount})
+    touch_users([user_id])
     db.session.commit()
     
     return jsonify({
-        'message': f'Marked {len(notifications)} notifications as read'
+        'message': f'Marked {result.rowcount} notifications as read',
+        'count': result.rowcount
     }), 200
 
 @notification_bp.route('/<int:notification_id>', methods=['DELETE'])
@@ -84,9 +228,51 @@ def delete_notification(notification_id):
     """Delete a notification"""
     notification = Notification.query.get_or_404(notification_id)
     
+    if not notification.is_read:
+        adjust_unread({notification.user_id: -1})
     db.session.delete(notification)
     db.session.commit()
     
     return jsonify({
         'message': 'Notification deleted successfully'
     }), 200
+
+@notification_bp.cli.command('reconcile-counters')
+@click.option('--chunk-size', type=int, default=500, show_default=True)
+def reconcile_counters_command(chunk_size):
+    """Recount unread notifications and repair drifted counters"""
+    repaired = reconcile_unread_counts(chunk_size)
+    click.echo(f'Repaired {repaired} unread counters')
+
+@notification_bp.route('/outbox', methods=['GET'])
+def get_outbox_stats():
+    """Get the backlog of the notification outbox"""
+    return jsonify(outbox_stats()), 200
+
+@notification_bp.cli.command('drain-outbox')
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, show_default=True, help='Attempts before an event is marked failed')
+@click.option('--loop', is_flag=True, help='Keep polling for new events instead of exiting when the outbox is drained')
+@click.option('--interval', type=float, default=1.0, show_default=True, help='Seconds to wait between polls of an empty outbox')
+def drain_outbox_command(batch_size, max_attempts, loop, interval):
+    """Deliver notifications queued in the outbox, retrying failures with backoff"""
+    totals = {'processed': 0, 'retried': 0, 'failed': 0}
+    while True:
+        summary = drain_outbox(batch_size, max_attempts)
+        for key, value in summary.items():
+            totals[key] += value
+        if sum(summary.values()) < batch_size:
+            if not loop:
+                break
+            time.sleep(interval)
+    click.echo(json.dumps(totals))
+
+@notification_bp.cli.command('apply-retention')
+@click.option('--archive-after-days', type=int, help='Archive read notifications older than this; defaults to NOTIFICATION_ARCHIVE_AFTER_DAYS')
+@click.option('--delete-after-days', type=int, help='Delete notifications older than this; defaults to NOTIFICATION_DELETE_AFTER_DAYS')
+@click.option('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option('--pause', type=float, default=0, show_default=True, help='Seconds to wait between chunks')
+def apply_retention_command(archive_after_days, delete_after_days, chunk_size, pause):
+    """Archive and delete old notifications in small batches"""
+    summary = apply_retention(archive_after_days, delete_after_days, chunk_size, pause)
+    click.echo(json.dumps(summary))
@@ -1,6 +1,16 @@
-from flask import Blueprint, request, jsonify
-from src.models.models import db, WishlistItem, PriceHistory, Notification, User
-from datetime import datetime
+from flask import Blueprint, request, jsonify, current_app
+from src.models.models import db, WishlistItem, User
+from src.services.pricing import apply_price, mark_checked, extend_runs, record_history, ingest_prices, parse_drop_args, find_price_drops, DEFAULT_CHUNK_SIZE
+from src.services.alerts import AlertIndex
+from src.services.notifications import notify
+from src.services.rollups import parse_history_args, query_history, rebuild_rollups
+from src.services.pagination import parse_limit, DEFAULT_LIMIT
+from src.services.analytics import compute_price_analytics, DEFAULT_WINDOW
+from src.services.feed_import import open_feed, read_feed, import_feed, feed_format_for, FEED_FORMATS
+from src.services.refresher import PriceRefresher, staleness_stats
+from src.services.watermarks import conditional_on_user
+import click
+import json
 
 price_bp = Blueprint('price', __name__)
 
@@ -14,37 +24,20 @@ def update_price(item_id):
         return jsonify({'error': 'Price is required'}), 400
     
     new_price = float(data['price'])
-    old_price = item.current_price
     
     # Only update if price is different
-    if old_price != new_price:
-        # Create price history entry
-        price_history = PriceHistory(
-            price=new_price,
-            item_id=item.id
-        )
-        db.session.add(price_history)
-        
-        # Update item price
-        item.current_price = new_price
+    if item.current_price != new_price:
+        old_lowest = item.lowest_price
+        old_price = apply_price(item, new_price)
         
-        # Update lowest and highest prices if needed
-        if item.lowest_price is None or new_price < item.lowest_price:
-            item.lowest_price = new_price
-        
-        if item.highest_price is None or new_price > item.highest_price:
-            item.highest_price = new_price
+        # Create price history entry
+        price_history = record_history(item.id, new_price)
         
-        # Create notification if price dropped
-        if old_price and new_price < old_price:
-            drop_percentage = ((old_price - new_price) / old_price) * 100
-            notification = Notification(
-                type='price_drop',
-                message=f"Price dropped by {drop_percentage:.2f}% on {item.name}",
-                user_id=item.user_id,
-                item_id=item.id
-            )
-            db.session.add(notification)
+        # Create notifications for the alert rules this change matches
+        alerts = AlertIndex.for_items([item])
+        for notification_type, message in alerts.evaluate(item, old_price, new_price, old_lowest):
+            notify(item.user_id, item.id, notification_type, message,
+                   reference_price=old_price, price=new_price, item_name=item.name)
         
         db.session.commit()
         
@@ -54,50 +47,219 @@ def update_price(item_id):
             'price_history': price_history.to_dict()
         }), 200
     
+    # Record the re-check by extending the current run of this price
+    mark_checked([item.id])
+    extend_runs([item.id])
+    db.session.commit()
+    
     return jsonify({
         'message': 'Price unchanged',
         'item': item.to_dict()
     }), 200
 
+@price_bp.route('/update', methods=['POST'])
+def update_prices():
+    """Update the prices of many items in one request"""
+    if request.mimetype == 'application/x-ndjson':
+        observations = _read_ndjson(request.stream)
+    else:
+        data = request.get_json()
+        if isinstance(data, dict):
+            data = data.get('prices')
+        if not isinstance(data, list):
+            return jsonify({'error': 'A list of {item_id, price} objects is required'}), 400
+        observations = data
+    
+    chunk_size = request.args.get('chunk_size', type=int) or current_app.config.get('PRICE_BATCH_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    if chunk_size < 1:
+        return jsonify({'error': 'chunk_size must be positive'}), 400
+    
+    results = list(ingest_prices(observations, chunk_size))
+    
+    summary = {'updated': 0, 'unchanged': 0, 'not_found': 0, 'invalid': 0}
+    for result in results:
+        summary[result['status']] += 1
+    
+    return jsonify({
+        'message': f'Processed {len(results)} price updates',
+        'summary': summary,
+        'results': results
+    }), 200
+
+def _read_ndjson(stream):
+    """Yield one decoded object per non-empty line of an NDJSON stream"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {}
+
+@price_bp.route('/import-feed', methods=['POST'])
+def import_price_feed():
+    """Import a retailer price feed (CSV or NDJSON, optionally gzipped) matched by item URL"""
+    feed_format = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'ndjson')
+    if feed_format not in FEED_FORMATS:
+        return jsonify({'error': f"Invalid format. Must be one of: {list(FEED_FORMATS)}"}), 400
+    
+    chunk_size = request.args.get('chunk_size', type=int) or current_app.config.get('PRICE_BATCH_CHUNK_SIZE', DEFAULT_CHUNK_SIZE)
+    if chunk_size < 1:
+        return jsonify({'error': 'chunk_size must be positive'}), 400
+    
+    rows = read_feed(
+        open_feed(request.stream),
+        feed_format,
+        url_field=request.args.get('url_field', 'url'),
+        price_field=request.args.get('price_field', 'price')
+    )
+    summary = import_feed(rows, chunk_size)
+    
+    return jsonify({
+        'message': f"Imported {summary['rows']} feed rows",
+        'summary': summary
+    }), 200
+
+@price_bp.cli.command('import-feed')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'feed_format', type=click.Choice(FEED_FORMATS), help='Defaults to the file extension')
+@click.option('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, show_default=True)
+@click.option('--url-field', default='url', show_default=True)
+@click.option('--price-field', default='price', show_default=True)
+def import_feed_command(path, feed_format, chunk_size, url_field, price_field):
+    """Import a retailer price feed file matched by item URL"""
+    feed_format = feed_format or feed_format_for(path)
+    if feed_format is None:
+        raise click.UsageError('Cannot infer the feed format, pass --format')
+    
+    with open(path, 'rb') as stream:
+        rows = read_feed(open_feed(stream), feed_format, url_field, price_field)
+        summary = import_feed(rows, chunk_size)
+    
+    click.echo(json.dumps(summary))
+
+@price_bp.cli.command('refresh')
+@click.option('--workers', type=int, default=8, show_default=True)
+@click.option('--per-domain', type=int, default=2, show_default=True, help='Concurrent requests per domain')
+@click.option('--interval', type=float, default=1.0, show_default=True, help='Seconds between requests to one domain')
+@click.option('--timeout', type=float, default=10, show_default=True)
+@click.option('--stale-after', type=int, help='Only refresh items not checked for this many seconds')
+@click.option('--limit', type=int, help='Refresh at most this many items')
+@click.option('--batch-size', type=int, default=DEFAULT_CHUNK_SIZE, show_default=True)
+def refresh_prices_command(workers, per_domain, interval, timeout, stale_after, limit, batch_size):
+    """Fetch item pages and update their prices"""
+    refresher = PriceRefresher(
+        workers=workers,
+        per_domain_concurrency=per_domain,
+        per_domain_interval=interval,
+        timeout=timeout,
+        batch_size=batch_size
+    )
+    stats = refresher.run(stale_after=stale_after, limit=limit)
+    click.echo(json.dumps(stats.to_dict()))
+
+@price_bp.route('/staleness', methods=['GET'])
+def get_price_staleness():
+    """Get how long ago tracked item prices were last observed"""
+    return jsonify({
+        'staleness': staleness_stats()
+    }), 200
+
 @price_bp.route('/history/<int:item_id>', methods=['GET'])
 def get_price_history(item_id):
     """Get price history for a specific item"""
     item = WishlistItem.query.get_or_404(item_id)
     
-    # Get price history
-    history = PriceHistory.query.filter_by(item_id=item_id).order_by(PriceHistory.recorded_at.desc()).all()
+    # Get raw price history or the requested rollup tier, one page at a time
+    try:
+        resolution, start, end = parse_history_args(request.args)
+        limit = parse_limit(request.args, default=DEFAULT_LIMIT)
+        history, next_cursor = query_history(item_id, resolution, start, end,
+                                             limit=limit, after=request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'item': item.to_dict(),
-        'price_history': [h.to_dict() for h in history]
+        'resolution': resolution,
+        'price_history': history,
+        'next_cursor': next_cursor
     }), 200
 
+@price_bp.route('/rollups/rebuild', methods=['POST'])
+def rebuild_price_rollups():
+    """Rebuild price rollups from the raw history for one item or all items"""
+    item_id = request.args.get('item_id', type=int)
+    
+    if item_id:
+        WishlistItem.query.get_or_404(item_id)
+        rebuilt = rebuild_rollups([item_id])
+    else:
+        rebuilt = rebuild_rollups()
+    
+    return jsonify({
+        'message': f'Rebuilt price rollups for {rebuilt} items'
+    }), 200
+
+@price_bp.cli.command('rebuild-rollups')
+@click.option('--item-id', type=int, multiple=True, help='Only rebuild these items')
+def rebuild_rollups_command(item_id):
+    """Rebuild price rollups from the raw price history"""
+    rebuilt = rebuild_rollups(list(item_id) or None)
+    click.echo(f'Rebuilt price rollups for {rebuilt} items')
+
 @price_bp.route('/drops', methods=['GET'])
+@conditional_on_user
 def get_price_drops():
-    """Get all items with price drops for a user"""
+    """Get items with price drops for a user, or the biggest drops across all users"""
     user_id = request.args.get('user_id')
+    all_users = request.args.get('all_users', 'false').lower() == 'true'
     
-    if not user_id:
+    if not user_id and not all_users:
         return jsonify({'error': 'User ID is required'}), 400
     
+    try:
+        sort, min_pct = parse_drop_args(request.args)
+        # The cross-user mode is always a bounded top-K query
+        limit = parse_limit(request.args, default=DEFAULT_LIMIT if all_users else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if all_users:
+        return jsonify({
+            'price_drops': find_price_drops(None, sort, min_pct, limit)
+        }), 200
+    
     # Verify user exists
     user = User.query.get(user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
     
-    # Get all items for user
-    items = WishlistItem.query.filter_by(user_id=user_id).all()
+    return jsonify({
+        'price_drops': find_price_drops(user.id, sort, min_pct, limit)
+    }), 200
+
+@price_bp.route('/analytics', methods=['GET'])
+def get_price_analytics():
+    """Get price metrics for every item of a user"""
+    user_id = request.args.get('user_id')
     
-    # Filter items with price drops
-    price_drops = []
-    for item in items:
-        if item.has_price_drop():
-            item_dict = item.to_dict()
-            item_dict['price_drop_percentage'] = item.price_drop_percentage()
-            price_drops.append(item_dict)
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    window = request.args.get('window', DEFAULT_WINDOW, type=int)
+    if window < 1:
+        return jsonify({'error': 'window must be positive'}), 400
     
     return jsonify({
-        'price_drops': price_drops
+        'window': window,
+        'analytics': compute_price_analytics(user.id, window)
     }), 200
 
 @price_bp.route('/simulate-drop/<int:item_id>', methods=['POST'])
@@ -112,31 +274,20 @@ def simulate_price_drop(item_id):
         return jsonify({'error': 'Item has no current price'}), 400
     
     # Calculate new price with drop
-    old_price = item.current_price
-    new_price = old_price * (1 - (drop_percentage / 100))
+    old_lowest = item.lowest_price
+    new_price = item.current_price * (1 - (drop_percentage / 100))
     
     # Create price history entry
-    price_history = PriceHistory(
-        price=new_price,
-        item_id=item.id
-    )
-    db.session.add(price_history)
+    record_history(item.id, new_price)
     
     # Update item price
-    item.current_price = new_price
-    
-    # Update lowest price if needed
-    if item.lowest_price is None or new_price < item.lowest_price:
-        item.lowest_price = new_price
-    
-    # Create notification
-    notification = Notification(
-        type='price_drop',
-        message=f"Price dropped by {drop_percentage:.2f}% on {item.name}",
-        user_id=item.user_id,
-        item_id=item.id
-    )
-    db.session.add(notification)
+    old_price = apply_price(item, new_price)
+    
+    # Create notifications for the alert rules this drop matches
+    alerts = AlertIndex.for_items([item])
+    for notification_type, message in alerts.evaluate(item, old_price, new_price, old_lowest):
+        notify(item.user_id, item.id, notification_type, message,
+               reference_price=old_price, price=new_price, item_name=item.name)
     
     db.session.commit()
     
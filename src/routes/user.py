@@ -40,6 +40,9 @@ def update_user(user_id):
             return jsonify({'error': 'Email already exists'}), 409
         user.email = data['email']
     
+    if 'notification_digest' in data:
+        user.notification_digest = bool(data['notification_digest'])
+    
     db.session.commit()
     
     return jsonify({
@@ -1,10 +1,23 @@
 from flask import Blueprint, request, jsonify
 from src.models.models import db, WishlistItem, Category, User, PriceHistory
+from src.services.pricing import apply_price, record_history, parse_drop_args, find_price_drops, recompute_price_drops
+from src.services.rollups import parse_embed, parse_history_args, query_history, summarize_history
+from src.services.pagination import DEFAULT_LIMIT, parse_limit, encode_cursor, decode_cursor, cursor_value
+from src.services.search import search_items, rebuild_search_index
+from src.services.bulk import apply_bulk, BulkError, MAX_BULK_OPERATIONS
+from src.services.alerts import AlertIndex
+from src.services.notifications import notify
+from src.services.items import parse_fields, parse_item_sort, list_items
+from src.services.watermarks import conditional_on_user
+from src.services.summary import wishlist_summary
+from src.services.schema import upgrade_schema
 from datetime import datetime
+import click
 
 wishlist_bp = Blueprint('wishlist', __name__)
 
 @wishlist_bp.route('/', methods=['GET'])
+@conditional_on_user
 def get_all_items():
     """Get all wishlist items for a user"""
     user_id = request.args.get('user_id')
@@ -22,24 +35,89 @@ def get_all_items():
     priority = request.args.get('priority')
     is_purchased = request.args.get('is_purchased')
     
-    # Build query
-    query = WishlistItem.query.filter_by(user_id=user_id)
-    
+    filters = {}
     if category_id:
-        query = query.filter_by(category_id=category_id)
+        filters['category_id'] = category_id
     
     if priority is not None:
-        query = query.filter_by(priority=int(priority))
+        filters['priority'] = int(priority)
     
     if is_purchased is not None:
-        is_purchased_bool = is_purchased.lower() == 'true'
-        query = query.filter_by(is_purchased=is_purchased_bool)
+        filters['is_purchased'] = is_purchased.lower() == 'true'
     
-    # Execute query
-    items = query.all()
+    try:
+        fields = parse_fields(request.args)
+        sort, descending = parse_item_sort(request.args)
+        limit = parse_limit(request.args)
+        items, next_cursor = list_items(user.id, filters, fields, sort, descending,
+                                        limit=limit, after=request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
-        'items': [item.to_dict() for item in items]
+        'items': items,
+        'next_cursor': next_cursor
+    }), 200
+
+@wishlist_bp.route('/summary', methods=['GET'])
+@conditional_on_user
+def get_summary():
+    """Get dashboard counts and totals for a user's wishlist"""
+    user_id = request.args.get('user_id')
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    return jsonify({
+        'summary': wishlist_summary(user.id)
+    }), 200
+
+@wishlist_bp.route('/search', methods=['GET'])
+def search_wishlist():
+    """Search the name and description of a user's items, best matches first"""
+    user_id = request.args.get('user_id')
+    query = request.args.get('q', '').strip()
+    
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    
+    if not query:
+        return jsonify({'error': 'Search query is required'}), 400
+    
+    # Verify user exists
+    user = User.query.get(user_id)
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    try:
+        limit = parse_limit(request.args, default=DEFAULT_LIMIT)
+        after = request.args.get('after')
+        (offset,) = decode_cursor(after, 1) if after else (0,)
+        if cursor_value(offset, int) < 0:
+            raise ValueError('Invalid cursor')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Fetch one extra match to know whether another page follows
+    matches = search_items(user.id, query, limit + 1, offset)
+    next_cursor = encode_cursor(offset + limit) if len(matches) > limit else None
+    matches = matches[:limit]
+    
+    items = {item.id: item for item in WishlistItem.query.filter(WishlistItem.id.in_([item_id for item_id, _ in matches]))}
+    results = []
+    for item_id, score in matches:
+        item_dict = items[item_id].to_dict()
+        item_dict['score'] = round(float(score), 4)
+        results.append(item_dict)
+    
+    return jsonify({
+        'items': results,
+        'next_cursor': next_cursor
     }), 200
 
 @wishlist_bp.route('/<int:item_id>', methods=['GET'])
@@ -47,11 +125,22 @@ def get_item(item_id):
     """Get a specific wishlist item by ID"""
     item = WishlistItem.query.get_or_404(item_id)
     
-    # Get price history
-    price_history = PriceHistory.query.filter_by(item_id=item_id).order_by(PriceHistory.recorded_at.desc()).all()
-    
-    item_data = item.to_dict()
-    item_data['price_history'] = [ph.to_dict() for ph in price_history]
+    try:
+        embed, count = parse_embed(request.args)
+        resolution, start, end = parse_history_args(request.args)
+        limit = count if embed == 'latest' else parse_limit(request.args, default=DEFAULT_LIMIT)
+        
+        item_data = item.to_dict()
+        if embed == 'summary':
+            # Aggregated in SQL without loading the rows
+            item_data['price_history_summary'] = summarize_history(item_id, start, end)
+        elif embed in ('latest', 'full'):
+            history, next_cursor = query_history(item_id, resolution, start, end,
+                                                 limit=limit, after=request.args.get('after'))
+            item_data['price_history'] = history
+            item_data['price_history_next_cursor'] = next_cursor
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'item': item_data
@@ -94,22 +183,45 @@ def create_item():
     )
     
     db.session.add(new_item)
-    db.session.commit()
     
-    # Add price history entry if price is provided
+    # Add price history entry if price is provided, in the same commit
     if data.get('current_price'):
-        price_history = PriceHistory(
-            price=data['current_price'],
-            item_id=new_item.id
-        )
-        db.session.add(price_history)
-        db.session.commit()
+        db.session.flush()
+        record_history(new_item.id, data['current_price'])
+    
+    db.session.commit()
     
     return jsonify({
         'message': 'Item added to wishlist successfully',
         'item': new_item.to_dict()
     }), 201
 
+@wishlist_bp.route('/bulk', methods=['POST'])
+def bulk_items():
+    """Create, update and delete many wishlist items in one request"""
+    data = request.get_json()
+    operations = data.get('operations') if isinstance(data, dict) else None
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'A list of operations is required'}), 400
+    
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({'error': f'At most {MAX_BULK_OPERATIONS} operations per request'}), 400
+    
+    mode = data.get('mode', 'atomic')
+    if mode not in ('atomic', 'best_effort'):
+        return jsonify({'error': "Invalid mode. Must be one of: ['atomic', 'best_effort']"}), 400
+    
+    try:
+        results = apply_bulk(operations, atomic=mode == 'atomic')
+    except BulkError as e:
+        return jsonify({'error': str(e), 'results': e.results}), 400
+    
+    return jsonify({
+        'message': f"Applied {sum(1 for r in results if r['status'] != 'error')} of {len(results)} operations",
+        'results': results
+    }), 200
+
 @wishlist_bp.route('/<int:item_id>', methods=['PUT'])
 def update_item(item_id):
     """Update an existing wishlist item"""
@@ -146,26 +258,21 @@ def update_item(item_id):
     
     # Handle price update
     if 'current_price' in data and data['current_price'] is not None:
-        old_price = item.current_price
         new_price = data['current_price']
         
         # Update price only if it's different
-        if old_price != new_price:
-            item.current_price = new_price
-            
-            # Update lowest and highest prices if needed
-            if item.lowest_price is None or new_price < item.lowest_price:
-                item.lowest_price = new_price
-            
-            if item.highest_price is None or new_price > item.highest_price:
-                item.highest_price = new_price
+        if item.current_price != new_price:
+            old_lowest = item.lowest_price
+            old_price = apply_price(item, new_price)
             
             # Add price history entry
-            price_history = PriceHistory(
-                price=new_price,
-                item_id=item.id
-            )
-            db.session.add(price_history)
+            record_history(item.id, new_price)
+            
+            # Notify for the alert rules this change matches, in the same commit
+            alerts = AlertIndex.for_items([item])
+            for notification_type, message in alerts.evaluate(item, old_price, new_price, old_lowest):
+                notify(item.user_id, item.id, notification_type, message,
+                       reference_price=old_price, price=new_price, item_name=item.name)
     
     db.session.commit()
     
@@ -194,17 +301,42 @@ def get_price_drops():
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
     
-    # Get all items for user
-    items = WishlistItem.query.filter_by(user_id=user_id).all()
+    if not user_id.isdigit():
+        return jsonify({'error': 'User ID must be an integer'}), 400
     
-    # Filter items with price drops
-    price_drops = [item.to_dict() for item in items if item.has_price_drop()]
+    try:
+        sort, min_pct = parse_drop_args(request.args)
+        limit = parse_limit(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Add price drop percentage
-    for item_dict in price_drops:
-        item = next(item for item in items if item.id == item_dict['id'])
-        item_dict['price_drop_percentage'] = item.price_drop_percentage()
+    # Drop detection, filtering and ordering all happen in the query
+    price_drops = find_price_drops(int(user_id), sort, min_pct, limit)
     
     return jsonify({
         'price_drops': price_drops
     }), 200
+
+@wishlist_bp.cli.command('recompute-price-drops')
+def recompute_price_drops_command():
+    """Backfill the stored price drop percentage of every item"""
+    updated = recompute_price_drops()
+    click.echo(f'Recomputed price drops for {updated} items')
+
+@wishlist_bp.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from the items table"""
+    backend = rebuild_search_index()
+    click.echo(f'Rebuilt the {backend} search index')
+
+@wishlist_bp.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    """Add the tables, columns and indexes an existing database is missing"""
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(change)
+    # A freshly added drop percentage is 0 until it is computed from the prices
+    if 'added column wishlist_item.price_drop_pct' in changes:
+        click.echo(f'Recomputed price drops for {recompute_price_drops()} items')
+    if not changes:
+        click.echo('The schema is up to date')
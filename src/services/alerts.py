@@ -0,0 +1,99 @@
+from bisect import bisect_right
+from src.models.models import AlertRule, AlertRuleType
+
+def drop_percentage(old_price, new_price):
+    """Percentage drop from old_price to new_price, or None if the price did not drop"""
+    if old_price and new_price < old_price:
+        return ((old_price - new_price) / old_price) * 100
+    return None
+
+def price_drop_message(item, percentage):
+    return f"Price dropped by {percentage:.2f}% on {item.name}"
+
+class _ThresholdIndex:
+    """Rules of one type for one scope, sorted by threshold for bisection"""
+
+    def __init__(self):
+        self.thresholds = []
+        self.rules = []
+
+    def add(self, rule):
+        position = bisect_right(self.thresholds, rule.threshold)
+        self.thresholds.insert(position, rule.threshold)
+        self.rules.insert(position, rule)
+
+    def between(self, low, high):
+        """Rules with low < threshold <= high"""
+        start = bisect_right(self.thresholds, low)
+        end = len(self.thresholds) if high is None else bisect_right(self.thresholds, high)
+        return self.rules[start:end]
+
+    def at_most(self, value):
+        """Rules with threshold <= value"""
+        return self.rules[:bisect_right(self.thresholds, value)]
+
+class AlertIndex:
+    """Active alert rules for a set of items, indexed for batch evaluation.
+    
+    Rules are grouped by scope (one item, or all items of a user) and type;
+    threshold rules are kept sorted so each price update finds its matching
+    rules by bisection, in O(log n + matches) rather than scanning every rule.
+    Items whose owner has no rules at all, active or not, keep the default
+    behaviour of a notification on every price drop.
+    """
+
+    def __init__(self, rules):
+        self._below = {}
+        self._drop = {}
+        self._all_time_low = {}
+        self._users_with_rules = set()
+        for rule in rules:
+            self._users_with_rules.add(rule.user_id)
+            # Inactive rules still mean the user opted out of the default
+            if not rule.is_active:
+                continue
+            scope = ('item', rule.item_id) if rule.item_id else ('user', rule.user_id)
+            if rule.rule_type == AlertRuleType.ALL_TIME_LOW:
+                self._all_time_low.setdefault(scope, []).append(rule)
+            elif rule.threshold is not None:
+                target = self._below if rule.rule_type == AlertRuleType.BELOW else self._drop
+                target.setdefault(scope, _ThresholdIndex()).add(rule)
+
+    @classmethod
+    def for_items(cls, items):
+        """Load every rule of the items' owners with one query"""
+        user_ids = {item.user_id for item in items}
+        if not user_ids:
+            return cls([])
+        # All of a user's rules are needed to know whether they have any
+        rules = AlertRule.query.filter(AlertRule.user_id.in_(user_ids)).all()
+        return cls(rules)
+
+    def evaluate(self, item, old_price, new_price, old_lowest):
+        """Notifications to send for a price change, as (type, message) pairs"""
+        percentage = drop_percentage(old_price, new_price)
+        
+        if item.user_id not in self._users_with_rules:
+            if percentage is None:
+                return []
+            return [('price_drop', price_drop_message(item, percentage))]
+        
+        scopes = (('item', item.id), ('user', item.user_id))
+        notifications = []
+        
+        # A target fires when the price crosses it: new_price < target <= old_price
+        below = [rule for scope in scopes if scope in self._below
+                 for rule in self._below[scope].between(new_price, old_price)]
+        if below:
+            target = min(rule.threshold for rule in below)
+            notifications.append(('price_target', f"{item.name} is now {new_price:.2f}, below your target of {target:.2f}"))
+        
+        if percentage is not None:
+            if any(self._drop[scope].at_most(percentage) for scope in scopes if scope in self._drop):
+                notifications.append(('price_drop', price_drop_message(item, percentage)))
+        
+        if old_lowest is not None and new_price < old_lowest:
+            if any(scope in self._all_time_low for scope in scopes):
+                notifications.append(('all_time_low', f"New all-time low for {item.name}: {new_price:.2f}"))
+        
+        return notifications
@@ -0,0 +1,101 @@
+from sqlalchemy import select, func
+from src.models.models import db, WishlistItem, PriceHistory
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+DEFAULT_WINDOW = 7
+
+def _fetch_history(user_id):
+    """Price history runs for every item of a user as one item_id/price/recorded_at/observations frame.
+    
+    Rows stay run-length encoded; the metrics weigh each run by its number of
+    observations instead of expanding it.
+    """
+    statement = select(
+        PriceHistory.item_id, PriceHistory.price, PriceHistory.recorded_at,
+        func.coalesce(PriceHistory.observation_count, 1)
+    ).join(WishlistItem, WishlistItem.id == PriceHistory.item_id).where(
+        WishlistItem.user_id == user_id
+    ).order_by(PriceHistory.item_id, PriceHistory.recorded_at, PriceHistory.id)
+    
+    rows = db.session.execute(statement).all()
+    return pd.DataFrame(rows, columns=['item_id', 'price', 'recorded_at', 'observations'])
+
+def _fetch_items(user_id):
+    statement = select(
+        WishlistItem.id, WishlistItem.name, WishlistItem.current_price
+    ).where(WishlistItem.user_id == user_id).order_by(WishlistItem.id)
+    
+    rows = db.session.execute(statement).all()
+    return pd.DataFrame(rows, columns=['item_id', 'name', 'current_price']).set_index('item_id')
+
+def compute_price_analytics(user_id, window=DEFAULT_WINDOW, now=None):
+    """Per-item price metrics for a user's whole wishlist, computed column-wise.
+    
+    Metrics: moving average of the last `window` observations, volatility
+    (standard deviation of price changes, in percent), distance from the
+    all-time low, days since the last drop and a 0-1 likely-to-drop score.
+    """
+    now = now or datetime.utcnow()
+    items = _fetch_items(user_id)
+    history = _fetch_history(user_id)
+    
+    result = items.copy()
+    result['current_price'] = result['current_price'].astype(float)
+    
+    if history.empty:
+        for column in ['observations', 'moving_average', 'volatility', 'all_time_low',
+                       'all_time_low_distance_pct', 'days_since_last_drop', 'likely_to_drop_score']:
+            result[column] = np.nan
+    else:
+        grouped = history.groupby('item_id')['price']
+        weights = history['observations']
+        # Prices only move at the start of a run; the other observations of a run are unchanged re-checks
+        history['change'] = grouped.diff()
+        history['pct_change'] = grouped.pct_change() * 100
+        
+        observations = weights.groupby(history['item_id']).sum()
+        result['observations'] = observations
+        
+        # Moving average of the newest `window` observations, taking whole or partial runs from the end
+        newer = weights.groupby(history['item_id']).transform('sum') - weights.groupby(history['item_id']).cumsum()
+        in_window = (window - newer).clip(lower=0, upper=weights)
+        result['moving_average'] = ((history['price'] * in_window).groupby(history['item_id']).sum()
+                                    / in_window.groupby(history['item_id']).sum())
+        
+        # Population standard deviation over every observation-to-observation change, re-checks counting as 0%
+        changes = (observations - 1).replace(0, np.nan)
+        mean = history['pct_change'].groupby(history['item_id']).sum() / changes
+        mean_square = (history['pct_change'] ** 2).groupby(history['item_id']).sum() / changes
+        result['volatility'] = np.sqrt((mean_square - mean ** 2).clip(lower=0))
+        result['all_time_low'] = grouped.min()
+        all_time_high = grouped.max()
+        
+        # Fall back to the last observation for items without a current price
+        current = result['current_price'].fillna(grouped.last())
+        result['all_time_low_distance_pct'] = (current - result['all_time_low']) / result['all_time_low'] * 100
+        
+        drops = history[history['change'] < 0]
+        last_drop = drops.groupby('item_id')['recorded_at'].max()
+        result['days_since_last_drop'] = (now - last_drop).dt.total_seconds() / 86400
+        
+        # Likely-to-drop score: how often the price has dropped, how close it
+        # sits to its historical high and how much it tends to move
+        drop_rate = (drops.groupby('item_id').size() / changes).reindex(result.index)
+        price_range = (all_time_high - result['all_time_low']).replace(0, np.nan)
+        range_position = ((current - result['all_time_low']) / price_range).clip(0, 1)
+        movement = (result['volatility'] / 10).clip(0, 1)
+        result['likely_to_drop_score'] = (
+            0.4 * drop_rate.fillna(0) + 0.3 * range_position.fillna(0) + 0.3 * movement.fillna(0)
+        ).where(result['observations'].notna())
+    
+    result['observations'] = result['observations'].fillna(0).astype(int)
+    result = result.reset_index().rename(columns={'index': 'item_id'})
+    
+    # Round and convert NaN to None so the frame serializes to plain JSON
+    rounded = result.round({
+        'moving_average': 2, 'volatility': 2, 'all_time_low_distance_pct': 2,
+        'days_since_last_drop': 2, 'likely_to_drop_score': 3
+    }).astype(object)
+    return rounded.where(rounded.notna(), None).to_dict('records')
@@ -0,0 +1,167 @@
+from flask import current_app
+from collections import deque
+import json
+import queue
+import threading
+
+DEFAULT_BUFFER_SIZE = 1000
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+_create_lock = threading.Lock()
+
+class MemorySubscription:
+    """Events for one subscriber of the in-process broker"""
+
+    def __init__(self, broker, user_id, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker
+        self.user_id = user_id
+        self.closed = False
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # A subscriber this far behind is dropped; it resumes from the
+            # replay buffer when it reconnects with Last-Event-ID
+            self.close()
+
+    def get(self, timeout):
+        """Wait up to timeout seconds for events; returns a possibly empty list of (id, payload)"""
+        if self.closed:
+            return []
+        try:
+            events = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker._unsubscribe(self)
+
+class MemoryBroker:
+    """In-process pub/sub broker that fans notification events out to every subscriber of a user.
+    
+    The most recent events of each user are kept so a reconnecting client can
+    resume after its Last-Event-ID. Only shares events within one process; use
+    RedisBroker when several worker processes serve the API.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._history = {}
+        self._subscribers = {}
+
+    def publish(self, user_id, payload):
+        with self._lock:
+            self._sequence += 1
+            event = (str(self._sequence), payload)
+            self._history.setdefault(user_id, deque(maxlen=self.buffer_size)).append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.put(event)
+        return event[0]
+
+    def subscribe(self, user_id, last_event_id=None):
+        # Room for the whole replay buffer, so replaying under the lock never overflows the queue
+        subscription = MemorySubscription(self, user_id, max(SUBSCRIBER_QUEUE_SIZE, self.buffer_size))
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if last_event_id is not None:
+                try:
+                    last = int(last_event_id)
+                except ValueError:
+                    last = None
+                if last is not None:
+                    for event in self._history.get(user_id, ()):
+                        if int(event[0]) > last:
+                            subscription.put(event)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+class RedisSubscription:
+    def __init__(self, client, key, last_event_id):
+        self._client = client
+        self._key = key
+        self._last_id = last_event_id
+
+    def get(self, timeout):
+        response = self._client.xread({self._key: self._last_id}, block=max(int(timeout * 1000), 1), count=100)
+        events = []
+        for _, entries in response or []:
+            for event_id, fields in entries:
+                events.append((event_id, json.loads(fields['data'])))
+                self._last_id = event_id
+        return events
+
+    def close(self):
+        pass
+
+class RedisBroker:
+    """Broker backed by one capped Redis stream per user, shared by every worker process.
+    
+    Stream entry ids double as SSE event ids, so resuming after a
+    Last-Event-ID is a plain XREAD from that id.
+    """
+
+    def __init__(self, url, buffer_size=DEFAULT_BUFFER_SIZE):
+        # Optional dependency, only needed when this backend is configured
+        import redis
+        self.buffer_size = buffer_size
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    @staticmethod
+    def _key(user_id):
+        return f'wishtracker:notifications:{user_id}'
+
+    def publish(self, user_id, payload):
+        return self._client.xadd(
+            self._key(user_id), {'data': json.dumps(payload)},
+            maxlen=self.buffer_size, approximate=True
+        )
+
+    def subscribe(self, user_id, last_event_id=None):
+        key = self._key(user_id)
+        if last_event_id is None:
+            # Start from the newest entry so nothing published after subscribing is missed
+            latest = self._client.xrevrange(key, count=1)
+            last_event_id = latest[0][0] if latest else '0-0'
+        return RedisSubscription(self._client, key, last_event_id)
+
+def create_broker(url, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Build a broker from a URL: memory:// for in-process, redis://... for Redis"""
+    if not url or url.startswith('memory://'):
+        return MemoryBroker(buffer_size)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url, buffer_size)
+    raise ValueError(f'Unsupported notification broker URL: {url}')
+
+def get_broker(app=None):
+    """The notification broker of the current app, created on first use"""
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('notification_broker')
+    if broker is None:
+        with _create_lock:
+            broker = app.extensions.get('notification_broker')
+            if broker is None:
+                broker = create_broker(
+                    app.config.get('NOTIFICATION_BROKER_URL'),
+                    app.config.get('NOTIFICATION_BROKER_BUFFER', DEFAULT_BUFFER_SIZE)
+                )
+                app.extensions['notification_broker'] = broker
+    return broker
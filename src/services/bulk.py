@@ -0,0 +1,194 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from src.models.models import db, WishlistItem, Category, User, PriceHistory
+from src.services.alerts import AlertIndex
+from src.services.notifications import notify_many
+from src.services.pricing import apply_price
+from src.services.rollups import update_rollups
+from datetime import datetime
+
+BULK_OPERATIONS = ('create', 'update', 'delete')
+MAX_BULK_OPERATIONS = 1000
+
+# Fields an update may set directly; prices go through apply_price
+UPDATABLE_FIELDS = ('name', 'description', 'url', 'image_url', 'priority', 'is_purchased', 'category_id')
+
+# JSON types accepted for each item field, None aside
+FIELD_TYPES = {
+    'name': (str,),
+    'description': (str,),
+    'url': (str,),
+    'image_url': (str,),
+    'current_price': (int, float),
+    'priority': (int,),
+    'is_purchased': (bool,),
+    'category_id': (int,),
+}
+FIELD_TYPE_NAMES = {str: 'a string', int: 'an integer', float: 'a number', bool: 'a boolean'}
+
+class BulkError(Exception):
+    """The whole batch was rejected; carries the per-operation results"""
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+def _check(operation):
+    """Shape and field type errors of one operation, or None"""
+    if not isinstance(operation, dict) or operation.get('op') not in BULK_OPERATIONS:
+        return f"op must be one of: {list(BULK_OPERATIONS)}"
+    data = operation.get('item', {})
+    if not isinstance(data, dict):
+        return 'item must be an object'
+    if operation['op'] == 'create':
+        if not data.get('name') or not isinstance(data.get('user_id'), int):
+            return 'Name and user_id are required'
+    elif not isinstance(operation.get('id'), int):
+        return 'id is required'
+    if 'name' in data and not data['name']:
+        return 'name must not be empty'
+    for field, types in FIELD_TYPES.items():
+        value = data.get(field)
+        if value is None:
+            continue
+        # JSON booleans are ints to Python, but only is_purchased takes them
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            return f'{field} must be {FIELD_TYPE_NAMES[types[-1]]}'
+    if data.get('current_price') is not None and data['current_price'] < 0:
+        return 'current_price must not be negative'
+    return None
+
+def _result(index, operation, status, **details):
+    op = operation.get('op') if isinstance(operation, dict) else None
+    return dict({'index': index, 'op': op, 'status': status}, **details)
+
+def apply_bulk(operations, atomic=True):
+    """Apply a mixed list of create/update/delete operations in one transaction.
+    
+    Users, categories and target items are each loaded with one query, new
+    items and every price history row are written in bulk, and alert rules
+    are evaluated once for the whole batch. With atomic=True any invalid
+    operation rejects the batch (raising BulkError); otherwise invalid
+    operations are reported and the rest are applied. Returns the results,
+    one per operation, in order.
+    """
+    results = [None] * len(operations)
+    for index, operation in enumerate(operations):
+        error = _check(operation)
+        if error:
+            results[index] = _result(index, operation, 'error', error=error)
+    
+    valid = [(index, operation) for index, operation in enumerate(operations) if results[index] is None]
+    data_of = lambda operation: operation.get('item', {})
+    
+    # One lookup each for users, categories and existing items
+    user_ids = {data_of(op)['user_id'] for _, op in valid if op['op'] == 'create'}
+    category_ids = {data_of(op)['category_id'] for _, op in valid if data_of(op).get('category_id')}
+    item_ids = {op['id'] for _, op in valid if op['op'] != 'create'}
+    users = {row.id for row in db.session.query(User.id).filter(User.id.in_(user_ids))} if user_ids else set()
+    categories = {row.id for row in db.session.query(Category.id).filter(Category.id.in_(category_ids))} if category_ids else set()
+    items = {item.id: item for item in WishlistItem.query.filter(WishlistItem.id.in_(item_ids))} if item_ids else {}
+    
+    touched = set()
+    for index, operation in valid:
+        data = data_of(operation)
+        error = None
+        if operation['op'] == 'create' and data['user_id'] not in users:
+            error = 'User not found'
+        elif operation['op'] != 'create' and operation['id'] not in items:
+            error = 'Item not found'
+        elif operation['op'] != 'create' and operation['id'] in touched:
+            error = 'Item already changed earlier in this batch'
+        elif data.get('category_id') and data['category_id'] not in categories:
+            error = 'Category not found'
+        if error:
+            results[index] = _result(index, operation, 'error', error=error)
+        elif operation['op'] != 'create':
+            touched.add(operation['id'])
+    
+    errors = sum(1 for result in results if result is not None)
+    if atomic and errors:
+        for index, operation in valid:
+            if results[index] is None:
+                results[index] = _result(index, operation, 'skipped')
+        raise BulkError(f'{errors} operations are invalid, nothing was applied', results)
+    
+    now = datetime.utcnow()
+    created = []
+    price_changes = []
+    for index, operation in enumerate(operations):
+        if results[index] is not None:
+            continue
+        data = data_of(operation)
+        if operation['op'] == 'create':
+            price = data.get('current_price')
+            item = WishlistItem(
+                name=data['name'],
+                description=data.get('description', ''),
+                url=data.get('url', ''),
+                image_url=data.get('image_url', ''),
+                current_price=price,
+                initial_price=price,
+                lowest_price=price,
+                highest_price=price,
+                priority=data.get('priority', 0),
+                user_id=data['user_id'],
+                category_id=data.get('category_id')
+            )
+            db.session.add(item)
+            created.append((index, item))
+        elif operation['op'] == 'update':
+            item = items[operation['id']]
+            for field in UPDATABLE_FIELDS:
+                if field in data:
+                    setattr(item, field, data[field])
+            new_price = data.get('current_price')
+            if new_price is not None and new_price != item.current_price:
+                old_lowest = item.lowest_price
+                old_price = apply_price(item, new_price, now)
+                price_changes.append((item, old_price, new_price, old_lowest))
+            results[index] = _result(index, operation, 'updated', item=item)
+        else:
+            db.session.delete(items[operation['id']])
+            results[index] = _result(index, operation, 'deleted', id=operation['id'])
+    
+    try:
+        # A single flush assigns every new id
+        db.session.flush()
+        
+        history = [(item.id, item.current_price, now) for _, item in created if item.current_price]
+        history += [(item.id, new_price, now) for item, _, new_price, _ in price_changes]
+        if history:
+            db.session.execute(insert(PriceHistory), [
+                {'item_id': item_id, 'price': price, 'recorded_at': recorded_at,
+                 'last_seen': recorded_at, 'observation_count': 1}
+                for item_id, price, recorded_at in history
+            ])
+            update_rollups(history)
+        
+        if price_changes:
+            alerts = AlertIndex.for_items([item for item, _, _, _ in price_changes])
+            notify_many([{
+                'type': notification_type,
+                'message': message,
+                'created_at': now,
+                'user_id': item.user_id,
+                'item_id': item.id,
+                'reference_price': old_price,
+                'price': new_price,
+                'item_name': item.name
+            } for item, old_price, new_price, old_lowest in price_changes
+              for notification_type, message in alerts.evaluate(item, old_price, new_price, old_lowest)])
+        
+        for index, item in created:
+            results[index] = _result(index, operations[index], 'created', item=item)
+        # Serialized before the commit expires the instances, which would reload each one
+        results = [dict(result, item=result['item'].to_dict()) if 'item' in result else result
+                   for result in results]
+        
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    
+    return results
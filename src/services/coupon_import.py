@@ -0,0 +1,174 @@
+from sqlalchemy import insert
+from src.models.models import db, Coupon, CouponStatus, WishlistItem
+from src.services.feed_import import normalize_url
+from src.services.notifications import notify_many
+from src.services.watermarks import touch_items
+from datetime import datetime
+from urllib.parse import urlsplit
+import json
+
+MATCH_FIELDS = ('url', 'url_prefix', 'domain')
+
+def _host(key):
+    return urlsplit(key).netloc
+
+def normalize_domain(domain):
+    """Bare host name of a domain rule such as 'https://www.Shop.com/'"""
+    if not domain:
+        return None
+    domain = domain.strip().lower()
+    if '//' not in domain:
+        domain = f'//{domain}'
+    host = urlsplit(domain).netloc
+    return host[4:] if host.startswith('www.') else host or None
+
+class ItemUrlIndex:
+    """Tracked items by normalized URL, host and parent domain, built in one pass"""
+
+    def __init__(self, rows):
+        self.items = {}
+        self.by_url = {}
+        self.by_host = {}
+        self.by_domain = {}
+        for item_id, url, user_id, name in rows:
+            key = normalize_url(url)
+            if key is None:
+                continue
+            self.items[item_id] = (user_id, name)
+            self.by_url.setdefault(key, []).append(item_id)
+            host = _host(key)
+            self.by_host.setdefault(host, []).append((key, item_id))
+            # Register every parent domain so shop.com also finds eu.shop.com
+            labels = host.split('.')
+            for start in range(len(labels) - 1):
+                self.by_domain.setdefault('.'.join(labels[start:]), []).append(item_id)
+
+    @classmethod
+    def build(cls):
+        return cls(db.session.query(WishlistItem.id, WishlistItem.url, WishlistItem.user_id, WishlistItem.name).filter(
+            WishlistItem.url.isnot(None), WishlistItem.url != ''
+        ))
+
+    def match(self, rule):
+        """Ids of the items a coupon's url, url_prefix or domain rule applies to"""
+        if rule.get('url'):
+            return list(self.by_url.get(normalize_url(rule['url']), ()))
+        if rule.get('url_prefix'):
+            prefix = normalize_url(rule['url_prefix'])
+            if prefix is None:
+                return []
+            # A bare domain prefix normalizes to a trailing '/', which must still match every path
+            prefix = prefix.rstrip('/')
+            return [item_id for key, item_id in self.by_host.get(_host(prefix), ()) if key.startswith(prefix)]
+        if rule.get('domain'):
+            return list(self.by_domain.get(normalize_domain(rule['domain']), ()))
+        return []
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+def _coupon_row(entry, now):
+    """Validated Coupon columns of one import entry; raises ValueError"""
+    if not isinstance(entry, dict) or not entry.get('code'):
+        raise ValueError('code is required')
+    if not any(entry.get(field) for field in MATCH_FIELDS):
+        raise ValueError(f'one of {list(MATCH_FIELDS)} is required')
+    for field in MATCH_FIELDS:
+        if entry.get(field) is not None and not isinstance(entry[field], str):
+            raise ValueError(f'{field} must be a string')
+    discount = entry.get('discount_amount')
+    return {
+        'code': str(entry['code']),
+        'description': entry.get('description'),
+        'discount_amount': float(discount) if discount is not None else None,
+        'is_percentage': bool(entry.get('is_percentage', True)),
+        'status': CouponStatus.ACTIVE,
+        'valid_from': _parse_datetime(entry.get('valid_from')) or now,
+        'valid_until': _parse_datetime(entry.get('valid_until')),
+        'created_at': now
+    }
+
+def import_coupons(entries, url_index=None):
+    """Attach each coupon entry to every tracked item its match rule selects.
+    
+    Target items come from the URL index, codes already on an item are
+    skipped, coupons are bulk inserted and each affected user gets a single
+    notification for the whole import. Returns a summary of counts.
+    """
+    url_index = ItemUrlIndex.build() if url_index is None else url_index
+    now = datetime.utcnow()
+    summary = {'entries': 0, 'invalid': 0, 'unmatched': 0, 'created': 0, 'duplicates': 0, 'users_notified': 0}
+    
+    candidates = {}
+    for entry in entries:
+        summary['entries'] += 1
+        try:
+            row = _coupon_row(entry, now)
+        except (ValueError, TypeError):
+            summary['invalid'] += 1
+            continue
+        item_ids = url_index.match(entry)
+        if not item_ids:
+            summary['unmatched'] += 1
+            continue
+        for item_id in item_ids:
+            if (item_id, row['code']) in candidates:
+                summary['duplicates'] += 1
+            else:
+                candidates[(item_id, row['code'])] = dict(row, item_id=item_id)
+    
+    if not candidates:
+        return summary
+    
+    # Codes already attached to an item are not added again
+    existing = set(db.session.query(Coupon.item_id, Coupon.code).filter(
+        Coupon.item_id.in_({item_id for item_id, _ in candidates}),
+        Coupon.code.in_({code for _, code in candidates})
+    ))
+    rows = [row for key, row in candidates.items() if key not in existing]
+    summary['duplicates'] += len(candidates) - len(rows)
+    if not rows:
+        return summary
+    
+    db.session.execute(insert(Coupon), rows)
+    touch_items(row['item_id'] for row in rows)
+    
+    by_user = {}
+    for row in rows:
+        by_user.setdefault(url_index.items[row['item_id']][0], []).append(row)
+    notify_many([_notification(user_id, user_rows, url_index, now) for user_id, user_rows in by_user.items()])
+    db.session.commit()
+    
+    summary['created'] = len(rows)
+    summary['users_notified'] = len(by_user)
+    return summary
+
+def _notification(user_id, rows, url_index, now):
+    item_ids = {row['item_id'] for row in rows}
+    if len(rows) == 1:
+        row = rows[0]
+        message = f"New coupon available for {url_index.items[row['item_id']][1]}: {row['code']}"
+    else:
+        message = f"{len(rows)} new coupons available for {len(item_ids)} of your wishlist items"
+    return {
+        'type': 'coupon',
+        'message': message,
+        'created_at': now,
+        'user_id': user_id,
+        'item_id': next(iter(item_ids)) if len(item_ids) == 1 else None
+    }
+
+def read_coupon_file(text):
+    """Coupon entries from a JSON array or NDJSON text stream"""
+    content = text.read()
+    if content.lstrip().startswith('['):
+        return json.loads(content)
+    return [_decode_line(line) for line in content.splitlines() if line.strip()]
+
+def _decode_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
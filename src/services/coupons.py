@@ -0,0 +1,170 @@
+from sqlalchemy import update, and_
+from src.models.models import db, Coupon, CouponStatus, WishlistItem
+from src.services.notifications import notify_many
+from src.services.watermarks import touch_items, get_watermark_cache
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_SIZE = 500
+
+def _claim(query, chunk_size):
+    """Lock a chunk of rows for this worker, skipping rows another worker holds"""
+    return query.order_by(Coupon.id).limit(chunk_size).with_for_update(skip_locked=True, of=Coupon).all()
+
+def expire_coupons(now=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Move active coupons whose valid_until has passed to EXPIRED; returns how many.
+    
+    Each chunk is claimed with FOR UPDATE SKIP LOCKED and flipped with one
+    set-based UPDATE that re-checks the status, so concurrent sweepers split
+    the work instead of fighting over it.
+    """
+    now = now or datetime.utcnow()
+    query = db.session.query(Coupon.id, Coupon.item_id).filter(
+        Coupon.status == CouponStatus.ACTIVE, Coupon.valid_until < now
+    )
+    expired = 0
+    while True:
+        rows = _claim(query, chunk_size)
+        ids = [row.id for row in rows]
+        if not ids:
+            return expired
+        result = db.session.execute(
+            update(Coupon)
+            .where(Coupon.id.in_(ids), Coupon.status == CouponStatus.ACTIVE)
+            .values(status=CouponStatus.EXPIRED)
+            .execution_options(synchronize_session=False)
+        )
+        touch_items(row.item_id for row in rows)
+        db.session.commit()
+        expired += result.rowcount
+        if len(ids) < chunk_size:
+            return expired
+
+def notify_expiring_coupons(within, now=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Notify owners of active coupons that expire in the next `within` seconds, once per coupon"""
+    now = now or datetime.utcnow()
+    query = db.session.query(Coupon.id, Coupon.code, Coupon.valid_until, WishlistItem.id.label('item_id'),
+                             WishlistItem.name, WishlistItem.user_id).join(
+        WishlistItem, WishlistItem.id == Coupon.item_id
+    ).filter(
+        Coupon.status == CouponStatus.ACTIVE,
+        Coupon.valid_until >= now,
+        Coupon.valid_until < now + timedelta(seconds=within),
+        Coupon.expiry_notified_at.is_(None)
+    )
+    notified = 0
+    while True:
+        rows = _claim(query, chunk_size)
+        if not rows:
+            return notified
+        db.session.execute(
+            update(Coupon)
+            .where(Coupon.id.in_([row.id for row in rows]))
+            .values(expiry_notified_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        touch_items(row.item_id for row in rows)
+        notify_many([{
+            'type': 'coupon_expiring',
+            'message': f"Coupon {row.code} for {row.name} expires on {row.valid_until:%Y-%m-%d %H:%M}",
+            'user_id': row.user_id,
+            'item_id': row.item_id
+        } for row in rows])
+        db.session.commit()
+        notified += len(rows)
+        if len(rows) < chunk_size:
+            return notified
+
+def sweep_coupons(notify_within=None, now=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Expire past-due coupons, then send the optional expiring-soon notifications"""
+    now = now or datetime.utcnow()
+    summary = {'expired': expire_coupons(now, chunk_size), 'notified': 0}
+    if notify_within:
+        summary['notified'] = notify_expiring_coupons(notify_within, now, chunk_size)
+    return summary
+
+def discounted_price(price, discount_amount, is_percentage=True):
+    """Price after one coupon, never below zero"""
+    if price is None or discount_amount is None:
+        return price
+    if is_percentage is not False:
+        return max(price * (1 - discount_amount / 100), 0)
+    return max(price - discount_amount, 0)
+
+def _fetch_candidates(user_id=None, item_ids=None, now=None):
+    """Every item joined with its active coupons as one frame, one row per (item, coupon) pair"""
+    query = db.session.query(
+        WishlistItem.id, WishlistItem.name, WishlistItem.current_price,
+        Coupon.id, Coupon.code, Coupon.discount_amount, Coupon.is_percentage, Coupon.valid_until
+    ).outerjoin(Coupon, and_(Coupon.item_id == WishlistItem.id, Coupon.is_active(now)))
+    if user_id is not None:
+        query = query.filter(WishlistItem.user_id == user_id)
+    if item_ids is not None:
+        query = query.filter(WishlistItem.id.in_(list(item_ids)))
+    return pd.DataFrame(query.all(), columns=[
+        'item_id', 'name', 'current_price', 'coupon_id', 'code', 'discount_amount', 'is_percentage', 'valid_until'
+    ])
+
+def compute_best_prices(user_id=None, item_ids=None, now=None):
+    """Best effective price of each item over all of its active coupons.
+    
+    Candidate prices for every (item, coupon) pair are computed as whole
+    columns and the cheapest row per item is kept. Returns item_id -> dict
+    with the effective price, savings and the coupon that gives them.
+    """
+    now = now or datetime.utcnow()
+    frame = _fetch_candidates(user_id, item_ids, now)
+    if frame.empty:
+        return {}
+    
+    price = frame['current_price'].astype(float)
+    discount = frame['discount_amount'].astype(float)
+    percentage = frame['is_percentage'].astype(object).where(frame['is_percentage'].notna(), True).astype(bool)
+    candidate = np.where(percentage, price * (1 - discount / 100), price - discount)
+    # Items without a usable coupon cost their current price
+    frame['effective_price'] = pd.Series(candidate, index=frame.index).clip(lower=0).fillna(price)
+    frame.loc[frame['effective_price'].isna() | discount.isna(), 'coupon_id'] = None
+    
+    best = frame.sort_values(['item_id', 'effective_price'], na_position='last').drop_duplicates('item_id')
+    results = {}
+    for row in best.itertuples(index=False):
+        has_price = not pd.isna(row.current_price)
+        has_coupon = has_price and not pd.isna(row.coupon_id)
+        results[int(row.item_id)] = {
+            'item_id': int(row.item_id),
+            'name': row.name,
+            'current_price': float(row.current_price) if has_price else None,
+            'effective_price': round(float(row.effective_price), 2) if has_price else None,
+            'savings': round(float(row.current_price - row.effective_price), 2) if has_price else None,
+            'coupon': {
+                'id': int(row.coupon_id),
+                'code': row.code,
+                'valid_until': None if pd.isna(row.valid_until) else pd.Timestamp(row.valid_until).to_pydatetime()
+            } if has_coupon else None
+        }
+    return results
+
+def get_price_cache(app=None):
+    """The effective price cache of the current app, or None when caching is disabled"""
+    return get_watermark_cache('effective_price_cache', 'EFFECTIVE_PRICE_CACHE_TTL', app)
+
+def best_prices(user_id=None, item_ids=None):
+    """Best effective prices for a user's wishlist or a set of items, cached per user when enabled"""
+    cache = get_price_cache() if user_id is not None and item_ids is None else None
+    if cache is None:
+        return compute_best_prices(user_id, item_ids)
+    return cache.fetch(user_id, compute_best_prices)
+
+def attach_effective_prices(item_dicts, user_id=None):
+    """Add effective_price, savings and best_coupon to serialized items, in place"""
+    if user_id is not None:
+        prices = best_prices(user_id=user_id)
+    else:
+        prices = best_prices(item_ids={item['id'] for item in item_dicts})
+    for item in item_dicts:
+        price = prices.get(item['id'], {})
+        item['effective_price'] = price.get('effective_price', item.get('current_price'))
+        item['savings'] = price.get('savings')
+        item['best_coupon'] = price.get('coupon')
+    return item_dicts
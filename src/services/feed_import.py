@@ -0,0 +1,117 @@
+from src.models.models import db, WishlistItem
+from src.services.pricing import ingest_prices, DEFAULT_CHUNK_SIZE
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import csv
+import gzip
+import io
+import json
+
+FEED_FORMATS = ('csv', 'ndjson')
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Query parameters that only track the visit and never identify the product
+TRACKING_PARAMS = {'gclid', 'fbclid', 'ref', 'tag'}
+TRACKING_PREFIXES = ('utm_',)
+
+def _is_tracking(key):
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+def normalize_url(url):
+    """Canonical form of a product URL used to match feed rows to items"""
+    if not url:
+        return None
+    parts = urlsplit(url.strip())
+    if not parts.netloc:
+        return None
+    
+    host = parts.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking(key)
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('', host, path, urlencode(query), ''))
+
+def build_url_index():
+    """Map normalized URL -> ids of every item tracking it, built in one pass"""
+    index = {}
+    rows = db.session.query(WishlistItem.id, WishlistItem.url).filter(
+        WishlistItem.url.isnot(None), WishlistItem.url != ''
+    )
+    for item_id, url in rows:
+        key = normalize_url(url)
+        if key:
+            index.setdefault(key, []).append(item_id)
+    return index
+
+def open_feed(stream):
+    """Wrap a binary stream as text, transparently decompressing gzip"""
+    buffered = stream if isinstance(stream, io.BufferedReader) else io.BufferedReader(stream)
+    if buffered.peek(2)[:2] == GZIP_MAGIC:
+        buffered = gzip.GzipFile(fileobj=buffered)
+    return io.TextIOWrapper(buffered, encoding='utf-8', newline='')
+
+def read_feed(text, feed_format, url_field='url', price_field='price'):
+    """Yield (url, price) pairs from a CSV or NDJSON text stream, one row at a time"""
+    if feed_format == 'csv':
+        rows = csv.DictReader(text)
+    else:
+        rows = (_decode_line(line) for line in text if line.strip())
+    
+    for row in rows:
+        if not isinstance(row, dict):
+            yield None, None
+            continue
+        yield row.get(url_field), row.get(price_field)
+
+def _decode_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def import_feed(rows, chunk_size=DEFAULT_CHUNK_SIZE, url_index=None):
+    """Apply a stream of (url, price) feed rows to every item tracking the URL.
+    
+    Only the URL index is held in memory; matched observations flow through
+    ingest_prices, which commits in chunks. Returns a summary of counts.
+    """
+    url_index = build_url_index() if url_index is None else url_index
+    summary = {'rows': 0, 'matched': 0, 'unmatched': 0, 'invalid': 0,
+               'updated': 0, 'unchanged': 0, 'not_found': 0}
+
+    def observations():
+        for url, price in rows:
+            summary['rows'] += 1
+            try:
+                price = float(price)
+            except (TypeError, ValueError):
+                summary['invalid'] += 1
+                continue
+            item_ids = url_index.get(normalize_url(url))
+            if not item_ids:
+                summary['unmatched'] += 1
+                continue
+            summary['matched'] += 1
+            for item_id in item_ids:
+                yield {'item_id': item_id, 'price': price}
+    
+    for result in ingest_prices(observations(), chunk_size):
+        summary[result['status']] += 1
+    
+    return summary
+
+def feed_format_for(filename):
+    """Guess the feed format from a file name such as prices.ndjson.gz"""
+    name = filename.lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
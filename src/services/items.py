@@ -0,0 +1,98 @@
+from sqlalchemy import and_, or_
+from src.models.models import db, WishlistItem
+from src.services.pagination import encode_cursor, decode_cursor, cursor_datetime, cursor_value
+from src.services.coupons import attach_effective_prices
+
+# Every field of WishlistItem.to_dict(), all plain columns
+ITEM_FIELDS = ('id', 'name', 'description', 'url', 'image_url', 'current_price', 'initial_price',
+               'lowest_price', 'highest_price', 'priority', 'is_purchased', 'price_checked_at',
+               'created_at', 'updated_at', 'user_id', 'category_id')
+
+# Fields filled in by attach_effective_prices rather than read from the row
+PRICE_FIELDS = ('effective_price', 'savings', 'best_coupon')
+
+# sort name -> (column, descending by default)
+ITEM_SORTS = {
+    'priority': (WishlistItem.priority, True),
+    'created_at': (WishlistItem.created_at, True),
+    'price': (WishlistItem.current_price, False),
+}
+
+def parse_fields(args):
+    """Fields requested with fields=a,b,c, or every field; raises ValueError"""
+    value = args.get('fields')
+    if not value:
+        return ITEM_FIELDS + PRICE_FIELDS
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in ITEM_FIELDS + PRICE_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {unknown}. Must be among: {list(ITEM_FIELDS + PRICE_FIELDS)}")
+    # The id is always returned so clients can address the item
+    return tuple(dict.fromkeys(['id'] + fields))
+
+def parse_item_sort(args):
+    """(sort, descending) from sort= and order=; raises ValueError"""
+    sort = args.get('sort', 'created_at')
+    if sort not in ITEM_SORTS:
+        raise ValueError(f"Invalid sort. Must be one of: {list(ITEM_SORTS)}")
+    order = args.get('order')
+    if order not in (None, 'asc', 'desc'):
+        raise ValueError("Invalid order. Must be one of: ['asc', 'desc']")
+    return sort, ITEM_SORTS[sort][1] if order is None else order == 'desc'
+
+def _after(column, descending, value, last_id):
+    """Keyset condition for rows after (value, last_id) in (column IS NULL, column, id) order.
+    
+    NULLs sort last in both directions, so a page that ended on a NULL only
+    continues among the NULLs.
+    """
+    later_id = WishlistItem.id < last_id if descending else WishlistItem.id > last_id
+    if value is None:
+        return and_(column.is_(None), later_id)
+    beyond = column < value if descending else column > value
+    return or_(column.is_(None), beyond, and_(column == value, later_id))
+
+def list_items(user_id, filters=None, fields=ITEM_FIELDS, sort='created_at', descending=True,
+               limit=None, after=None):
+    """One page of a user's items as dicts holding only the requested fields.
+    
+    Only the needed columns are selected, without hydrating ORM objects.
+    Returns (items, next_cursor); the cursor is None on the last page.
+    """
+    column, _ = ITEM_SORTS[sort]
+    row_fields = [field for field in fields if field in ITEM_FIELDS]
+    # The sort key is needed for the cursor even when it was not asked for
+    selected = list(dict.fromkeys(row_fields + ['id', column.key]))
+    query = db.session.query(*[getattr(WishlistItem, field) for field in selected]).filter(
+        WishlistItem.user_id == user_id
+    )
+    for name, value in (filters or {}).items():
+        query = query.filter(getattr(WishlistItem, name) == value)
+    
+    if after:
+        value, last_id = decode_cursor(after, 2)
+        last_id = cursor_value(last_id, int)
+        if value is not None:
+            value = cursor_datetime(value) if sort == 'created_at' else cursor_value(value, int, float)
+        query = query.filter(_after(column, descending, value, last_id))
+    
+    direction = (lambda c: c.desc()) if descending else (lambda c: c.asc())
+    query = query.order_by(column.is_(None), direction(column), direction(WishlistItem.id))
+    rows = query.limit(limit + 1).all() if limit else query.all()
+    
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], column.key), rows[-1].id)
+    
+    items = [{field: getattr(row, field) for field in row_fields} for row in rows]
+    price_fields = [field for field in fields if field in PRICE_FIELDS]
+    if price_fields:
+        for item, row in zip(items, rows):
+            item.setdefault('id', row.id)
+        attach_effective_prices(items, user_id)
+        for item in items:
+            for field in PRICE_FIELDS:
+                if field not in price_fields:
+                    item.pop(field)
+    return items, next_cursor
@@ -0,0 +1,299 @@
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert, update, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from src.models.models import db, Notification, NotificationCounter, User
+from src.services.broker import get_broker
+from src.services.outbox import enqueue, outbox_handler
+from src.services.watermarks import touch_users
+from collections import Counter
+from datetime import datetime, timedelta
+
+# Session.info key for events waiting for the transaction to commit
+PENDING_EVENTS = 'pending_notification_events'
+OUTBOX_EVENT = 'notifications'
+
+def _event_payload(row):
+    return {
+        'type': row['type'],
+        'message': row['message'],
+        'occurrences': row.get('occurrences', 1),
+        'user_id': row['user_id'],
+        'item_id': row['item_id'],
+        'created_at': row['created_at'].isoformat()
+    }
+
+def _queue_events(rows):
+    db.session.info.setdefault(PENDING_EVENTS, []).extend(
+        (row['user_id'], _event_payload(row)) for row in rows
+    )
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending_events(session):
+    """Publish queued notification events once their rows are committed"""
+    events = session.info.pop(PENDING_EVENTS, None)
+    if not events or not has_app_context():
+        return
+    broker = get_broker()
+    for user_id, payload in events:
+        try:
+            broker.publish(user_id, payload)
+        except Exception:
+            # Delivery is best effort; clients catch up from the feed
+            current_app.logger.exception('Failed to publish notification event')
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_events(session):
+    session.info.pop(PENDING_EVENTS, None)
+
+def notify(user_id, item_id, notification_type, message, **details):
+    """Add one notification; see notify_many for coalescing and the optional details"""
+    notify_many([dict(details, type=notification_type, message=message, user_id=user_id, item_id=item_id)])
+
+def notify_many(rows):
+    """Create notifications for rows of Notification columns.
+    
+    With NOTIFICATION_OUTBOX enabled the rows are only appended to the outbox
+    in the caller's transaction and the outbox worker delivers them; otherwise
+    they are delivered inline.
+    """
+    if not rows:
+        return
+    if _config('NOTIFICATION_OUTBOX', False):
+        now = datetime.utcnow()
+        enqueue(OUTBOX_EVENT, {'rows': [
+            dict(row, created_at=row.get('created_at', now).isoformat()) for row in rows
+        ]})
+        return
+    deliver_notifications(rows)
+
+@outbox_handler(OUTBOX_EVENT)
+def _deliver_from_outbox(payload):
+    rows = [dict(row, created_at=datetime.fromisoformat(row['created_at'])) for row in payload['rows']]
+    pending = db.session.info.setdefault(PENDING_EVENTS, [])
+    queued = len(pending)
+    try:
+        deliver_notifications(rows)
+    except Exception:
+        # The outbox rolls this attempt back, so its push events must not go out
+        del pending[queued:]
+        raise
+
+def deliver_notifications(rows):
+    """Write notification rows and count the unread ones.
+    
+    Rows may also carry 'price' and 'item_name' so coalesced price drops can
+    say how far the price has fallen in total. With a coalescing window
+    configured, an event for a (user, item, type) that still has an unread
+    notification from within the window updates that row instead of adding
+    one; users with digests enabled get a single digest row per window.
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    for row in rows:
+        row.setdefault('is_read', False)
+        row.setdefault('created_at', now)
+    
+    coalesce_window = _config('NOTIFICATION_COALESCE_WINDOW', 0)
+    digest_users = _digest_users({row['user_id'] for row in rows})
+    if not coalesce_window and not digest_users:
+        _insert(rows)
+        return
+    
+    # Merge the rows of this call by target first
+    standalone = []
+    groups = {}
+    for row in rows:
+        if row['user_id'] in digest_users:
+            key = (row['user_id'], None, DIGEST_TYPE)
+        elif coalesce_window:
+            key = (row['user_id'], row['item_id'], row['type'])
+        else:
+            standalone.append(row)
+            continue
+        if key in groups:
+            _merge(groups[key], row)
+        else:
+            groups[key] = _start_group(key, row)
+    
+    # Then fold them into open notifications from earlier calls
+    existing = _find_open(groups, now, coalesce_window, _config('NOTIFICATION_DIGEST_WINDOW', DEFAULT_DIGEST_WINDOW))
+    updated = []
+    for key, group in groups.items():
+        notification = existing.get(key)
+        if notification is None:
+            standalone.append(group)
+            continue
+        notification.occurrences = (notification.occurrences or 1) + group['occurrences']
+        notification.updated_at = now
+        notification.message = _coalesced_message(
+            notification.type, notification.occurrences, group['latest_message'],
+            notification.reference_price, group.get('price'), group.get('item_name')
+        )
+        updated.append({
+            'type': notification.type,
+            'message': notification.message,
+            'occurrences': notification.occurrences,
+            'user_id': notification.user_id,
+            'item_id': notification.item_id,
+            'created_at': notification.created_at
+        })
+    
+    _insert(standalone)
+    _queue_events(updated)
+
+DIGEST_TYPE = 'digest'
+DEFAULT_DIGEST_WINDOW = 3600
+COLUMNS = ('type', 'message', 'is_read', 'occurrences', 'reference_price', 'created_at', 'user_id', 'item_id')
+
+def _config(name, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+def _digest_users(user_ids):
+    return {row[0] for row in db.session.query(User.id).filter(
+        User.id.in_(user_ids), User.notification_digest.is_(True)
+    )}
+
+def _start_group(key, row):
+    user_id, item_id, notification_type = key
+    return {
+        'type': notification_type,
+        'user_id': user_id,
+        'item_id': item_id,
+        'is_read': False,
+        'created_at': row['created_at'],
+        'occurrences': row.get('occurrences', 1),
+        'message': row['message'],
+        'latest_message': row['message'],
+        'reference_price': row.get('reference_price'),
+        'price': row.get('price'),
+        'item_name': row.get('item_name')
+    }
+
+def _merge(group, row):
+    group['occurrences'] += row.get('occurrences', 1)
+    group['latest_message'] = row['message']
+    group['price'] = row.get('price')
+    group['message'] = _coalesced_message(
+        group['type'], group['occurrences'], row['message'],
+        group['reference_price'], row.get('price'), row.get('item_name')
+    )
+
+def _coalesced_message(notification_type, occurrences, latest_message, reference_price, price, item_name):
+    if notification_type == DIGEST_TYPE:
+        return f"{occurrences} updates on your wishlist, latest: {latest_message}"
+    if notification_type == 'price_drop' and reference_price and price is not None and item_name:
+        percentage = (reference_price - price) / reference_price * 100
+        return f"Price dropped {occurrences} times on {item_name}, now {percentage:.2f}% off"
+    return f"{latest_message} ({occurrences} updates)"
+
+def _find_open(groups, now, coalesce_window, digest_window):
+    """Latest unread notification within its window for each group key"""
+    found = {}
+    item_keys = [key for key in groups if key[2] != DIGEST_TYPE]
+    digest_keys = [key for key in groups if key[2] == DIGEST_TYPE]
+    
+    candidates = []
+    if item_keys:
+        candidates += Notification.query.filter(
+            Notification.user_id.in_({key[0] for key in item_keys}),
+            Notification.is_read.is_(False),
+            Notification.created_at >= now - timedelta(seconds=coalesce_window),
+            Notification.item_id.in_({key[1] for key in item_keys}),
+            Notification.type.in_({key[2] for key in item_keys})
+        ).all()
+    if digest_keys:
+        candidates += Notification.query.filter(
+            Notification.user_id.in_({key[0] for key in digest_keys}),
+            Notification.is_read.is_(False),
+            Notification.created_at >= now - timedelta(seconds=digest_window),
+            Notification.type == DIGEST_TYPE
+        ).all()
+    
+    for notification in candidates:
+        key = (notification.user_id, notification.item_id, notification.type)
+        if key in groups and (key not in found or notification.created_at > found[key].created_at):
+            found[key] = notification
+    return found
+
+def _insert(rows):
+    if not rows:
+        return
+    db.session.execute(insert(Notification), [
+        {column: row.get(column) for column in COLUMNS if column in row} for row in rows
+    ])
+    adjust_unread(Counter(row['user_id'] for row in rows if not row['is_read']))
+    touch_users(row['user_id'] for row in rows)
+    _queue_events(rows)
+
+def adjust_unread(deltas):
+    """Atomically add to the unread counters of several users.
+    
+    deltas maps user_id -> change. Users without a counter row are skipped;
+    their counter is created from the real count the first time it is read.
+    """
+    by_delta = {}
+    for user_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(user_id)
+    
+    for delta, user_ids in by_delta.items():
+        new_count = NotificationCounter.unread_count + delta
+        db.session.execute(
+            update(NotificationCounter)
+            .where(NotificationCounter.user_id.in_(user_ids))
+            .values(unread_count=db.case((new_count < 0, 0), else_=new_count))
+            .execution_options(synchronize_session=False)
+        )
+
+def _count_unread(user_ids):
+    rows = db.session.query(Notification.user_id, func.count(Notification.id)).filter(
+        Notification.user_id.in_(user_ids), Notification.is_read.is_(False)
+    ).group_by(Notification.user_id)
+    counts = dict.fromkeys(user_ids, 0)
+    counts.update(rows)
+    return counts
+
+def unread_count(user_id):
+    """Unread notifications of a user, served from the cached counter"""
+    counter = db.session.get(NotificationCounter, user_id)
+    if counter is not None:
+        return counter.unread_count
+    
+    # First read for this user: seed the counter from the notifications table
+    count = _count_unread([user_id])[user_id]
+    db.session.add(NotificationCounter(user_id=user_id, unread_count=count))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another request seeded it first
+        db.session.rollback()
+        return db.session.get(NotificationCounter, user_id).unread_count
+    return count
+
+def reconcile_unread_counts(chunk_size=500):
+    """Recount unread notifications for every user in chunks and repair drifted counters.
+    
+    Returns the number of counters that were created or corrected.
+    """
+    repaired = 0
+    last_id = 0
+    while True:
+        user_ids = [row[0] for row in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(chunk_size)]
+        if not user_ids:
+            return repaired
+        last_id = user_ids[-1]
+        
+        counts = _count_unread(user_ids)
+        counters = {c.user_id: c for c in NotificationCounter.query.filter(NotificationCounter.user_id.in_(user_ids))}
+        for user_id, count in counts.items():
+            counter = counters.get(user_id)
+            if counter is None:
+                db.session.add(NotificationCounter(user_id=user_id, unread_count=count))
+                repaired += 1
+            elif counter.unread_count != count:
+                counter.unread_count = count
+                repaired += 1
+        db.session.commit()
@@ -0,0 +1,81 @@
+from sqlalchemy import func
+from src.models.models import db, OutboxEvent, OutboxStatus
+from datetime import datetime, timedelta
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_ATTEMPTS = 8
+BASE_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 3600
+
+# event_type -> callable(payload), filled in by the modules that own the events
+HANDLERS = {}
+
+def outbox_handler(event_type):
+    """Register the function that runs outbox events of this type"""
+    def register(function):
+        HANDLERS[event_type] = function
+        return function
+    return register
+
+def enqueue(event_type, payload):
+    """Record an event in the current transaction; it runs only if the transaction commits"""
+    event = OutboxEvent(event_type=event_type, payload=payload)
+    db.session.add(event)
+    return event
+
+def retry_delay(attempts):
+    """Exponential backoff in seconds after the given number of failed attempts"""
+    return min(BASE_RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+def drain_outbox(batch_size=DEFAULT_BATCH_SIZE, max_attempts=DEFAULT_MAX_ATTEMPTS, now=None):
+    """Run one batch of due outbox events and commit; returns counts by outcome.
+    
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the database
+    supports it, so several workers can drain the same outbox. Each event runs
+    in a savepoint: a failure rolls back only that event's writes and
+    reschedules it with exponential backoff, until max_attempts marks it failed.
+    """
+    now = now or datetime.utcnow()
+    events = OutboxEvent.query.filter(
+        OutboxEvent.status == OutboxStatus.PENDING,
+        OutboxEvent.available_at <= now
+    ).order_by(OutboxEvent.id).limit(batch_size).with_for_update(skip_locked=True).all()
+    
+    summary = {'processed': 0, 'retried': 0, 'failed': 0}
+    for event in events:
+        event.attempts += 1
+        try:
+            with db.session.begin_nested():
+                run = HANDLERS.get(event.event_type)
+                if run is None:
+                    raise LookupError(f'No handler for outbox event type {event.event_type}')
+                run(event.payload)
+        except Exception as e:
+            event.last_error = f'{type(e).__name__}: {e}'
+            if event.attempts >= max_attempts:
+                event.status = OutboxStatus.FAILED
+                summary['failed'] += 1
+            else:
+                event.available_at = now + timedelta(seconds=retry_delay(event.attempts))
+                summary['retried'] += 1
+        else:
+            event.status = OutboxStatus.DONE
+            event.processed_at = now
+            event.last_error = None
+            summary['processed'] += 1
+    
+    db.session.commit()
+    return summary
+
+def outbox_stats():
+    """Number of outbox events per status and the age of the oldest pending one"""
+    counts = dict(db.session.query(OutboxEvent.status, func.count(OutboxEvent.id)).group_by(OutboxEvent.status).all())
+    oldest = db.session.query(func.min(OutboxEvent.created_at)).filter(
+        OutboxEvent.status == OutboxStatus.PENDING
+    ).scalar()
+    return {
+        'pending': counts.get(OutboxStatus.PENDING, 0),
+        'done': counts.get(OutboxStatus.DONE, 0),
+        'failed': counts.get(OutboxStatus.FAILED, 0),
+        'oldest_pending_age_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None
+    }
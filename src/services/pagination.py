@@ -0,0 +1,57 @@
+from datetime import datetime
+import base64
+import json
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def encode_cursor(*values):
+    """Pack the sort key of the last row on a page into an opaque cursor string"""
+    raw = json.dumps([_encode_value(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Unpack a cursor produced by encode_cursor; raises ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+def cursor_datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+def cursor_value(value, *types):
+    """A decoded cursor value checked against the JSON types it should have"""
+    if isinstance(value, bool) or not isinstance(value, types):
+        raise ValueError('Invalid cursor')
+    return value
+
+def decode_keyset_cursor(cursor):
+    """Unpack a (created_at, id) style cursor as (datetime, int); raises ValueError if it is malformed"""
+    moment, last_id = decode_cursor(cursor, 2)
+    return cursor_datetime(moment), cursor_value(last_id, int)
+
+def parse_limit(args, default=None, maximum=MAX_LIMIT):
+    """Read the limit query parameter, capped at maximum; raises ValueError on bad input"""
+    value = args.get('limit')
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
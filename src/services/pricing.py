@@ -0,0 +1,274 @@
+from sqlalchemy import insert, update, func
+from src.models.models import db, WishlistItem, PriceHistory, User
+from src.services.rollups import update_rollups
+from src.services.alerts import AlertIndex, drop_percentage
+from src.services.notifications import notify_many
+from src.services.coupons import attach_effective_prices
+from src.services.watermarks import touch_users, touch_items
+from collections import Counter
+from datetime import datetime
+
+DEFAULT_CHUNK_SIZE = 500
+
+# Orderings accepted by the price drop endpoints
+DROP_SORTS = {
+    'pct': lambda: (WishlistItem.price_drop_pct.desc(),),
+    'amount': lambda: ((WishlistItem.initial_price - WishlistItem.current_price).desc(),),
+    'price': lambda: (WishlistItem.current_price.asc(),),
+    'recent': lambda: (WishlistItem.updated_at.desc(),),
+}
+
+def apply_price(item, new_price, checked_at=None):
+    """Update the current, lowest and highest prices of an item and return the previous price"""
+    old_price = item.current_price
+    item.current_price = new_price
+    item.price_checked_at = checked_at or datetime.utcnow()
+    
+    # Update lowest and highest prices if needed
+    if item.lowest_price is None or new_price < item.lowest_price:
+        item.lowest_price = new_price
+    
+    if item.highest_price is None or new_price > item.highest_price:
+        item.highest_price = new_price
+    
+    return old_price
+
+def record_history(item_id, price, recorded_at=None):
+    """Add a price history row for an item and fold it into the rollups"""
+    recorded_at = recorded_at or datetime.utcnow()
+    price_history = PriceHistory(
+        price=price,
+        item_id=item_id,
+        recorded_at=recorded_at,
+        last_seen=recorded_at,
+        observation_count=1
+    )
+    db.session.add(price_history)
+    update_rollups([(item_id, price, price_history.recorded_at)])
+    return price_history
+
+def mark_checked(item_ids, checked_at=None):
+    """Record that the prices of these items were observed without changing"""
+    if not item_ids:
+        return
+    db.session.execute(
+        update(WishlistItem)
+        .where(WishlistItem.id.in_(item_ids))
+        .values(price_checked_at=checked_at or datetime.utcnow(), updated_at=WishlistItem.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    touch_items(item_ids)
+
+def mark_check_failed(item_ids, failed_at=None):
+    """Record a failed price fetch so the refresher moves these items to the back of the queue"""
+    if not item_ids:
+        return
+    db.session.execute(
+        update(WishlistItem)
+        .where(WishlistItem.id.in_(item_ids))
+        .values(price_check_failed_at=failed_at or datetime.utcnow(), updated_at=WishlistItem.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+def extend_runs(observed, seen_at=None):
+    """Extend the latest price history run of each item instead of writing new rows.
+    
+    observed maps item_id -> number of unchanged observations (or is any
+    iterable of item ids, one observation each). The observations are folded
+    into the rollups as well, at seen_at.
+    """
+    observed = Counter(observed)
+    if not observed:
+        return
+    seen_at = seen_at or datetime.utcnow()
+    
+    latest_ids = db.session.query(func.max(PriceHistory.id)).filter(
+        PriceHistory.item_id.in_(list(observed))
+    ).group_by(PriceHistory.item_id)
+    latest = db.session.query(PriceHistory.item_id, PriceHistory.id, PriceHistory.price).filter(
+        PriceHistory.id.in_(latest_ids.scalar_subquery())
+    ).all()
+    
+    # Group the runs by increment so typical batches need a single UPDATE
+    runs_by_increment = {}
+    for item_id, run_id, _ in latest:
+        runs_by_increment.setdefault(observed[item_id], []).append(run_id)
+    
+    for increment, run_ids in runs_by_increment.items():
+        db.session.execute(
+            update(PriceHistory)
+            .where(PriceHistory.id.in_(run_ids))
+            .values(last_seen=seen_at, observation_count=PriceHistory.observation_count + increment)
+            .execution_options(synchronize_session=False)
+        )
+    
+    update_rollups((item_id, price, seen_at) for item_id, _, price in latest for _ in range(observed[item_id]))
+
+def chunked(iterable, size):
+    """Yield lists of at most size elements from any iterable"""
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def ingest_prices(observations, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Apply many {item_id, price} observations, committing once per chunk.
+    
+    Each chunk loads its items with a single query and bulk-inserts the
+    resulting price history and notification rows. Yields one result dict per
+    observation, in input order.
+    """
+    for chunk in chunked(observations, chunk_size):
+        yield from _ingest_chunk(chunk)
+
+def _parse_observation(observation):
+    try:
+        return int(observation['item_id']), float(observation['price'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _ingest_chunk(chunk):
+    parsed = [_parse_observation(o) for o in chunk]
+    item_ids = {p[0] for p in parsed if p is not None}
+    items = {}
+    if item_ids:
+        items = {item.id: item for item in WishlistItem.query.filter(WishlistItem.id.in_(item_ids))}
+    alerts = AlertIndex.for_items(items.values())
+    
+    now = datetime.utcnow()
+    history_rows = []
+    notification_rows = []
+    # Re-checks before an item's first change in the chunk extend its stored run,
+    # later ones the run that change starts
+    unchanged = Counter()
+    new_runs = {}
+    results = []
+    
+    for observation, entry in zip(chunk, parsed):
+        if entry is None:
+            results.append({
+                'item_id': observation.get('item_id') if isinstance(observation, dict) else None,
+                'status': 'invalid',
+                'error': 'item_id and numeric price are required'
+            })
+            continue
+        
+        item_id, new_price = entry
+        item = items.get(item_id)
+        if item is None:
+            results.append({'item_id': item_id, 'status': 'not_found'})
+            continue
+        
+        if item.current_price == new_price:
+            if item_id in new_runs:
+                new_runs[item_id]['observation_count'] += 1
+            else:
+                unchanged[item_id] += 1
+            results.append({'item_id': item_id, 'status': 'unchanged', 'price': new_price})
+            continue
+        
+        old_lowest = item.lowest_price
+        old_price = apply_price(item, new_price, now)
+        new_runs[item_id] = {
+            'price': new_price,
+            'item_id': item_id,
+            'recorded_at': now,
+            'last_seen': now,
+            'observation_count': 1
+        }
+        history_rows.append(new_runs[item_id])
+        
+        # Only the alert rules matching this change produce notifications
+        alerts_fired = alerts.evaluate(item, old_price, new_price, old_lowest)
+        for notification_type, message in alerts_fired:
+            notification_rows.append({
+                'type': notification_type,
+                'message': message,
+                'is_read': False,
+                'created_at': now,
+                'user_id': item.user_id,
+                'item_id': item_id,
+                'reference_price': old_price,
+                'price': new_price,
+                'item_name': item.name
+            })
+        
+        results.append({
+            'item_id': item_id,
+            'status': 'updated',
+            'old_price': old_price,
+            'new_price': new_price,
+            'price_drop': drop_percentage(old_price, new_price) is not None,
+            'alerts': [notification_type for notification_type, _ in alerts_fired]
+        })
+    
+    # Extend the stored runs before the new runs are inserted and become the latest
+    extend_runs(unchanged, now)
+    if history_rows:
+        db.session.execute(insert(PriceHistory), history_rows)
+        # Re-checks in this chunk after the change count in the rollups too
+        update_rollups((row['item_id'], row['price'], row['recorded_at'])
+                       for row in history_rows for _ in range(row['observation_count']))
+        touch_items(row['item_id'] for row in history_rows)
+    notify_many(notification_rows)
+    mark_checked(list(unchanged), now)
+    db.session.commit()
+    
+    return results
+
+def parse_drop_args(args):
+    """Read sort/min_pct query parameters for the price drop endpoints; raises ValueError"""
+    sort = args.get('sort', 'pct')
+    if sort not in DROP_SORTS:
+        raise ValueError(f"Invalid sort. Must be one of: {list(DROP_SORTS)}")
+    
+    min_pct = args.get('min_pct')
+    if min_pct is not None:
+        try:
+            min_pct = float(min_pct)
+        except ValueError:
+            raise ValueError('min_pct must be a number')
+    
+    return sort, min_pct
+
+def find_price_drops(user_id=None, sort='pct', min_pct=None, limit=None):
+    """Items whose price dropped, filtered and ordered in SQL on the indexed price_drop_pct.
+    
+    Without a user_id this searches every user's items; with sort='pct' and a
+    limit that is a top-K read straight off the price_drop_pct index.
+    """
+    query = WishlistItem.query
+    if user_id is not None:
+        query = query.filter(WishlistItem.user_id == user_id)
+    
+    if min_pct is not None and min_pct > 0:
+        query = query.filter(WishlistItem.price_drop_pct >= min_pct)
+    else:
+        query = query.filter(WishlistItem.price_drop_pct > 0)
+    
+    query = query.order_by(*DROP_SORTS[sort](), WishlistItem.id)
+    if limit:
+        query = query.limit(limit)
+    
+    price_drops = []
+    for item in query:
+        item_dict = item.to_dict()
+        item_dict['price_drop_percentage'] = item.price_drop_pct
+        price_drops.append(item_dict)
+    return attach_effective_prices(price_drops, user_id)
+
+def recompute_price_drops():
+    """Backfill price_drop_pct for every item with one UPDATE; returns the row count"""
+    result = db.session.execute(
+        update(WishlistItem)
+        .values(price_drop_pct=WishlistItem.price_drop_expression(), updated_at=WishlistItem.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    touch_users(row.id for row in db.session.query(User.id))
+    db.session.commit()
+    return result.rowcount
+
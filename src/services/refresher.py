@@ -0,0 +1,265 @@
+from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from sqlalchemy import func, or_, case
+from src.models.models import db, WishlistItem
+from src.services.feed_import import normalize_url
+from src.services.pricing import ingest_prices, mark_check_failed, DEFAULT_CHUNK_SIZE
+from datetime import datetime, timedelta
+from itertools import zip_longest
+from urllib.parse import urlsplit
+import json
+import re
+import requests
+import threading
+import time
+
+USER_AGENT = 'WishTracker price refresher'
+PRICE_PATTERN = re.compile(r'\d[\d.,\s]*')
+
+class PriceNotFound(Exception):
+    pass
+
+def parse_price_text(text):
+    """Extract a number from text such as '$1,299.99' or '1.299,99 EUR'"""
+    match = PRICE_PATTERN.search(text or '')
+    if not match:
+        return None
+    number = re.sub(r'\s', '', match.group()).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Whichever separator comes last is the decimal separator
+        if number.rfind(',') > number.rfind('.'):
+            number = number.replace('.', '').replace(',', '.')
+        else:
+            number = number.replace(',', '')
+    elif ',' in number:
+        whole, _, fraction = number.rpartition(',')
+        number = f'{whole.replace(",", "")}.{fraction}' if len(fraction) != 3 else number.replace(',', '')
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def _json_ld_prices(data):
+    if isinstance(data, list):
+        for entry in data:
+            yield from _json_ld_prices(entry)
+    elif isinstance(data, dict):
+        if 'price' in data:
+            yield data['price']
+        if 'lowPrice' in data:
+            yield data['lowPrice']
+        for key in ('offers', '@graph'):
+            if key in data:
+                yield from _json_ld_prices(data[key])
+
+def parse_price(html):
+    """Find the product price on a page; raises PriceNotFound"""
+    soup = BeautifulSoup(html, 'lxml')
+    candidates = []
+    
+    for selector in ('meta[property="product:price:amount"]', 'meta[property="og:price:amount"]',
+                     'meta[itemprop="price"]'):
+        candidates.extend(tag.get('content') for tag in soup.select(selector))
+    
+    for tag in soup.select('[itemprop="price"]'):
+        candidates.append(tag.get('content') or tag.get_text())
+    
+    for script in soup.select('script[type="application/ld+json"]'):
+        try:
+            candidates.extend(str(price) for price in _json_ld_prices(json.loads(script.string or '')))
+        except ValueError:
+            continue
+    
+    for tag in soup.select('[class*="price"]'):
+        candidates.append(tag.get_text())
+    
+    for candidate in candidates:
+        price = parse_price_text(candidate)
+        if price is not None:
+            return price
+    raise PriceNotFound('No price found on page')
+
+class DomainLimiter:
+    """Caps concurrent requests and the request rate for each domain"""
+
+    def __init__(self, concurrency=2, interval=1.0):
+        self.concurrency = concurrency
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_at = {}
+
+    @contextmanager
+    def slot(self, domain):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(domain, threading.BoundedSemaphore(self.concurrency))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_at.get(domain, now))
+                self._next_at[domain] = start + self.interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+class RefreshStats:
+    """Counters for one refresher run"""
+
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.items = 0
+        self.urls = 0
+        self.fetched = 0
+        self.failed = 0
+        self.failures = {}
+        self.updated = 0
+        self.unchanged = 0
+        self.staleness = {}
+        self._lock = threading.Lock()
+
+    def record_failure(self, reason):
+        with self._lock:
+            self.failed += 1
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'items': self.items,
+            'urls': self.urls,
+            'fetched': self.fetched,
+            'failed': self.failed,
+            'failures': self.failures,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'elapsed_seconds': round(elapsed, 3),
+            'urls_per_second': round(self.urls / elapsed, 2) if elapsed else None,
+            'staleness': self.staleness
+        }
+
+def staleness_stats(now=None):
+    """How long ago tracked items last had their price observed"""
+    now = now or datetime.utcnow()
+    tracked = WishlistItem.query.filter(WishlistItem.url.isnot(None), WishlistItem.url != '')
+    never_checked = tracked.filter(WishlistItem.price_checked_at.is_(None)).count()
+    total = tracked.count()
+    oldest = db.session.query(func.min(WishlistItem.price_checked_at)).filter(
+        WishlistItem.url.isnot(None), WishlistItem.url != ''
+    ).scalar()
+    return {
+        'tracked_items': total,
+        'never_checked': never_checked,
+        'oldest_check_age_seconds': round((now - oldest).total_seconds(), 1) if oldest else None
+    }
+
+def _interleave_by_domain(targets):
+    """Order URLs round-robin across domains so one slow domain cannot hog every worker"""
+    by_domain = {}
+    for url in targets:
+        by_domain.setdefault(urlsplit(url).netloc.lower(), []).append(url)
+    for group in zip_longest(*by_domain.values()):
+        for url in group:
+            if url is not None:
+                yield url
+
+class PriceRefresher:
+    """Fetches item pages concurrently and writes the prices in batches"""
+
+    def __init__(self, workers=8, per_domain_concurrency=2, per_domain_interval=1.0,
+                 timeout=10, batch_size=DEFAULT_CHUNK_SIZE, session=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.limiter = DomainLimiter(per_domain_concurrency, per_domain_interval)
+        self.session = session or self._build_session(workers)
+
+    @staticmethod
+    def _build_session(workers):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = USER_AGENT
+        return session
+
+    def fetch_price(self, url):
+        with self.limiter.slot(urlsplit(url).netloc.lower()):
+            response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_price(response.text)
+
+    def select_targets(self, stale_after=None, limit=None):
+        """Map fetchable URL -> item ids for items due a refresh, least recently attempted first"""
+        checked = WishlistItem.price_checked_at
+        failed = WishlistItem.price_check_failed_at
+        # A failed fetch counts as an attempt, so broken URLs queue behind healthy ones
+        attempted = case((or_(checked.is_(None), failed > checked), failed), else_=checked)
+        query = db.session.query(WishlistItem.id, WishlistItem.url).filter(
+            WishlistItem.url.isnot(None), WishlistItem.url != '', WishlistItem.is_purchased.isnot(True)
+        )
+        if stale_after is not None:
+            cutoff = datetime.utcnow() - timedelta(seconds=stale_after)
+            query = query.filter(or_(attempted.is_(None), attempted < cutoff))
+        query = query.order_by(attempted.is_(None).desc(), attempted)
+        if limit:
+            query = query.limit(limit)
+        
+        # Items sharing a product URL are fetched once
+        targets = {}
+        canonical = {}
+        for item_id, url in query:
+            key = normalize_url(url)
+            if key is None:
+                continue
+            targets.setdefault(canonical.setdefault(key, url), []).append(item_id)
+        return targets
+
+    def run(self, stale_after=None, limit=None):
+        """Refresh every due item and return the run statistics"""
+        stats = RefreshStats()
+        stats.staleness = staleness_stats()
+        targets = self.select_targets(stale_after, limit)
+        stats.urls = len(targets)
+        stats.items = sum(len(ids) for ids in targets.values())
+        
+        pending = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.fetch_price, url): url for url in _interleave_by_domain(targets)}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    price = future.result()
+                except PriceNotFound:
+                    stats.record_failure('no_price')
+                    failed.extend(targets[url])
+                    continue
+                except requests.HTTPError as e:
+                    stats.record_failure(f'http_{e.response.status_code}')
+                    failed.extend(targets[url])
+                    continue
+                except requests.RequestException as e:
+                    stats.record_failure(type(e).__name__)
+                    failed.extend(targets[url])
+                    continue
+                
+                stats.fetched += 1
+                pending.extend({'item_id': item_id, 'price': price} for item_id in targets[url])
+                if len(pending) >= self.batch_size:
+                    self._write(pending, stats)
+                    pending = []
+        
+        self._write(pending, stats)
+        if failed:
+            mark_check_failed(failed)
+            db.session.commit()
+        return stats
+
+    def _write(self, observations, stats):
+        for result in ingest_prices(observations, self.batch_size):
+            if result['status'] == 'updated':
+                stats.updated += 1
+            elif result['status'] == 'unchanged':
+                stats.unchanged += 1
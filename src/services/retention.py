@@ -0,0 +1,116 @@
+from flask import current_app, has_app_context
+from sqlalchemy import insert, delete
+from src.models.models import db, Notification, ArchivedNotification, OutboxEvent, OutboxStatus
+from src.services.notifications import adjust_unread
+from src.services.watermarks import touch_users
+from collections import Counter
+from datetime import datetime, timedelta
+import time
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_ARCHIVE_AFTER_DAYS = 30
+DEFAULT_DELETE_AFTER_DAYS = 365
+
+ARCHIVED_COLUMNS = ('id', 'type', 'message', 'is_read', 'occurrences', 'created_at', 'updated_at', 'user_id', 'item_id')
+
+def retention_policy():
+    """(archive_after_days, delete_after_days) from the app config; 0 disables a step"""
+    config = current_app.config if has_app_context() else {}
+    return (config.get('NOTIFICATION_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS),
+            config.get('NOTIFICATION_DELETE_AFTER_DAYS', DEFAULT_DELETE_AFTER_DAYS))
+
+def _chunks(query, chunk_size, pause):
+    """Yield chunks of an ordered query until it is exhausted, committing after each chunk.
+    
+    Each chunk is its own short transaction, so the job holds locks briefly
+    and an interrupted run loses nothing: the next run picks up the rows
+    that are still left.
+    """
+    while True:
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        db.session.commit()
+        if len(rows) < chunk_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+def archive_notifications(cutoff, chunk_size=DEFAULT_CHUNK_SIZE, pause=0):
+    """Move read notifications created before cutoff into the archive table"""
+    archived = 0
+    columns = [getattr(Notification, column) for column in ARCHIVED_COLUMNS]
+    query = db.session.query(*columns).filter(
+        Notification.is_read.is_(True), Notification.created_at < cutoff
+    ).order_by(Notification.id)
+    now = datetime.utcnow()
+    for rows in _chunks(query, chunk_size, pause):
+        db.session.execute(insert(ArchivedNotification), [
+            dict(row._asdict(), archived_at=now) for row in rows
+        ])
+        db.session.execute(delete(Notification).where(Notification.id.in_([row.id for row in rows])))
+        touch_users(row.user_id for row in rows)
+        archived += len(rows)
+    return archived
+
+def delete_notifications(cutoff, chunk_size=DEFAULT_CHUNK_SIZE, pause=0):
+    """Delete live notifications created before cutoff, read or not"""
+    deleted = 0
+    query = db.session.query(Notification.id, Notification.user_id, Notification.is_read).filter(
+        Notification.created_at < cutoff
+    ).order_by(Notification.id)
+    for rows in _chunks(query, chunk_size, pause):
+        db.session.execute(delete(Notification).where(Notification.id.in_([row.id for row in rows])))
+        adjust_unread({user_id: -count for user_id, count in
+                       Counter(row.user_id for row in rows if not row.is_read).items()})
+        touch_users(row.user_id for row in rows)
+        deleted += len(rows)
+    return deleted
+
+def delete_archived_notifications(cutoff, chunk_size=DEFAULT_CHUNK_SIZE, pause=0):
+    """Delete archived notifications created before cutoff"""
+    deleted = 0
+    query = db.session.query(ArchivedNotification.id).filter(
+        ArchivedNotification.created_at < cutoff
+    ).order_by(ArchivedNotification.id)
+    for rows in _chunks(query, chunk_size, pause):
+        db.session.execute(delete(ArchivedNotification).where(
+            ArchivedNotification.id.in_([row.id for row in rows])
+        ))
+        deleted += len(rows)
+    return deleted
+
+def delete_processed_outbox_events(cutoff, chunk_size=DEFAULT_CHUNK_SIZE, pause=0):
+    """Delete delivered outbox events processed before cutoff"""
+    deleted = 0
+    query = db.session.query(OutboxEvent.id).filter(
+        OutboxEvent.status == OutboxStatus.DONE, OutboxEvent.processed_at < cutoff
+    ).order_by(OutboxEvent.id)
+    for rows in _chunks(query, chunk_size, pause):
+        db.session.execute(delete(OutboxEvent).where(OutboxEvent.id.in_([row.id for row in rows])))
+        deleted += len(rows)
+    return deleted
+
+def apply_retention(archive_after_days=None, delete_after_days=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    pause=0, now=None):
+    """Run the retention policy: archive old read notifications, then delete expired ones.
+    
+    Days default to the configured policy. Delivered outbox events follow the
+    archive cutoff since nothing reads them once processed.
+    """
+    configured_archive, configured_delete = retention_policy()
+    archive_after_days = configured_archive if archive_after_days is None else archive_after_days
+    delete_after_days = configured_delete if delete_after_days is None else delete_after_days
+    now = now or datetime.utcnow()
+    
+    summary = {'archived': 0, 'deleted': 0, 'archive_deleted': 0, 'outbox_deleted': 0}
+    if archive_after_days:
+        cutoff = now - timedelta(days=archive_after_days)
+        summary['archived'] = archive_notifications(cutoff, chunk_size, pause)
+        summary['outbox_deleted'] = delete_processed_outbox_events(cutoff, chunk_size, pause)
+    if delete_after_days:
+        cutoff = now - timedelta(days=delete_after_days)
+        summary['deleted'] = delete_notifications(cutoff, chunk_size, pause)
+        summary['archive_deleted'] = delete_archived_notifications(cutoff, chunk_size, pause)
+    return summary
@@ -0,0 +1,267 @@
+from sqlalchemy import insert, update, case, and_, or_, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from src.models.models import db, PriceHistory, PriceRollup
+from src.services.pagination import encode_cursor, decode_cursor, decode_keyset_cursor, cursor_datetime, DEFAULT_LIMIT, MAX_LIMIT
+from datetime import datetime, timedelta
+
+RESOLUTIONS = ('hour', 'day', 'week')
+EMBED_MODES = ('none', 'summary', 'latest', 'full')
+
+def bucket_start(resolution, moment):
+    """Start of the resolution bucket containing moment (weeks start on Monday)"""
+    if resolution == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if resolution == 'day':
+        return day
+    return day - timedelta(days=day.weekday())
+
+def _new_bucket(item_id, resolution, start, price):
+    return {
+        'item_id': item_id,
+        'resolution': resolution,
+        'bucket_start': start,
+        'open_price': price,
+        'high_price': price,
+        'low_price': price,
+        'close_price': price,
+        'count': 1
+    }
+
+def _fold_row(bucket, price):
+    bucket['high_price'] = max(bucket['high_price'], price)
+    bucket['low_price'] = min(bucket['low_price'], price)
+    bucket['close_price'] = price
+    bucket['count'] += 1
+
+def _merged(new):
+    """Column updates merging a new bucket into the stored one; new holds its values or columns"""
+    return {
+        'high_price': case((new['high_price'] > PriceRollup.high_price, new['high_price']), else_=PriceRollup.high_price),
+        'low_price': case((new['low_price'] < PriceRollup.low_price, new['low_price']), else_=PriceRollup.low_price),
+        'close_price': new['close_price'],
+        'count': PriceRollup.count + new['count']
+    }
+
+def _upsert_buckets(rows):
+    """Insert new buckets and merge the others into the stored ones in the database.
+    
+    The merge happens in the statement itself, so concurrent writers folding
+    into the same bucket neither collide on the unique key nor lose updates.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        statement = mysql.insert(PriceRollup)
+        statement = statement.on_duplicate_key_update(_merged(statement.inserted))
+    elif dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(PriceRollup)
+        statement = statement.on_conflict_do_update(
+            index_elements=[PriceRollup.item_id, PriceRollup.resolution, PriceRollup.bucket_start],
+            set_=_merged(statement.excluded)
+        )
+    else:
+        # Without an upsert, merge one bucket at a time and insert the ones still missing
+        for row in rows:
+            result = db.session.execute(
+                update(PriceRollup)
+                .where(PriceRollup.item_id == row['item_id'], PriceRollup.resolution == row['resolution'],
+                       PriceRollup.bucket_start == row['bucket_start'])
+                .values(_merged(row))
+                .execution_options(synchronize_session=False)
+            )
+            if not result.rowcount:
+                db.session.execute(insert(PriceRollup), [row])
+        return
+    db.session.execute(statement, rows)
+
+def update_rollups(observations):
+    """Fold (item_id, price, observed_at) observations into every rollup tier.
+    
+    Observations are first combined per bucket, then written with one upsert
+    that creates the missing buckets and merges into the existing ones.
+    """
+    observations = sorted(observations, key=lambda o: o[2])
+    if not observations:
+        return
+    
+    buckets = {}
+    for item_id, price, observed_at in observations:
+        for resolution in RESOLUTIONS:
+            key = (item_id, resolution, bucket_start(resolution, observed_at))
+            if key in buckets:
+                _fold_row(buckets[key], price)
+            else:
+                buckets[key] = _new_bucket(*key, price)
+    
+    _upsert_buckets(list(buckets.values()))
+
+def _run_observations(price, recorded_at, last_seen, observation_count):
+    """(price, observed_at) of each observation in a run.
+    
+    Only the first and last observation times of a run are stored, so the
+    re-checks in between are placed evenly across it.
+    """
+    count = observation_count or 1
+    last_seen = last_seen or recorded_at
+    if count == 1:
+        return [(price, recorded_at)]
+    step = (last_seen - recorded_at) / (count - 1)
+    return [(price, recorded_at + step * index) for index in range(count)]
+
+def rebuild_rollups(item_ids=None):
+    """Recompute rollups from the raw price history, one item at a time.
+    
+    Every observation of a run counts, re-checks included. Returns the number
+    of items rebuilt. Each item is committed on its own so an interrupted
+    rebuild can simply be run again.
+    """
+    if item_ids is None:
+        item_ids = [row[0] for row in db.session.query(PriceHistory.item_id).distinct()]
+    
+    rebuilt = 0
+    for item_id in item_ids:
+        PriceRollup.query.filter_by(item_id=item_id).delete(synchronize_session=False)
+        
+        history = db.session.query(
+            PriceHistory.price, PriceHistory.recorded_at, PriceHistory.last_seen, PriceHistory.observation_count
+        ).filter_by(item_id=item_id).order_by(PriceHistory.recorded_at)
+        
+        buckets = {}
+        for run in history:
+            for price, observed_at in _run_observations(*run):
+                for resolution in RESOLUTIONS:
+                    key = (resolution, bucket_start(resolution, observed_at))
+                    if key in buckets:
+                        _fold_row(buckets[key], price)
+                    else:
+                        buckets[key] = _new_bucket(item_id, resolution, key[1], price)
+        
+        if buckets:
+            db.session.execute(insert(PriceRollup), list(buckets.values()))
+        db.session.commit()
+        rebuilt += 1
+    
+    return rebuilt
+
+def parse_history_args(args):
+    """Read resolution/from/to query parameters; raises ValueError on bad input"""
+    resolution = args.get('resolution', 'raw')
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        raise ValueError(f"Invalid resolution. Must be one of: {['raw', *RESOLUTIONS]}")
+    
+    window = []
+    for name in ('from', 'to'):
+        value = args.get(name)
+        try:
+            window.append(datetime.fromisoformat(value) if value else None)
+        except ValueError:
+            raise ValueError(f"Invalid '{name}' timestamp, expected ISO 8601")
+    
+    return resolution, window[0], window[1]
+
+def parse_embed(args):
+    """Read embed=none|summary|latest:N|full as (mode, n); raises ValueError on bad input.
+    
+    Without embed, explicit history parameters ask for the history itself and
+    anything else gets the summary.
+    """
+    value = args.get('embed')
+    if value is None:
+        explicit = any(args.get(name) for name in ('resolution', 'from', 'to', 'limit', 'after'))
+        return ('full', None) if explicit else ('summary', None)
+    
+    mode, _, count = value.partition(':')
+    if mode not in EMBED_MODES or bool(count) != (mode == 'latest'):
+        raise ValueError("Invalid embed. Must be one of: ['none', 'summary', 'latest:<n>', 'full']")
+    if mode != 'latest':
+        return mode, None
+    try:
+        count = int(count)
+    except ValueError:
+        raise ValueError('embed=latest:<n> needs an integer')
+    if count < 1:
+        raise ValueError('embed=latest:<n> needs a positive integer')
+    return mode, min(count, MAX_LIMIT)
+
+def summarize_history(item_id, start=None, end=None):
+    """Observation count, min/max/average price and first/last observation times, from one aggregate query"""
+    observations = func.coalesce(PriceHistory.observation_count, 1)
+    last_seen = func.coalesce(PriceHistory.last_seen, PriceHistory.recorded_at)
+    query = db.session.query(
+        func.count(PriceHistory.id),
+        func.sum(observations),
+        func.min(PriceHistory.price),
+        func.max(PriceHistory.price),
+        func.sum(PriceHistory.price * observations),
+        func.min(PriceHistory.recorded_at),
+        func.max(last_seen)
+    ).filter(PriceHistory.item_id == item_id)
+    if start:
+        query = query.filter(PriceHistory.recorded_at >= start)
+    if end:
+        query = query.filter(PriceHistory.recorded_at <= end)
+    
+    runs, count, low, high, total, first_seen, last_seen = query.one()
+    return {
+        'count': int(count or 0),
+        'changes': runs,
+        'min': low,
+        'max': high,
+        'avg': round(total / count, 2) if count else None,
+        'first_seen': first_seen,
+        'last_seen': last_seen
+    }
+
+def query_history(item_id, resolution='raw', start=None, end=None, limit=DEFAULT_LIMIT, after=None):
+    """Price history for an item, newest first, from the raw rows or a rollup tier.
+    
+    Returns (rows, next_cursor). Pages are read by keyset on (recorded_at, id)
+    for raw rows or bucket_start for rollups, so each page is a bounded index
+    range scan; next_cursor is None on the last page. limit=None reads the
+    whole history. Raises ValueError for a malformed cursor.
+    """
+    if resolution == 'raw':
+        query = PriceHistory.query.filter_by(item_id=item_id)
+        column = PriceHistory.recorded_at
+        order = (PriceHistory.recorded_at.desc(), PriceHistory.id.desc())
+    else:
+        query = PriceRollup.query.filter_by(item_id=item_id, resolution=resolution)
+        column = PriceRollup.bucket_start
+        order = (PriceRollup.bucket_start.desc(),)
+        # Include the bucket that contains the start of the window
+        if start:
+            start = bucket_start(resolution, start)
+    
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column <= end)
+    
+    if after:
+        if resolution == 'raw':
+            recorded_at, last_id = decode_keyset_cursor(after)
+            query = query.filter(
+                PriceHistory.recorded_at <= recorded_at,
+                or_(PriceHistory.recorded_at < recorded_at,
+                    and_(PriceHistory.recorded_at == recorded_at, PriceHistory.id < last_id))
+            )
+        else:
+            last_start, = decode_cursor(after, 1)
+            query = query.filter(PriceRollup.bucket_start < cursor_datetime(last_start))
+    
+    query = query.order_by(*order)
+    if limit is None:
+        return [row.to_dict() for row in query.all()], None
+    
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        if resolution == 'raw':
+            next_cursor = encode_cursor(last.recorded_at, last.id)
+        else:
+            next_cursor = encode_cursor(last.bucket_start)
+    
+    return [row.to_dict() for row in rows], next_cursor
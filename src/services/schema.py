@@ -0,0 +1,83 @@
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.schema import CreateColumn, DefaultClause
+from src.models.models import db
+
+def _server_default(column):
+    """The column's server default, or its scalar Python default as one so existing rows get a value"""
+    if column.server_default is not None:
+        return column.server_default
+    value = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if isinstance(value, (bool, int, float)):
+        return DefaultClause(text(str(int(value) if isinstance(value, bool) else value)))
+    return None
+
+def _column_ddl(column, dialect):
+    # A detached copy, so the default only applies to this ALTER and not to the model
+    copy = db.Column(column.name, column.type, nullable=column.nullable, server_default=_server_default(column))
+    Table(column.table.name, MetaData(), copy)
+    return str(CreateColumn(copy).compile(dialect=dialect))
+
+def _rebuild_sqlite_table(connection, table):
+    """Recreate a table from its model, copying the rows over; SQLite cannot alter a column in place"""
+    preparer = connection.dialect.identifier_preparer
+    old_name = preparer.quote(f'_{table.name}_old')
+    names = ', '.join(preparer.quote(column.name) for column in table.columns)
+    # Index names are global in SQLite, so the old ones must go before the new table takes them
+    for index in inspect(connection).get_indexes(table.name):
+        connection.execute(text(f'DROP INDEX {preparer.quote(index["name"])}'))
+    connection.execute(text(f'ALTER TABLE {preparer.format_table(table)} RENAME TO {old_name}'))
+    table.create(connection)
+    connection.execute(text(f'INSERT INTO {preparer.format_table(table)} ({names}) SELECT {names} FROM {old_name}'))
+    connection.execute(text(f'DROP TABLE {old_name}'))
+
+def _drop_not_null(connection, table, columns):
+    dialect = connection.dialect
+    name = dialect.identifier_preparer.format_table(table)
+    if dialect.name == 'sqlite':
+        _rebuild_sqlite_table(connection, table)
+        return
+    for column in columns:
+        if dialect.name in ('mysql', 'mariadb'):
+            connection.execute(text(f'ALTER TABLE {name} MODIFY {_column_ddl(column, dialect)}'))
+        else:
+            column_name = dialect.identifier_preparer.quote(column.name)
+            connection.execute(text(f'ALTER TABLE {name} ALTER COLUMN {column_name} DROP NOT NULL'))
+
+def upgrade_schema():
+    """Bring an existing database up to date with the models; returns a description of each change.
+    
+    create_all only creates missing tables. This also adds missing columns
+    (existing rows get the column's scalar default), drops NOT NULL where a
+    model column became nullable and creates missing indexes. A database that
+    is already up to date is left alone, so it is safe to run again.
+    """
+    db.create_all()
+    changes = []
+    with db.engine.begin() as connection:
+        dialect = connection.dialect
+        for table in db.metadata.sorted_tables:
+            columns = {column['name']: column for column in inspect(connection).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    connection.execute(text(
+                        f'ALTER TABLE {dialect.identifier_preparer.format_table(table)} ADD COLUMN {_column_ddl(column, dialect)}'
+                    ))
+                    changes.append(f'added column {table.name}.{column.name}')
+            
+            indexes = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+            missing = [index for index in table.indexes if index.name not in indexes]
+            
+            relaxed = [column for column in table.columns if column.name in columns and column.nullable
+                       and not column.primary_key and not columns[column.name]['nullable']]
+            if relaxed:
+                # Missing columns were added above, so every model column exists by now
+                _drop_not_null(connection, table, relaxed)
+                changes.extend(f'made {table.name}.{column.name} nullable' for column in relaxed)
+            
+            if missing:
+                for index in missing:
+                    index.create(connection, checkfirst=True)
+                # Dialect-specific indexes, such as the MySQL FULLTEXT one, are skipped elsewhere
+                indexes = {index['name'] for index in inspect(connection).get_indexes(table.name)}
+                changes.extend(f'created index {index.name}' for index in missing if index.name in indexes)
+    return changes
@@ -0,0 +1,203 @@
+from flask import current_app, has_app_context
+from sqlalchemy import DDL, event, inspect, text
+from src.models.models import db, WishlistItem
+from src.services.watermarks import get_watermark
+from bisect import bisect_left
+import heapq
+import re
+import threading
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+SEARCH_BACKENDS = ('auto', 'fts5', 'fulltext', 'memory')
+
+# Matches in the name weigh more than matches in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Declared on WishlistItem for MySQL
+FULLTEXT_INDEX = 'ix_wishlist_item_fulltext'
+
+_create_lock = threading.Lock()
+
+# SQLite keeps an external-content FTS5 table in sync with wishlist_item through triggers
+_SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS wishlist_item_fts USING fts5(
+        name, description, content='wishlist_item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS wishlist_item_fts_insert AFTER INSERT ON wishlist_item BEGIN
+        INSERT INTO wishlist_item_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS wishlist_item_fts_delete AFTER DELETE ON wishlist_item BEGIN
+        INSERT INTO wishlist_item_fts(wishlist_item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS wishlist_item_fts_update AFTER UPDATE OF name, description ON wishlist_item BEGIN
+        INSERT INTO wishlist_item_fts(wishlist_item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO wishlist_item_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+for statement in _SQLITE_FTS:
+    event.listen(WishlistItem.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(WishlistItem.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS wishlist_item_fts').execute_if(dialect='sqlite'))
+
+def tokenize(value):
+    return [token.lower() for token in TOKEN_PATTERN.findall(value or '')]
+
+def search_backend():
+    """The configured search backend, resolving 'auto' from the database dialect"""
+    backend = current_app.config.get('SEARCH_BACKEND', 'auto') if has_app_context() else 'auto'
+    if backend not in SEARCH_BACKENDS:
+        raise ValueError(f'Unsupported search backend: {backend}')
+    if backend != 'auto':
+        return backend
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return 'fts5'
+    if dialect in ('mysql', 'mariadb'):
+        return 'fulltext'
+    return 'memory'
+
+def _search_fts5(user_id, terms, limit, offset):
+    # Every term must match, each as a prefix
+    query = ' '.join(f'"{term}"*' for term in terms)
+    rows = db.session.execute(text(
+        f"""SELECT wishlist_item.id, -bm25(wishlist_item_fts, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}) AS score
+        FROM wishlist_item_fts JOIN wishlist_item ON wishlist_item.id = wishlist_item_fts.rowid
+        WHERE wishlist_item_fts MATCH :query AND wishlist_item.user_id = :user_id
+        ORDER BY score DESC, wishlist_item.id LIMIT :limit OFFSET :offset"""
+    ), {'query': query, 'user_id': user_id, 'limit': limit, 'offset': offset})
+    return [(row.id, row.score) for row in rows]
+
+def _search_fulltext(user_id, terms, limit, offset):
+    # Boolean mode: every term required, each as a prefix
+    query = ' '.join(f'+{term}*' for term in terms)
+    rows = db.session.execute(text(
+        """SELECT id, MATCH(name, description) AGAINST (:query IN BOOLEAN MODE) AS score
+        FROM wishlist_item
+        WHERE user_id = :user_id AND MATCH(name, description) AGAINST (:query IN BOOLEAN MODE)
+        ORDER BY score DESC, id LIMIT :limit OFFSET :offset"""
+    ), {'query': query, 'user_id': user_id, 'limit': limit, 'offset': offset})
+    return [(row.id, row.score) for row in rows]
+
+class InvertedIndex:
+    """In-process token index of wishlist items, loaded per user on first search.
+    
+    Used where the database has no full-text index. Each user's index is
+    tagged with their change watermark and reloaded once it moves, so writes
+    committed by any process show up in the next search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = {}
+
+    def _load(self, user_id):
+        postings = {}
+        documents = {}
+        rows = db.session.query(WishlistItem.id, WishlistItem.name, WishlistItem.description).filter(
+            WishlistItem.user_id == user_id
+        )
+        for item_id, name, description in rows:
+            self._add(postings, documents, item_id, name, description)
+        return {'postings': postings, 'documents': documents, 'tokens': sorted(postings)}
+
+    @staticmethod
+    def _add(postings, documents, item_id, name, description):
+        weights = {}
+        for token in tokenize(name):
+            weights[token] = weights.get(token, 0) + NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] = weights.get(token, 0) + DESCRIPTION_WEIGHT
+        documents[item_id] = list(weights)
+        for token, weight in weights.items():
+            postings.setdefault(token, {})[item_id] = weight
+
+    @staticmethod
+    def _remove(postings, documents, item_id):
+        for token in documents.pop(item_id, ()):
+            entries = postings.get(token)
+            if entries is not None:
+                entries.pop(item_id, None)
+                if not entries:
+                    del postings[token]
+
+    def search(self, user_id, terms, limit, offset):
+        # Read the watermark first so a write racing the load only costs a reload
+        watermark = get_watermark(user_id)
+        tag = watermark[0] if watermark else None
+        with self._lock:
+            index = self._users.get(user_id)
+        if index is None or index['tag'] != tag:
+            index = dict(self._load(user_id), tag=tag)
+            with self._lock:
+                self._users[user_id] = index
+        
+        with self._lock:
+            scores = None
+            for term in terms:
+                # Every indexed token starting with the term counts as a match
+                matches = {}
+                position = bisect_left(index['tokens'], term)
+                while position < len(index['tokens']) and index['tokens'][position].startswith(term):
+                    for item_id, weight in index['postings'][index['tokens'][position]].items():
+                        matches[item_id] = matches.get(item_id, 0) + weight
+                    position += 1
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {item_id: score + matches[item_id] for item_id, score in scores.items() if item_id in matches}
+        
+        ranked = heapq.nsmallest(offset + limit, (scores or {}).items(), key=lambda entry: (-entry[1], entry[0]))
+        return ranked[offset:]
+
+    def rebuild(self):
+        with self._lock:
+            self._users.clear()
+
+def get_memory_index(app=None):
+    app = app or current_app._get_current_object()
+    index = app.extensions.get('search_index')
+    if index is None:
+        with _create_lock:
+            index = app.extensions.setdefault('search_index', InvertedIndex())
+    return index
+
+def search_items(user_id, query, limit, offset=0):
+    """Ranked (item_id, score) matches of a user's items for a search string, best first"""
+    terms = tokenize(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == 'fts5':
+        return _search_fts5(user_id, terms, limit, offset)
+    if backend == 'fulltext':
+        return _search_fulltext(user_id, terms, limit, offset)
+    return get_memory_index().search(int(user_id), terms, limit, offset)
+
+def _ensure_fulltext_index():
+    if FULLTEXT_INDEX in {index['name'] for index in inspect(db.engine).get_indexes(WishlistItem.__tablename__)}:
+        return
+    index = next(index for index in WishlistItem.__table__.indexes if index.name == FULLTEXT_INDEX)
+    index.create(db.engine)
+
+def rebuild_search_index():
+    """Rebuild the index of the active backend from the items table.
+    
+    The FTS5 table and triggers or the FULLTEXT index are created first when
+    the database predates them, since create_all only adds them to new tables.
+    """
+    backend = search_backend()
+    if backend == 'fts5':
+        for statement in _SQLITE_FTS:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO wishlist_item_fts(wishlist_item_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    elif backend == 'fulltext':
+        # MySQL maintains FULLTEXT indexes itself once they exist
+        _ensure_fulltext_index()
+    else:
+        get_memory_index().rebuild()
+    return backend
@@ -0,0 +1,89 @@
+from sqlalchemy import func
+from src.models.models import db, WishlistItem, Category, Coupon
+from src.services.notifications import unread_count
+from src.services.watermarks import get_watermark_cache
+from datetime import datetime
+
+def _money(value):
+    return round(float(value or 0), 2)
+
+def _nulls_last(value):
+    return (value is None, value or 0)
+
+def _totals(count=0, current=0, initial=0):
+    return {
+        'count': count,
+        'current_value': _money(current),
+        'initial_value': _money(initial),
+        'savings': _money((initial or 0) - (current or 0))
+    }
+
+def compute_summary(user_id, now=None):
+    """Dashboard counts and totals of a user's wishlist, from two aggregate queries and the unread counter"""
+    now = now or datetime.utcnow()
+    
+    # Everything about items comes from one GROUP BY over (category, priority, purchased)
+    priced = WishlistItem.current_price.isnot(None) & WishlistItem.initial_price.isnot(None)
+    rows = db.session.query(
+        WishlistItem.category_id,
+        Category.name,
+        WishlistItem.priority,
+        WishlistItem.is_purchased,
+        func.count(WishlistItem.id).label('count'),
+        func.sum(db.case((priced, WishlistItem.current_price), else_=0)).label('current'),
+        func.sum(db.case((priced, WishlistItem.initial_price), else_=0)).label('initial'),
+        func.sum(db.case((WishlistItem.price_drop_pct > 0, 1), else_=0)).label('drops')
+    ).outerjoin(Category, Category.id == WishlistItem.category_id).filter(
+        WishlistItem.user_id == user_id
+    ).group_by(WishlistItem.category_id, Category.name, WishlistItem.priority, WishlistItem.is_purchased).all()
+    
+    by_category = {}
+    by_priority = {}
+    sums = {True: [0, 0, 0], False: [0, 0, 0]}
+    active_drops = 0
+    for row in rows:
+        category = by_category.setdefault(row.category_id, {
+            'category_id': row.category_id, 'name': row.name, 'count': 0
+        })
+        category['count'] += row.count
+        by_priority[row.priority] = by_priority.get(row.priority, 0) + row.count
+        totals = sums[bool(row.is_purchased)]
+        totals[0] += row.count
+        totals[1] += row.current or 0
+        totals[2] += row.initial or 0
+        # A drop on something already bought is no longer actionable
+        if not row.is_purchased:
+            active_drops += row.drops or 0
+    
+    active_coupons = db.session.query(func.count(Coupon.id)).join(
+        WishlistItem, WishlistItem.id == Coupon.item_id
+    ).filter(WishlistItem.user_id == user_id, Coupon.is_active(now)).scalar()
+    
+    summary = {
+        'user_id': user_id,
+        'items': {
+            'total': sum(totals[0] for totals in sums.values()),
+            'by_category': sorted(by_category.values(), key=lambda entry: _nulls_last(entry['category_id'])),
+            'by_priority': [{'priority': priority, 'count': by_priority[priority]}
+                            for priority in sorted(by_priority, key=_nulls_last)]
+        },
+        'purchased': _totals(*sums[True]),
+        'unpurchased': _totals(*sums[False]),
+        'total': _totals(*(a + b for a, b in zip(sums[True], sums[False]))),
+        'active_drops': int(active_drops),
+        'active_coupons': active_coupons,
+        'unread_notifications': unread_count(user_id),
+        'computed_at': now
+    }
+    return summary
+
+def get_summary_cache(app=None):
+    """The summary cache of the current app, or None when caching is disabled"""
+    return get_watermark_cache('summary_cache', 'SUMMARY_CACHE_TTL', app)
+
+def wishlist_summary(user_id):
+    """The dashboard summary of a user, cached until their data changes when enabled"""
+    cache = get_summary_cache()
+    if cache is None:
+        return compute_summary(user_id)
+    return cache.fetch(user_id, compute_summary)
@@ -0,0 +1,239 @@
+from flask import current_app, request, make_response
+from sqlalchemy import event, insert, update, select, func, case
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from src.models.models import (db, ChangeWatermark, User, WishlistItem, PriceHistory, Coupon, CouponStatus,
+                               Notification, ArchivedNotification, AlertRule)
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import threading
+import time
+
+# Session.info key for the users and items whose owners' watermarks move on commit
+PENDING_CHANGES = 'pending_watermark_changes'
+
+# Instances carrying their owner directly, and those owned through their item
+USER_OWNED = (WishlistItem, Notification, ArchivedNotification, AlertRule)
+ITEM_OWNED = (PriceHistory, Coupon)
+
+_create_lock = threading.Lock()
+
+def _pending(session):
+    return session.info.setdefault(PENDING_CHANGES, (set(), set()))
+
+def touch_users(user_ids):
+    """Bump these users' watermarks when the current transaction commits, for bulk writes the ORM does not see"""
+    _pending(db.session)[0].update(user_ids)
+
+def touch_items(item_ids):
+    """Bump the watermarks of these items' owners when the current transaction commits"""
+    _pending(db.session)[1].update(item_ids)
+
+def _insert_watermarks(session, rows):
+    """Insert first watermarks, bumping instead where a concurrent transaction inserted one first"""
+    dialect = session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        statement = mysql.insert(ChangeWatermark)
+        statement = statement.on_duplicate_key_update(
+            version=ChangeWatermark.version + 1, updated_at=statement.inserted.updated_at
+        )
+    elif dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite.insert if dialect == 'sqlite' else postgresql.insert)(ChangeWatermark)
+        statement = statement.on_conflict_do_update(
+            index_elements=[ChangeWatermark.user_id],
+            set_={'version': ChangeWatermark.version + 1, 'updated_at': statement.excluded.updated_at}
+        )
+    else:
+        statement = insert(ChangeWatermark)
+    session.execute(statement, rows)
+
+def _bump(session, user_ids, now=None):
+    """Advance the watermark of each user in the session's transaction, creating the missing ones"""
+    now = now or datetime.utcnow()
+    result = session.execute(
+        update(ChangeWatermark)
+        .where(ChangeWatermark.user_id.in_(user_ids))
+        .values(version=ChangeWatermark.version + 1, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == len(user_ids):
+        return
+    
+    # Users without a watermark yet, skipping any deleted in this transaction
+    existing = {row.user_id for row in session.query(ChangeWatermark.user_id).filter(
+        ChangeWatermark.user_id.in_(user_ids)
+    )}
+    missing = [row.id for row in session.query(User.id).filter(User.id.in_(user_ids - existing))]
+    if missing:
+        _insert_watermarks(session, [
+            {'user_id': user_id, 'version': 1, 'updated_at': now} for user_id in missing
+        ])
+
+def _coupon_epoch(user_id, now):
+    """Latest coupon start or end of a user's items that has already passed, as a scalar subquery.
+    
+    Coupons become active and expire as time passes, without any write; this
+    moment only ever moves forward, so it versions what time alone changes.
+    """
+    passed = case(
+        (Coupon.valid_until < now, Coupon.valid_until),
+        (Coupon.valid_from <= now, Coupon.valid_from)
+    )
+    return select(func.max(passed)).join(WishlistItem, WishlistItem.id == Coupon.item_id).where(
+        WishlistItem.user_id == user_id, Coupon.status == CouponStatus.ACTIVE
+    ).scalar_subquery()
+
+def get_watermark(user_id, now=None):
+    """(tag, last_modified) of a user's data, or None when nothing was recorded yet.
+    
+    The tag changes whenever a write commits or a coupon starts or ends, in
+    one indexed lookup.
+    """
+    now = now or datetime.utcnow()
+    row = db.session.query(
+        ChangeWatermark.version, ChangeWatermark.updated_at, _coupon_epoch(user_id, now)
+    ).filter(ChangeWatermark.user_id == user_id).first()
+    if row is None:
+        return None
+    version, updated_at, epoch = row
+    if epoch is None:
+        return str(version), updated_at
+    return f'{version}.{epoch:%Y%m%d%H%M%S%f}', max(updated_at, epoch)
+
+class WatermarkCache:
+    """Values computed per user, tagged with the change watermark they were computed at.
+    
+    An entry is served only while the user's watermark is unchanged, so any
+    committed write, from any process, and any coupon starting or ending makes
+    the next read recompute. Entries also lapse after the time to live.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, user_id, tag):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry['tag'] != tag or entry['expires'] <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            return entry['value']
+
+    def put(self, user_id, tag, value):
+        with self._lock:
+            self._entries[user_id] = {
+                'value': value,
+                'tag': tag,
+                'expires': time.monotonic() + self.ttl
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def fetch(self, user_id, compute):
+        """The value of a user, from the cache or computed with compute(user_id) and stored"""
+        # Read the watermark first so a write racing the computation only costs a recompute
+        watermark = get_watermark(user_id)
+        tag = watermark[0] if watermark else None
+        value = self.get(user_id, tag)
+        if value is None:
+            value = compute(user_id)
+            self.put(user_id, tag, value)
+        return value
+
+def get_watermark_cache(name, ttl_setting, app=None):
+    """The cache stored under name in the current app, or None when its time to live setting is 0"""
+    app = app or current_app._get_current_object()
+    ttl = app.config.get(ttl_setting, 0)
+    if not ttl:
+        return None
+    cache = app.extensions.get(name)
+    if cache is None:
+        with _create_lock:
+            cache = app.extensions.setdefault(name, WatermarkCache(ttl))
+    return cache
+
+def _etag(user_id, tag):
+    # The same watermark backs many URLs, so the tag also covers the path and query string
+    digest = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+    return f'{user_id}-{tag}-{digest}'
+
+def _not_modified(etag, updated_at):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and updated_at:
+        # Last-Modified has whole seconds, so only a change before that second is certainly older
+        return updated_at.replace(tzinfo=timezone.utc) < request.if_modified_since
+    return False
+
+def conditional_on_user(view):
+    """Answer a user-scoped GET with 304 when the user's watermark says nothing changed.
+    
+    The user comes from the user_id query argument; requests without one,
+    cross-user listings (all_users=true) and users without a watermark are
+    served as usual. Successful responses carry ETag and Last-Modified, both
+    moving with writes and with coupon starts and ends.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = request.args.get('user_id', type=int)
+        if user_id is None or request.args.get('all_users', 'false').lower() == 'true':
+            return view(*args, **kwargs)
+        
+        watermark = get_watermark(user_id)
+        if watermark is None:
+            return view(*args, **kwargs)
+        
+        tag, updated_at = watermark
+        etag = _etag(user_id, tag)
+        if _not_modified(etag, updated_at):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        
+        response.set_etag(etag, weak=True)
+        response.last_modified = updated_at
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    """Remember whose data a flush touched"""
+    user_ids, item_ids = _pending(session)
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, User):
+            user_ids.add(instance.id)
+        elif isinstance(instance, USER_OWNED):
+            user_ids.add(instance.user_id)
+        elif isinstance(instance, ITEM_OWNED):
+            item_ids.add(instance.item_id)
+
+@event.listens_for(Session, 'before_commit')
+def _bump_on_commit(session):
+    # Flush first so the final flush has nothing left to report
+    session.flush()
+    pending = session.info.pop(PENDING_CHANGES, None)
+    if not pending:
+        return
+    user_ids, item_ids = pending
+    item_ids -= {None}
+    if item_ids:
+        user_ids |= {row.user_id for row in session.query(WishlistItem.user_id).filter(
+            WishlistItem.id.in_(item_ids)
+        ).distinct()}
+    user_ids -= {None}
+    if user_ids:
+        _bump(session, user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop(PENDING_CHANGES, None)
@@ -3,10 +3,21 @@ import json
 import sys
 import os
 import uuid
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from src.main import app
-from src.models.models import db, User, Category, WishlistItem, PriceHistory, Coupon, Notification, CouponStatus
+from src.models.models import db, User, Category, WishlistItem, PriceHistory, PriceRollup, Coupon, Notification, NotificationCounter, CouponStatus, ChangeWatermark
+from src.services.refresher import PriceRefresher
+from src.services.outbox import enqueue, drain_outbox, retry_delay
+from src.services.retention import apply_retention
+from src.services.broker import MemoryBroker
+from src.services.rollups import update_rollups, rebuild_rollups
+from src.services.feed_import import normalize_url
+from src.services.pagination import encode_cursor
+from datetime import datetime, timedelta
 
 class WishlistAppTestCase(unittest.TestCase):
     """Test case for the wishlist app"""
@@ -234,6 +245,439 @@ class WishlistAppTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertGreaterEqual(len(data['price_drops']), 1)
     
+    def test_batch_price_update(self):
+        """Test batch price ingestion"""
+        item_ids = []
+        for name in ['Batch Item A', 'Batch Item B']:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={
+                    'name': name,
+                    'current_price': 100.00,
+                    'user_id': self.test_user_id
+                }
+            )
+            item_ids.append(json.loads(response.data)['item']['id'])
+        
+        # JSON array body, committed in chunks of one
+        response = self.client.post(
+            '/api/prices/update?chunk_size=1',
+            json=[
+                {'item_id': item_ids[0], 'price': 80.00},
+                {'item_id': item_ids[1], 'price': 100.00},
+                {'item_id': 999999, 'price': 10.00},
+                {'item_id': item_ids[1]}
+            ]
+        )
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['summary'], {'updated': 1, 'unchanged': 1, 'not_found': 1, 'invalid': 1})
+        self.assertTrue(data['results'][0]['price_drop'])
+        
+        # NDJSON body
+        response = self.client.post(
+            '/api/prices/update',
+            data=f'{{"item_id": {item_ids[1]}, "price": 120.0}}\n\n{{"item_id": {item_ids[0]}, "price": 70.0}}\n',
+            content_type='application/x-ndjson'
+        )
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['summary']['updated'], 2)
+        
+        response = self.client.get(f'/api/wishlist/{item_ids[1]}')
+        data = json.loads(response.data)
+        self.assertEqual(data['item']['highest_price'], 120.00)
+        
+        response = self.client.get(f'/api/notifications/?user_id={self.test_user_id}&type=price_drop')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['notifications']), 2)
+    
+    def test_price_rollups(self):
+        """Test rollup tiers on the price history endpoints"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Rollup Test Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        for price in [90.00, 95.00]:
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': price})
+        
+        # Re-checks of an unchanged price count as observations in the rollups too
+        for price in [95.00, 95.00, 95.00]:
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': price})
+        self.client.post('/api/prices/update', json=[{'item_id': item_id, 'price': 95.00}])
+        
+        response = self.client.get(f'/api/prices/history/{item_id}?resolution=day')
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['price_history']), 1)
+        bucket = data['price_history'][0]
+        self.assertEqual((bucket['open'], bucket['high'], bucket['low'], bucket['close'], bucket['count']),
+                         (100.00, 100.00, 90.00, 95.00, 7))
+        summary = json.loads(self.client.get(f'/api/wishlist/{item_id}?embed=summary').data)['item']['price_history_summary']
+        self.assertEqual(summary['count'], 7)
+        
+        # Rebuilding from the raw runs gives the same buckets
+        response = self.client.post(f'/api/prices/rollups/rebuild?item_id={item_id}')
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.get(f'/api/wishlist/{item_id}?resolution=week')
+        data = json.loads(response.data)
+        self.assertEqual(data['item']['price_history'][0]['count'], 7)
+        self.assertEqual(data['item']['price_history'][0]['close'], 95.00)
+        
+        response = self.client.get(f'/api/prices/history/{item_id}?from=2000-01-01&to=2000-01-02')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['price_history']), 0)
+        
+        response = self.client.get(f'/api/prices/history/{item_id}?resolution=minute')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_price_history_pagination(self):
+        """Test keyset pagination of price history"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Paged Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        for price in [91.00, 92.00, 93.00, 94.00]:
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': price})
+        
+        response = self.client.get(f'/api/prices/history/{item_id}')
+        all_ids = [h['id'] for h in json.loads(response.data)['price_history']]
+        self.assertEqual(len(all_ids), 5)
+        
+        paged_ids = []
+        url = f'/api/prices/history/{item_id}?limit=2'
+        while url:
+            data = json.loads(self.client.get(url).data)
+            self.assertLessEqual(len(data['price_history']), 2)
+            paged_ids.extend(h['id'] for h in data['price_history'])
+            url = f'/api/prices/history/{item_id}?limit=2&after={data["next_cursor"]}' if data['next_cursor'] else None
+        
+        self.assertEqual(paged_ids, all_ids)
+        
+        # Without a limit the history still comes one bounded page at a time
+        with app.app_context():
+            start = datetime(2024, 1, 1)
+            db.session.add_all(PriceHistory(item_id=item_id, price=50.00 + minute, recorded_at=start + timedelta(minutes=minute))
+                               for minute in range(60))
+            db.session.commit()
+        data = json.loads(self.client.get(f'/api/prices/history/{item_id}').data)
+        self.assertEqual(len(data['price_history']), 50)
+        self.assertIsNotNone(data['next_cursor'])
+        
+        response = self.client.get(f'/api/prices/history/{item_id}?limit=2&after=garbage')
+        self.assertEqual(response.status_code, 400)
+        
+        # Well-formed cursors holding values of the wrong type are rejected too
+        bad_cursor = encode_cursor('2020-01-01T00:00:00', {'a': 1})
+        response = self.client.get(f'/api/prices/history/{item_id}?limit=1&after={bad_cursor}')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/wishlist/{item_id}?embed=full&after={bad_cursor}')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_price_analytics(self):
+        """Test price analytics over a user's wishlist"""
+        item_ids = []
+        for name in ['Analytics Item', 'Untracked Item']:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={
+                    'name': name,
+                    'current_price': 100.00 if name == 'Analytics Item' else None,
+                    'user_id': self.test_user_id
+                }
+            )
+            item_ids.append(json.loads(response.data)['item']['id'])
+        
+        for price in [80.00, 120.00]:
+            self.client.post(f'/api/prices/update/{item_ids[0]}', json={'price': price})
+        
+        response = self.client.get(f'/api/prices/analytics?user_id={self.test_user_id}&window=2')
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        metrics = {m['item_id']: m for m in data['analytics']}
+        tracked = metrics[item_ids[0]]
+        self.assertEqual(tracked['observations'], 3)
+        self.assertEqual(tracked['moving_average'], 100.00)
+        self.assertEqual(tracked['all_time_low'], 80.00)
+        self.assertEqual(tracked['all_time_low_distance_pct'], 50.00)
+        self.assertIsNotNone(tracked['days_since_last_drop'])
+        self.assertTrue(0 <= tracked['likely_to_drop_score'] <= 1)
+        
+        untracked = metrics[item_ids[1]]
+        self.assertEqual(untracked['observations'], 0)
+        self.assertIsNone(untracked['moving_average'])
+    
+    def test_price_feed_import(self):
+        """Test importing a retailer price feed matched by URL"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Feed Item',
+                'url': 'https://www.example.com/p/123/?utm_source=mail',
+                'current_price': 50.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        feed = 'url,price\nhttp://example.com/p/123,45.00\nhttp://example.com/p/999,10.00\nhttp://example.com/p/123,oops\n'
+        response = self.client.post(
+            '/api/prices/import-feed?chunk_size=1',
+            data=gzip.compress(feed.encode()),
+            content_type='text/csv'
+        )
+        data = json.loads(response.data)
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['summary']['rows'], 3)
+        self.assertEqual(data['summary']['matched'], 1)
+        self.assertEqual(data['summary']['unmatched'], 1)
+        self.assertEqual(data['summary']['invalid'], 1)
+        self.assertEqual(data['summary']['updated'], 1)
+        
+        response = self.client.post(
+            '/api/prices/import-feed?format=ndjson',
+            data='{"url": "https://example.com/p/123", "price": 40}\n',
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(json.loads(response.data)['summary']['updated'], 1)
+        
+        response = self.client.get(f'/api/wishlist/{item_id}')
+        data = json.loads(response.data)
+        self.assertEqual(data['item']['current_price'], 40.00)
+        self.assertEqual(data['item']['lowest_price'], 40.00)
+    
+    def test_price_refresher(self):
+        """Test the price refresher against a local HTTP server"""
+        pages = {
+            '/meta': '<html><head><meta property="product:price:amount" content="79.50"></head></html>',
+            '/jsonld': '<script type="application/ld+json">{"@type": "Product", "offers": {"price": "1,299.00"}}</script>',
+            '/noprice': '<html><body>Sold out</body></html>'
+        }
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = pages.get(self.path)
+                self.send_response(200 if body else 404)
+                self.end_headers()
+                self.wfile.write((body or '').encode())
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+        
+        item_ids = {}
+        for path in ['/meta', '/jsonld', '/noprice', '/missing']:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={
+                    'name': f'Refresh {path}',
+                    'url': base + path,
+                    'current_price': 100.00,
+                    'user_id': self.test_user_id
+                }
+            )
+            item_ids[path] = json.loads(response.data)['item']['id']
+        
+        try:
+            with app.app_context():
+                stats = PriceRefresher(workers=4, per_domain_interval=0).run().to_dict()
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        self.assertEqual(stats['urls'], 4)
+        self.assertEqual(stats['fetched'], 2)
+        self.assertEqual(stats['updated'], 2)
+        self.assertEqual(stats['failures'], {'no_price': 1, 'http_404': 1})
+        self.assertEqual(stats['staleness']['never_checked'], 4)
+        
+        response = self.client.get(f'/api/wishlist/{item_ids["/jsonld"]}')
+        self.assertEqual(json.loads(response.data)['item']['current_price'], 1299.00)
+        
+        response = self.client.get('/api/prices/staleness')
+        data = json.loads(response.data)
+        self.assertEqual(data['staleness']['never_checked'], 2)
+        
+        # Failed fetches count as attempts, so broken URLs do not take every slot of a limited run
+        with app.app_context():
+            targets = PriceRefresher(workers=1).select_targets(limit=2)
+        self.assertEqual(sorted(ids[0] for ids in targets.values()),
+                         sorted([item_ids['/meta'], item_ids['/jsonld']]))
+    
+    def test_price_history_runs(self):
+        """Test unchanged observations extend the current history run"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Stable Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 100.00})
+        self.client.post('/api/prices/update', json=[
+            {'item_id': item_id, 'price': 100.00},
+            {'item_id': item_id, 'price': 100.00}
+        ])
+        
+        response = self.client.get(f'/api/prices/history/{item_id}')
+        data = json.loads(response.data)
+        
+        self.assertEqual(len(data['price_history']), 1)
+        self.assertEqual(data['price_history'][0]['observation_count'], 4)
+        self.assertIsNotNone(data['item']['price_checked_at'])
+        
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 90.00})
+        response = self.client.get(f'/api/prices/history/{item_id}')
+        data = json.loads(response.data)
+        self.assertEqual([h['observation_count'] for h in data['price_history']], [1, 4])
+        
+        # Analytics weigh every observation, not every row
+        response = self.client.get(f'/api/prices/analytics?user_id={self.test_user_id}&window=5')
+        metrics = json.loads(response.data)['analytics'][0]
+        self.assertEqual(metrics['observations'], 5)
+        self.assertEqual(metrics['moving_average'], 98.00)
+        
+        # A re-check before a change in the same batch belongs to the earlier run
+        self.client.post('/api/prices/update', json=[
+            {'item_id': item_id, 'price': 90.00},
+            {'item_id': item_id, 'price': 80.00},
+            {'item_id': item_id, 'price': 80.00}
+        ])
+        response = self.client.get(f'/api/prices/history/{item_id}')
+        data = json.loads(response.data)
+        self.assertEqual([(h['price'], h['observation_count']) for h in data['price_history']],
+                         [(80.00, 2), (90.00, 2), (100.00, 4)])
+        
+        response = self.client.get(f'/api/prices/analytics?user_id={self.test_user_id}&window=5')
+        metrics = json.loads(response.data)['analytics'][0]
+        self.assertEqual(metrics['observations'], 8)
+        self.assertEqual(metrics['moving_average'], 88.00)
+        self.assertEqual(metrics['volatility'], 4.78)
+        self.assertEqual(metrics['likely_to_drop_score'], 0.258)
+    
+    def test_alert_rules(self):
+        """Test price alert rules replace the notify-on-every-drop default"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Alert Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        for rule in [
+            {'rule_type': 'below', 'threshold': 80.00, 'item_id': item_id},
+            {'rule_type': 'drop_pct', 'threshold': 15},
+            {'rule_type': 'all_time_low'}
+        ]:
+            response = self.client.post('/api/alerts/', json={'user_id': self.test_user_id, **rule})
+            self.assertEqual(response.status_code, 201)
+        
+        response = self.client.post('/api/alerts/', json={'user_id': self.test_user_id, 'rule_type': 'below'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/alerts/', json={'user_id': self.test_user_id, 'rule_type': 'below', 'threshold': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        
+        # 100 -> 95: new all-time low only; 95 -> 78: crosses the target and drops over 15%
+        response = self.client.post('/api/prices/update', json=[
+            {'item_id': item_id, 'price': 95.00},
+            {'item_id': item_id, 'price': 78.00}
+        ])
+        results = json.loads(response.data)['results']
+        self.assertEqual(results[0]['alerts'], ['all_time_low'])
+        self.assertEqual(results[1]['alerts'], ['price_target', 'price_drop', 'all_time_low'])
+        
+        # 78 -> 120 -> 110: no rule matches a small drop above the low
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 120.00})
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 110.00})
+        
+        response = self.client.get(f'/api/notifications/?user_id={self.test_user_id}')
+        data = json.loads(response.data)
+        self.assertEqual(len(data['notifications']), 4)
+        
+        response = self.client.get(f'/api/alerts/?user_id={self.test_user_id}')
+        rules = json.loads(response.data)['alert_rules']
+        self.assertEqual(len(rules), 3)
+        response = self.client.put(f"/api/alerts/{rules[0]['id']}", json={'threshold': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        
+        # Deactivating every rule silences alerts rather than restoring the default
+        for rule in rules:
+            self.client.put(f"/api/alerts/{rule['id']}", json={'is_active': False})
+        response = self.client.post('/api/prices/update', json=[{'item_id': item_id, 'price': 50.00}])
+        self.assertEqual(json.loads(response.data)['results'][0]['alerts'], [])
+    
+    def test_price_drop_queries(self):
+        """Test SQL-side price drop filtering, sorting and top-K"""
+        item_ids = []
+        for name, price in [('Drop 10', 90.00), ('Drop 30', 70.00), ('Rise', 120.00)]:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={
+                    'name': name,
+                    'current_price': 100.00,
+                    'user_id': self.test_user_id
+                }
+            )
+            item_id = json.loads(response.data)['item']['id']
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': price})
+            item_ids.append(item_id)
+        
+        response = self.client.get(f'/api/wishlist/price-drops?user_id={self.test_user_id}')
+        data = json.loads(response.data)
+        self.assertEqual([d['name'] for d in data['price_drops']], ['Drop 30', 'Drop 10'])
+        self.assertAlmostEqual(data['price_drops'][0]['price_drop_percentage'], 30.0)
+        
+        response = self.client.get(f'/api/prices/drops?user_id={self.test_user_id}&sort=price&min_pct=5')
+        data = json.loads(response.data)
+        self.assertEqual([d['name'] for d in data['price_drops']], ['Drop 30', 'Drop 10'])
+        
+        response = self.client.get(f'/api/prices/drops?user_id={self.test_user_id}&min_pct=20')
+        self.assertEqual(len(json.loads(response.data)['price_drops']), 1)
+        
+        response = self.client.get('/api/prices/drops?all_users=true&limit=1')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([d['name'] for d in data['price_drops']], ['Drop 30'])
+        
+        response = self.client.get(f'/api/prices/drops?user_id={self.test_user_id}&sort=bogus')
+        self.assertEqual(response.status_code, 400)
+        
+        # The stored percentage can be rebuilt from the prices
+        with app.app_context():
+            db.session.execute(db.update(WishlistItem).values(price_drop_pct=0))
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=['wishlist', 'recompute-price-drops'])
+        self.assertIn('3 items', result.output)
+        response = self.client.get(f'/api/prices/drops?user_id={self.test_user_id}')
+        self.assertEqual(len(json.loads(response.data)['price_drops']), 2)
+    
     def test_coupon_endpoints(self):
         """Test coupon CRUD operations"""
         # Create item first
@@ -352,6 +796,868 @@ class WishlistAppTestCase(unittest.TestCase):
         
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(data['notifications']), 0)
+    
+    def test_notification_pagination(self):
+        """Test cursor pagination of the notification feed"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Feed Item',
+                'image_url': 'http://example.com/feed.png',
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        with app.app_context():
+            db.session.add_all([
+                Notification(type='test', message=f'Message {i}', user_id=self.test_user_id, item_id=item_id)
+                for i in range(5)
+            ])
+            db.session.commit()
+        
+        response = self.client.get(f'/api/notifications/?user_id={self.test_user_id}')
+        all_ids = [n['id'] for n in json.loads(response.data)['notifications']]
+        self.assertEqual(len(all_ids), 5)
+        
+        paged_ids = []
+        url = f'/api/notifications/?user_id={self.test_user_id}&limit=2'
+        while url:
+            data = json.loads(self.client.get(url).data)
+            for notification in data['notifications']:
+                self.assertEqual(notification['item_name'], 'Feed Item')
+                self.assertEqual(notification['item_image'], 'http://example.com/feed.png')
+            paged_ids.extend(n['id'] for n in data['notifications'])
+            url = f'/api/notifications/?user_id={self.test_user_id}&limit=2&before={data["next_cursor"]}' if data['next_cursor'] else None
+        
+        self.assertEqual(paged_ids, all_ids)
+        
+        bad_cursor = encode_cursor('2020-01-01T00:00:00', {'a': 1})
+        response = self.client.get(f'/api/notifications/?user_id={self.test_user_id}&before={bad_cursor}')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_unread_counter(self):
+        """Test the cached unread notification counter"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Counter Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        count_url = f'/api/notifications/unread-count?user_id={self.test_user_id}'
+        
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 0)
+        
+        self.client.post('/api/coupons/', json={'code': 'COUNT10', 'item_id': item_id})
+        self.client.post('/api/prices/update', json=[{'item_id': item_id, 'price': 90.00}])
+        self.client.post(f'/api/prices/simulate-drop/{item_id}', json={'drop_percentage': 10})
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 3)
+        
+        response = self.client.get(f'/api/notifications/?user_id={self.test_user_id}')
+        notification_ids = [n['id'] for n in json.loads(response.data)['notifications']]
+        self.client.put(f'/api/notifications/{notification_ids[0]}/read')
+        self.client.put(f'/api/notifications/{notification_ids[0]}/read')
+        self.client.delete(f'/api/notifications/{notification_ids[1]}')
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 1)
+        
+        response = self.client.put(f'/api/notifications/read-all?user_id={self.test_user_id}')
+        self.assertEqual(json.loads(response.data)['count'], 1)
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 0)
+        
+        # Writes that bypass the counter are repaired by the reconcile job
+        with app.app_context():
+            db.session.add(Notification(type='test', message='Drift', user_id=self.test_user_id, item_id=item_id))
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=['notification', 'reconcile-counters'])
+        self.assertIn('Repaired 1', result.output)
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 1)
+        
+        # Marking all as read moves the counter by the rows it flipped, keeping a concurrent insert's +1
+        with app.app_context():
+            db.session.execute(db.update(NotificationCounter).where(NotificationCounter.user_id == self.test_user_id)
+                               .values(unread_count=NotificationCounter.unread_count + 1))
+            db.session.commit()
+        response = self.client.put(f'/api/notifications/read-all?user_id={self.test_user_id}')
+        self.assertEqual(json.loads(response.data)['count'], 1)
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 1)
+    
+    def test_notification_stream(self):
+        """Test pushing notifications over Server-Sent Events"""
+        app.config['NOTIFICATION_STREAM_HEARTBEAT'] = 0.05
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Stream Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        stream = self.client.get(f'/api/notifications/stream?user_id={self.test_user_id}', buffered=False)
+        self.assertEqual(stream.mimetype, 'text/event-stream')
+        chunks = iter(stream.response)
+        self.assertTrue(next(chunks).startswith(b'retry:'))
+        self.assertEqual(next(chunks), b': heartbeat\n\n')
+        
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 90.00})
+        self.client.post('/api/coupons/', json={'code': 'STREAM5', 'item_id': item_id})
+        
+        first = next(chunks).decode()
+        second = next(chunks).decode()
+        self.assertIn('event: notification', first)
+        self.assertIn('"type": "price_drop"', first)
+        self.assertIn('"type": "coupon"', second)
+        stream.close()
+        
+        # Reconnecting with Last-Event-ID replays only what was missed
+        first_id = first.split('\n')[0][len('id: '):]
+        stream = self.client.get(
+            f'/api/notifications/stream?user_id={self.test_user_id}',
+            headers={'Last-Event-ID': first_id},
+            buffered=False
+        )
+        chunks = iter(stream.response)
+        next(chunks)
+        self.assertIn('"type": "coupon"', next(chunks).decode())
+        stream.close()
+    
+    def test_broker_replay_larger_than_queue(self):
+        """Test replaying a buffer larger than the default subscriber queue"""
+        broker = MemoryBroker(buffer_size=1500)
+        for number in range(1200):
+            broker.publish(1, {'number': number})
+        
+        subscriptions = []
+        worker = threading.Thread(target=lambda: subscriptions.append(broker.subscribe(1, '0')), daemon=True)
+        worker.start()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+        
+        events = subscriptions[0].get(timeout=0)
+        self.assertEqual(len(events), 1200)
+        self.assertFalse(subscriptions[0].closed)
+    
+    def test_notification_coalescing(self):
+        """Test coalescing repeated notifications and digest mode"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Coalesced Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        feed_url = f'/api/notifications/?user_id={self.test_user_id}'
+        count_url = f'/api/notifications/unread-count?user_id={self.test_user_id}'
+        
+        app.config['NOTIFICATION_COALESCE_WINDOW'] = 3600
+        try:
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': 90.00})
+            self.client.post('/api/prices/update', json=[{'item_id': item_id, 'price': 80.00}])
+            notifications = json.loads(self.client.get(feed_url).data)['notifications']
+            self.assertEqual(len(notifications), 1)
+            self.assertEqual(notifications[0]['occurrences'], 2)
+            self.assertEqual(notifications[0]['message'], 'Price dropped 2 times on Coalesced Item, now 20.00% off')
+            self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 1)
+            
+            # Once read, the next drop starts a new notification
+            self.client.put(f'/api/notifications/read-all?user_id={self.test_user_id}')
+            self.client.post(f'/api/prices/update/{item_id}', json={'price': 70.00})
+            notifications = json.loads(self.client.get(feed_url).data)['notifications']
+            self.assertEqual(len(notifications), 2)
+            self.assertEqual(notifications[0]['occurrences'], 1)
+        finally:
+            app.config['NOTIFICATION_COALESCE_WINDOW'] = 0
+        
+        self.client.put(f'/api/users/{self.test_user_id}', json={'notification_digest': True})
+        self.client.post('/api/coupons/', json={'code': 'DIGEST10', 'item_id': item_id})
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 60.00})
+        notifications = json.loads(self.client.get(feed_url).data)['notifications']
+        self.assertEqual(len(notifications), 3)
+        self.assertEqual(notifications[0]['type'], 'digest')
+        self.assertEqual(notifications[0]['occurrences'], 2)
+        self.assertTrue(notifications[0]['message'].startswith('2 updates on your wishlist'))
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 2)
+    
+    def test_notification_outbox(self):
+        """Test delivering notifications through the transactional outbox"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Outbox Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        feed_url = f'/api/notifications/?user_id={self.test_user_id}'
+        
+        app.config['NOTIFICATION_OUTBOX'] = True
+        try:
+            self.client.put(f'/api/wishlist/{item_id}', json={'current_price': 90.00})
+            self.client.post('/api/coupons/', json={'code': 'OUTBOX10', 'item_id': item_id})
+        finally:
+            app.config['NOTIFICATION_OUTBOX'] = False
+        
+        # Nothing is delivered until the worker drains the outbox
+        self.assertEqual(json.loads(self.client.get(feed_url).data)['notifications'], [])
+        self.assertEqual(json.loads(self.client.get('/api/notifications/outbox').data)['pending'], 2)
+        
+        result = app.test_cli_runner().invoke(args=['notification', 'drain-outbox'])
+        self.assertEqual(json.loads(result.output), {'processed': 2, 'retried': 0, 'failed': 0})
+        notifications = json.loads(self.client.get(feed_url).data)['notifications']
+        self.assertEqual(sorted(n['type'] for n in notifications), ['coupon', 'price_drop'])
+        count_url = f'/api/notifications/unread-count?user_id={self.test_user_id}'
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 2)
+        
+        # Failing events are retried with backoff, then marked failed
+        with app.app_context():
+            enqueue('unknown', {})
+            db.session.commit()
+            self.assertEqual(drain_outbox(max_attempts=2), {'processed': 0, 'retried': 1, 'failed': 0})
+            self.assertEqual(drain_outbox(max_attempts=2), {'processed': 0, 'retried': 0, 'failed': 0})
+            later = datetime.utcnow() + timedelta(seconds=retry_delay(1) + 1)
+            self.assertEqual(drain_outbox(max_attempts=2, now=later), {'processed': 0, 'retried': 0, 'failed': 1})
+        stats = json.loads(self.client.get('/api/notifications/outbox').data)
+        self.assertEqual((stats['pending'], stats['done'], stats['failed']), (0, 2, 1))
+    
+    def test_notification_retention(self):
+        """Test archiving and deleting old notifications"""
+        now = datetime.utcnow()
+        with app.app_context():
+            for days, is_read in [(1, True), (40, True), (45, True), (50, False), (400, False)]:
+                db.session.add(Notification(
+                    type='test', message=f'{days} days old', is_read=is_read,
+                    created_at=now - timedelta(days=days), user_id=self.test_user_id
+                ))
+            db.session.commit()
+        count_url = f'/api/notifications/unread-count?user_id={self.test_user_id}'
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 2)
+        
+        result = app.test_cli_runner().invoke(args=[
+            'notification', 'apply-retention', '--archive-after-days', '30',
+            '--delete-after-days', '365', '--chunk-size', '1'
+        ])
+        summary = json.loads(result.output)
+        self.assertEqual((summary['archived'], summary['deleted']), (2, 1))
+        self.assertEqual(json.loads(self.client.get(count_url).data)['unread_count'], 1)
+        
+        notifications = json.loads(self.client.get(f'/api/notifications/?user_id={self.test_user_id}').data)['notifications']
+        self.assertEqual([n['message'] for n in notifications], ['1 days old', '50 days old'])
+        
+        # The archive pages like the live feed
+        response = self.client.get(f'/api/notifications/archive?user_id={self.test_user_id}&limit=1')
+        data = json.loads(response.data)
+        self.assertEqual([n['message'] for n in data['notifications']], ['40 days old'])
+        response = self.client.get(f"/api/notifications/archive?user_id={self.test_user_id}&limit=1&before={data['next_cursor']}")
+        data = json.loads(response.data)
+        self.assertEqual([n['message'] for n in data['notifications']], ['45 days old'])
+        self.assertIsNone(data['next_cursor'])
+        bad_cursor = encode_cursor('2020-01-01T00:00:00', 'x')
+        response = self.client.get(f'/api/notifications/archive?user_id={self.test_user_id}&before={bad_cursor}')
+        self.assertEqual(response.status_code, 400)
+        
+        # Archived rows expire with the delete policy too
+        with app.app_context():
+            summary = apply_retention(30, 42, now=now)
+        self.assertEqual(summary['archive_deleted'], 1)
+    
+    def test_active_coupons(self):
+        """Test filtering and paging active coupons in SQL"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Coupon Filter Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        now = datetime.utcnow()
+        with app.app_context():
+            for code, status, valid_until in [
+                ('ACTIVE1', CouponStatus.ACTIVE, None),
+                ('ACTIVE2', CouponStatus.ACTIVE, now + timedelta(days=1)),
+                ('ACTIVE3', CouponStatus.ACTIVE, now + timedelta(days=2)),
+                ('LAPSED', CouponStatus.ACTIVE, now - timedelta(days=1)),
+                ('USED', CouponStatus.USED, None)
+            ]:
+                db.session.add(Coupon(code=code, status=status, valid_from=now - timedelta(days=3),
+                                      valid_until=valid_until, item_id=item_id))
+            db.session.add(Coupon(code='FUTURE', valid_from=now + timedelta(days=1), item_id=item_id))
+            db.session.commit()
+            coupons = Coupon.query.filter_by(item_id=item_id).all()
+            active = Coupon.query.filter(Coupon.item_id == item_id, Coupon.is_active()).all()
+            self.assertEqual({c.code for c in active}, {c.code for c in coupons if c.is_active()})
+        
+        url = f'/api/coupons/?user_id={self.test_user_id}&active_only=true&limit=2'
+        data = json.loads(self.client.get(url).data)
+        self.assertEqual([c['code'] for c in data['coupons']], ['ACTIVE1', 'ACTIVE2'])
+        data = json.loads(self.client.get(f"{url}&after={data['next_cursor']}").data)
+        self.assertEqual([c['code'] for c in data['coupons']], ['ACTIVE3'])
+        self.assertIsNone(data['next_cursor'])
+        response = self.client.get(f"{url}&after={encode_cursor({'a': 1})}")
+        self.assertEqual(response.status_code, 400)
+        
+        data = json.loads(self.client.get(f'/api/coupons/?item_id={item_id}').data)
+        self.assertEqual(len(data['coupons']), 6)
+    
+    def test_coupon_expiry_sweeper(self):
+        """Test expiring coupons and the expiring-soon notification"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={
+                'name': 'Expiring Item',
+                'current_price': 100.00,
+                'user_id': self.test_user_id
+            }
+        )
+        item_id = json.loads(response.data)['item']['id']
+        now = datetime.utcnow()
+        with app.app_context():
+            for code, valid_until in [('PAST1', now - timedelta(days=2)), ('PAST2', now - timedelta(hours=1)),
+                                      ('SOON', now + timedelta(hours=2)), ('LATER', now + timedelta(days=5)),
+                                      ('FOREVER', None)]:
+                db.session.add(Coupon(code=code, valid_from=now - timedelta(days=3),
+                                      valid_until=valid_until, item_id=item_id))
+            db.session.commit()
+        
+        result = app.test_cli_runner().invoke(args=['coupon', 'expire', '--notify-within-hours', '24', '--chunk-size', '1'])
+        self.assertEqual(json.loads(result.output), {'expired': 2, 'notified': 1})
+        
+        data = json.loads(self.client.get(f'/api/coupons/?item_id={item_id}').data)
+        statuses = {c['code']: c['status'] for c in data['coupons']}
+        self.assertEqual(statuses['PAST1'], 'expired')
+        self.assertEqual(statuses['SOON'], 'active')
+        
+        notifications = json.loads(self.client.get(f'/api/notifications/?user_id={self.test_user_id}&type=coupon_expiring').data)['notifications']
+        self.assertEqual(len(notifications), 1)
+        self.assertIn('SOON', notifications[0]['message'])
+        
+        # A second run finds nothing left to do
+        result = app.test_cli_runner().invoke(args=['coupon', 'expire', '--notify-within-hours', '24'])
+        self.assertEqual(json.loads(result.output), {'expired': 0, 'notified': 0})
+        
+        # Moving the expiry date into the future revives an expired coupon
+        past1 = next(c for c in data['coupons'] if c['code'] == 'PAST1')
+        valid_until = (now + timedelta(days=1)).isoformat()
+        response = self.client.put(f"/api/coupons/{past1['id']}", json={'valid_until': valid_until})
+        self.assertEqual(json.loads(response.data)['coupon']['status'], 'active')
+        response = self.client.put(f"/api/coupons/{past1['id']}", json={'valid_until': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_effective_prices(self):
+        """Test combining coupons and prices into effective prices"""
+        item_ids = []
+        for name, price in [('Coupon Laptop', 1000.00), ('Coupon Mouse', 40.00), ('No Coupon', 25.00)]:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={'name': name, 'current_price': price, 'user_id': self.test_user_id}
+            )
+            item_ids.append(json.loads(response.data)['item']['id'])
+        laptop_id, mouse_id, plain_id = item_ids
+        
+        self.client.post('/api/coupons/', json={'code': 'PCT10', 'item_id': laptop_id, 'discount_amount': 10})
+        self.client.post('/api/coupons/', json={'code': 'FIXED150', 'item_id': laptop_id, 'discount_amount': 150, 'is_percentage': False})
+        self.client.post('/api/coupons/', json={'code': 'BIGFIXED', 'item_id': mouse_id, 'discount_amount': 50, 'is_percentage': False})
+        
+        data = json.loads(self.client.get(f'/api/coupons/best?user_id={self.test_user_id}').data)
+        best = {price['item_id']: price for price in data['items']}
+        self.assertEqual(best[laptop_id]['effective_price'], 850.00)
+        self.assertEqual(best[laptop_id]['coupon']['code'], 'FIXED150')
+        self.assertEqual(best[mouse_id]['effective_price'], 0)
+        self.assertIsNone(best[plain_id]['coupon'])
+        self.assertEqual(best[plain_id]['effective_price'], 25.00)
+        self.assertEqual(data['total_savings'], 190.00)
+        
+        # Cached results are refreshed by price and coupon writes
+        self.client.put(f'/api/wishlist/{laptop_id}', json={'current_price': 2000.00})
+        data = json.loads(self.client.get(f'/api/wishlist/?user_id={self.test_user_id}').data)
+        laptop = next(item for item in data['items'] if item['id'] == laptop_id)
+        self.assertEqual(laptop['effective_price'], 1800.00)
+        self.assertEqual(laptop['best_coupon']['code'], 'PCT10')
+        
+        coupon_id = laptop['best_coupon']['id']
+        self.client.delete(f'/api/coupons/{coupon_id}')
+        data = json.loads(self.client.get(f'/api/coupons/best?user_id={self.test_user_id}').data)
+        self.assertEqual({p['item_id']: p['effective_price'] for p in data['items']}[laptop_id], 1850.00)
+        
+        # A write committed by another process reaches this cache through the watermark alone
+        with app.app_context():
+            db.session.execute(db.update(WishlistItem).where(WishlistItem.id == laptop_id).values(current_price=1000.00))
+            db.session.execute(db.update(ChangeWatermark).where(ChangeWatermark.user_id == self.test_user_id)
+                               .values(version=ChangeWatermark.version + 1))
+            db.session.commit()
+        data = json.loads(self.client.get(f'/api/coupons/best?user_id={self.test_user_id}').data)
+        self.assertEqual({p['item_id']: p['effective_price'] for p in data['items']}[laptop_id], 850.00)
+        
+        response = self.client.get('/api/wishlist/price-drops?user_id=abc')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_coupon_import(self):
+        """Test importing coupons matched by URL, prefix and domain"""
+        item_ids = {}
+        for name, url in [('Import Shoes', 'https://www.shoeshop.test/shoes/1?utm_source=x'),
+                          ('Import Boots', 'https://eu.shoeshop.test/boots/2'),
+                          ('Import Lamp', 'https://lamps.test/lamp/3')]:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={'name': name, 'current_price': 50.00, 'url': url, 'user_id': self.test_user_id}
+            )
+            item_ids[name] = json.loads(response.data)['item']['id']
+        
+        coupons = [
+            {'code': 'SHOES20', 'domain': 'shoeshop.test', 'discount_amount': 20},
+            {'code': 'LAMP5', 'url': 'https://lamps.test/lamp/3/', 'discount_amount': 5, 'is_percentage': False},
+            {'code': 'BOOTS', 'url_prefix': 'https://eu.shoeshop.test/boots', 'discount_amount': 10},
+            {'code': 'SHOES20', 'url_prefix': 'https://shoeshop.test/', 'discount_amount': 20},
+            {'code': 'NOWHERE', 'domain': 'unknown.test'},
+            {'discount_amount': 10},
+            {'code': 'BADURL', 'url': 123},
+            {'code': 'BADDOMAIN', 'domain': ['shoeshop.test']}
+        ]
+        response = self.client.post('/api/coupons/import', json={'coupons': coupons})
+        summary = json.loads(response.data)['summary']
+        self.assertEqual(summary['created'], 4)
+        self.assertEqual(summary['duplicates'], 1)
+        self.assertEqual((summary['unmatched'], summary['invalid']), (1, 3))
+        self.assertEqual(summary['users_notified'], 1)
+        
+        data = json.loads(self.client.get(f"/api/coupons/?item_id={item_ids['Import Boots']}").data)
+        self.assertEqual(sorted(c['code'] for c in data['coupons']), ['BOOTS', 'SHOES20'])
+        
+        notifications = json.loads(self.client.get(f'/api/notifications/?user_id={self.test_user_id}&type=coupon').data)['notifications']
+        self.assertEqual(len(notifications), 1)
+        self.assertEqual(notifications[0]['message'], '4 new coupons available for 3 of your wishlist items')
+        
+        # Importing the same file again adds nothing
+        response = self.client.post('/api/coupons/import', json=coupons)
+        summary = json.loads(response.data)['summary']
+        self.assertEqual((summary['created'], summary['users_notified']), (0, 0))
+    
+    def test_wishlist_pagination_and_fields(self):
+        """Test paging the wishlist and selecting fields"""
+        for name, price, priority in [('Page A', 30.00, 2), ('Page B', None, 1), ('Page C', 10.00, 2),
+                                      ('Page D', 20.00, 0), ('Page E', 10.00, 1)]:
+            self.client.post(
+                '/api/wishlist/',
+                json={'name': name, 'current_price': price, 'priority': priority,
+                      'description': 'Long text', 'user_id': self.test_user_id}
+            )
+        base_url = f'/api/wishlist/?user_id={self.test_user_id}'
+        
+        def collect(query):
+            names, cursor = [], None
+            while True:
+                url = f'{base_url}&{query}&limit=2' + (f'&after={cursor}' if cursor else '')
+                data = json.loads(self.client.get(url).data)
+                self.assertLessEqual(len(data['items']), 2)
+                names += [item['name'] for item in data['items']]
+                cursor = data['next_cursor']
+                if not cursor:
+                    return names
+        
+        self.assertEqual(collect('sort=price'), ['Page C', 'Page E', 'Page D', 'Page A', 'Page B'])
+        self.assertEqual(collect('sort=price&order=desc'), ['Page A', 'Page D', 'Page E', 'Page C', 'Page B'])
+        self.assertEqual(collect('sort=priority'), ['Page C', 'Page A', 'Page E', 'Page B', 'Page D'])
+        self.assertEqual(collect('sort=created_at&order=asc'), ['Page A', 'Page B', 'Page C', 'Page D', 'Page E'])
+        
+        data = json.loads(self.client.get(f'{base_url}&fields=name,current_price,effective_price').data)
+        self.assertEqual(set(data['items'][0]), {'id', 'name', 'current_price', 'effective_price'})
+        self.assertEqual(len(data['items']), 5)
+        
+        response = self.client.get(f'{base_url}&fields=name,password')
+        self.assertEqual(response.status_code, 400)
+        
+        # Cursors holding values of the wrong type are rejected
+        for values in ([{'a': 1}, 1], [10.0, 'x'], [True, 1]):
+            response = self.client.get(f'{base_url}&sort=price&limit=2&after={encode_cursor(*values)}')
+            self.assertEqual(response.status_code, 400)
+    
+    def test_wishlist_search(self):
+        """Test full-text search over wishlist items"""
+        item_ids = {}
+        for name, description in [('Mechanical Keyboard', 'Tactile switches, backlit'),
+                                  ('Keyboard Wrist Rest', 'Memory foam'),
+                                  ('Desk Lamp', 'Warm light for a mechanical workshop'),
+                                  ('Headphones', None)]:
+            response = self.client.post(
+                '/api/wishlist/',
+                json={'name': name, 'description': description, 'current_price': 10.00, 'user_id': self.test_user_id}
+            )
+            item_ids[name] = json.loads(response.data)['item']['id']
+        search_url = f'/api/wishlist/search?user_id={self.test_user_id}'
+        
+        for backend in ('fts5', 'memory'):
+            app.config['SEARCH_BACKEND'] = backend
+            try:
+                data = json.loads(self.client.get(f'{search_url}&q=mech').data)
+                # Name matches rank above description matches
+                self.assertEqual([item['name'] for item in data['items']], ['Mechanical Keyboard', 'Desk Lamp'])
+                
+                data = json.loads(self.client.get(f'{search_url}&q=keyb&limit=1').data)
+                self.assertEqual(len(data['items']), 1)
+                data = json.loads(self.client.get(f"{search_url}&q=keyb&limit=1&after={data['next_cursor']}").data)
+                self.assertEqual(len(data['items']), 1)
+                self.assertIsNone(data['next_cursor'])
+                
+                # The index follows updates and deletes
+                self.client.put(f"/api/wishlist/{item_ids['Headphones']}", json={'description': 'Noise cancelling'})
+                data = json.loads(self.client.get(f'{search_url}&q=noise').data)
+                self.assertEqual([item['name'] for item in data['items']], ['Headphones'])
+                self.client.put(f"/api/wishlist/{item_ids['Headphones']}", json={'description': None})
+                
+                self.client.delete(f"/api/wishlist/{item_ids['Desk Lamp']}")
+                data = json.loads(self.client.get(f'{search_url}&q=mech').data)
+                self.assertEqual([item['name'] for item in data['items']], ['Mechanical Keyboard'])
+                
+                response = self.client.post(
+                    '/api/wishlist/',
+                    json={'name': 'Desk Lamp', 'description': 'Warm light for a mechanical workshop',
+                          'current_price': 10.00, 'user_id': self.test_user_id}
+                )
+                item_ids['Desk Lamp'] = json.loads(response.data)['item']['id']
+            finally:
+                app.config['SEARCH_BACKEND'] = 'auto'
+        
+        # The in-process index picks up writes committed by another process through the watermark
+        app.config['SEARCH_BACKEND'] = 'memory'
+        try:
+            with app.app_context():
+                db.session.execute(db.update(WishlistItem).where(WishlistItem.id == item_ids['Headphones'])
+                                   .values(description='Studio monitors'))
+                db.session.execute(db.update(ChangeWatermark).where(ChangeWatermark.user_id == self.test_user_id)
+                                   .values(version=ChangeWatermark.version + 1))
+                db.session.commit()
+            data = json.loads(self.client.get(f'{search_url}&q=studio').data)
+            self.assertEqual([item['name'] for item in data['items']], ['Headphones'])
+        finally:
+            app.config['SEARCH_BACKEND'] = 'auto'
+        
+        response = self.client.get(search_url)
+        self.assertEqual(response.status_code, 400)
+        for offset in ('abc', -1):
+            response = self.client.get(f'{search_url}&q=mech&after={encode_cursor(offset)}')
+            self.assertEqual(response.status_code, 400)
+        
+        # Databases created before search get the FTS5 table and triggers from the rebuild command
+        with app.app_context():
+            for name in ('insert', 'delete', 'update'):
+                db.session.execute(db.text(f'DROP TRIGGER wishlist_item_fts_{name}'))
+            db.session.execute(db.text('DROP TABLE wishlist_item_fts'))
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=['wishlist', 'rebuild-search-index'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        data = json.loads(self.client.get(f'{search_url}&q=mech').data)
+        self.assertEqual([item['name'] for item in data['items']], ['Mechanical Keyboard', 'Desk Lamp'])
+    
+    def test_item_history_embed(self):
+        """Test the embedded price history modes of item detail"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={'name': 'Embed Item', 'current_price': 100.00, 'user_id': self.test_user_id}
+        )
+        item_id = json.loads(response.data)['item']['id']
+        for price in (80.00, 80.00, 90.00):
+            self.client.post('/api/prices/update', json=[{'item_id': item_id, 'price': price}])
+        item_url = f'/api/wishlist/{item_id}'
+        
+        item = json.loads(self.client.get(item_url).data)['item']
+        self.assertNotIn('price_history', item)
+        summary = item['price_history_summary']
+        self.assertEqual((summary['count'], summary['changes']), (4, 3))
+        self.assertEqual((summary['min'], summary['max']), (80.00, 100.00))
+        self.assertEqual(summary['avg'], 87.5)
+        
+        item = json.loads(self.client.get(f'{item_url}?embed=latest:2').data)['item']
+        self.assertEqual([h['price'] for h in item['price_history']], [90.00, 80.00])
+        self.assertIsNotNone(item['price_history_next_cursor'])
+        
+        item = json.loads(self.client.get(f'{item_url}?embed=full').data)['item']
+        self.assertEqual(len(item['price_history']), 3)
+        
+        item = json.loads(self.client.get(f'{item_url}?embed=none').data)['item']
+        self.assertNotIn('price_history', item)
+        self.assertNotIn('price_history_summary', item)
+        
+        for embed in ('latest', 'latest:0', 'everything', 'full:3'):
+            response = self.client.get(f'{item_url}?embed={embed}')
+            self.assertEqual(response.status_code, 400)
+    
+    def test_bulk_items(self):
+        """Test creating, updating and deleting items in bulk"""
+        existing = []
+        for name in ('Bulk Old 1', 'Bulk Old 2'):
+            response = self.client.post(
+                '/api/wishlist/',
+                json={'name': name, 'current_price': 100.00, 'user_id': self.test_user_id}
+            )
+            existing.append(json.loads(response.data)['item']['id'])
+        
+        operations = [
+            {'op': 'create', 'item': {'name': 'Bulk New 1', 'current_price': 10.00, 'user_id': self.test_user_id}},
+            {'op': 'create', 'item': {'name': 'Bulk New 2', 'user_id': self.test_user_id}},
+            {'op': 'update', 'id': existing[0], 'item': {'priority': 2, 'current_price': 75.00}},
+            {'op': 'delete', 'id': existing[1]},
+            {'op': 'create', 'item': {'name': 'Bad User', 'user_id': 99999}}
+        ]
+        
+        # Atomic mode rejects the whole batch
+        response = self.client.post('/api/wishlist/bulk', json={'operations': operations})
+        self.assertEqual(response.status_code, 400)
+        statuses = [r['status'] for r in json.loads(response.data)['results']]
+        self.assertEqual(statuses, ['skipped', 'skipped', 'skipped', 'skipped', 'error'])
+        items = json.loads(self.client.get(f'/api/wishlist/?user_id={self.test_user_id}').data)['items']
+        self.assertEqual(len(items), 2)
+        
+        response = self.client.post('/api/wishlist/bulk', json={'operations': operations, 'mode': 'best_effort'})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'created', 'updated', 'deleted', 'error'])
+        self.assertEqual(results[2]['item']['current_price'], 75.00)
+        self.assertEqual(results[2]['item']['lowest_price'], 75.00)
+        
+        items = json.loads(self.client.get(f'/api/wishlist/?user_id={self.test_user_id}').data)['items']
+        self.assertEqual(sorted(item['name'] for item in items), ['Bulk New 1', 'Bulk New 2', 'Bulk Old 1'])
+        
+        history = json.loads(self.client.get(f"/api/prices/history/{results[0]['item']['id']}").data)['price_history']
+        self.assertEqual([h['price'] for h in history], [10.00])
+        history = json.loads(self.client.get(f'/api/prices/history/{existing[0]}').data)['price_history']
+        self.assertEqual([h['price'] for h in history], [75.00, 100.00])
+        
+        notifications = json.loads(self.client.get(f'/api/notifications/?user_id={self.test_user_id}').data)['notifications']
+        self.assertEqual([n['type'] for n in notifications], ['price_drop'])
+        
+        # Field types are checked per operation, so bad values never reach the database
+        response = self.client.post('/api/wishlist/bulk', json={'mode': 'best_effort', 'operations': [
+            {'op': 'update', 'id': existing[0], 'item': {'current_price': 'cheap'}},
+            {'op': 'create', 'item': {'name': 'Bad Price', 'current_price': 'abc', 'user_id': self.test_user_id}},
+            {'op': 'create', 'item': {'name': 'Bad Priority', 'priority': 'high', 'user_id': self.test_user_id}},
+            {'op': 'update', 'id': existing[0], 'item': {'is_purchased': 'yes'}},
+            {'op': 'update', 'id': results[0]['item']['id'], 'item': {'name': None}},
+            {'op': 'create', 'item': {'name': 'Good', 'current_price': 5, 'user_id': self.test_user_id}}
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual([r['status'] for r in results], ['error'] * 5 + ['created'])
+        self.assertEqual(results[0]['error'], 'current_price must be a number')
+    
+    def test_conditional_get(self):
+        """Test ETags and 304 answers driven by the per-user change watermark"""
+        url = f'/api/wishlist/?user_id={self.test_user_id}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+        
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        
+        # Other parameters are a different representation
+        response = self.client.get(url + '&sort=price', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        
+        # Any write to the user's data moves the watermark
+        response = self.client.post(
+            '/api/wishlist/',
+            json={'name': 'Watermark Item', 'current_price': 50.00, 'user_id': self.test_user_id}
+        )
+        item_id = json.loads(response.data)['item']['id']
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['items']), 1)
+        etag = response.headers['ETag']
+        
+        notifications_url = f'/api/notifications/?user_id={self.test_user_id}'
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 40.00})
+        response = self.client.get(notifications_url)
+        self.assertEqual(response.status_code, 200)
+        notifications_etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+        
+        # Bulk statements that bypass the ORM move it too
+        self.client.put(f'/api/notifications/read-all?user_id={self.test_user_id}')
+        response = self.client.get(notifications_url, headers={'If-None-Match': notifications_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(n['is_read'] for n in json.loads(response.data)['notifications']))
+        
+        # Cross-user listings are never conditional
+        response = self.client.get('/api/prices/drops?all_users=true')
+        self.assertNotIn('ETag', response.headers)
+        
+        # A coupon running out changes the listing without any write, and so the tag
+        self.client.post('/api/coupons/', json={'code': 'TICK5', 'discount_amount': 5, 'item_id': item_id})
+        coupons_url = f'/api/coupons/?user_id={self.test_user_id}&active_only=true'
+        with app.app_context():
+            db.session.execute(db.update(Coupon).values(valid_from=datetime.utcnow() - timedelta(hours=2),
+                                                     valid_until=datetime.utcnow() + timedelta(hours=1)))
+            db.session.commit()
+        response = self.client.get(coupons_url)
+        self.assertEqual(len(json.loads(response.data)['coupons']), 1)
+        coupons_etag = response.headers['ETag']
+        self.assertEqual(self.client.get(coupons_url, headers={'If-None-Match': coupons_etag}).status_code, 304)
+        
+        with app.app_context():
+            db.session.execute(db.update(Coupon).values(valid_until=datetime.utcnow() - timedelta(minutes=1)))
+            db.session.commit()
+        response = self.client.get(coupons_url, headers={'If-None-Match': coupons_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['coupons'], [])
+    
+    def test_wishlist_summary(self):
+        """Test the dashboard summary and its invalidation on writes"""
+        with app.app_context():
+            books = Category.query.filter_by(name='Books').first().id
+        for name, price, priority, category_id in [('Laptop', 1000.00, 2, self.test_category_id),
+                                                   ('Phone', 500.00, 1, self.test_category_id),
+                                                   ('Novel', 20.00, 1, books),
+                                                   ('Mug', None, 0, None)]:
+            self.client.post('/api/wishlist/', json={
+                'name': name, 'current_price': price, 'priority': priority,
+                'category_id': category_id, 'user_id': self.test_user_id
+            })
+        items = {item['name']: item['id'] for item in
+                 json.loads(self.client.get(f'/api/wishlist/?user_id={self.test_user_id}').data)['items']}
+        self.client.post(f"/api/prices/update/{items['Laptop']}", json={'price': 800.00})
+        self.client.put(f"/api/wishlist/{items['Novel']}", json={'is_purchased': True})
+        self.client.post('/api/coupons/', json={
+            'code': 'SAVE10', 'discount_amount': 10, 'is_percentage': True, 'item_id': items['Phone']
+        })
+        
+        url = f'/api/wishlist/summary?user_id={self.test_user_id}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        summary = json.loads(response.data)['summary']
+        self.assertEqual(summary['items']['total'], 4)
+        self.assertEqual({c['category_id']: c['count'] for c in summary['items']['by_category']},
+                         {self.test_category_id: 2, books: 1, None: 1})
+        self.assertEqual({p['priority']: p['count'] for p in summary['items']['by_priority']}, {0: 1, 1: 2, 2: 1})
+        self.assertEqual(summary['purchased']['count'], 1)
+        self.assertEqual(summary['unpurchased'], {'count': 3, 'current_value': 1300.00,
+                                                  'initial_value': 1500.00, 'savings': 200.00})
+        self.assertEqual(summary['total']['current_value'], 1320.00)
+        self.assertEqual(summary['active_drops'], 1)
+        self.assertEqual(summary['active_coupons'], 1)
+        self.assertEqual(summary['unread_notifications'], 2)
+        
+        # Served from the cache, then recomputed after a write
+        self.assertEqual(json.loads(self.client.get(url).data)['summary']['computed_at'], summary['computed_at'])
+        self.client.put(f'/api/notifications/read-all?user_id={self.test_user_id}')
+        response = self.client.get(url)
+        summary = json.loads(response.data)['summary']
+        self.assertEqual(summary['unread_notifications'], 0)
+        
+        # A coupon running out changes the summary without a write, for polls and the cache alike
+        etag = response.headers['ETag']
+        with app.app_context():
+            db.session.execute(db.update(Coupon).values(valid_until=datetime.utcnow() - timedelta(minutes=1)))
+            db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['summary']['active_coupons'], 0)
+        
+        response = self.client.get('/api/wishlist/summary')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_normalize_url_tracking_params(self):
+        """Test that only tracking parameters are dropped from product URLs"""
+        self.assertEqual(normalize_url('https://www.shop.test/p/1/?utm_source=x&ref=mail&gclid=1&tag=aff'),
+                         normalize_url('https://shop.test/p/1'))
+        # Product parameters that merely start like a tracking key are kept
+        for url in ('https://shop.test/p?reference=A1', 'https://shop.test/p?tags=red',
+                    'https://shop.test/p?refurbished=1'):
+            self.assertNotEqual(normalize_url(url), normalize_url('https://shop.test/p'))
+    
+    def test_rollup_upsert(self):
+        """Test folding observations into buckets another writer already created"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={'name': 'Upsert Item', 'user_id': self.test_user_id}
+        )
+        item_id = json.loads(response.data)['item']['id']
+        moment = datetime(2024, 5, 1, 10, 15)
+        
+        with app.app_context():
+            # Both batches insert the same buckets, as two concurrent writers would
+            update_rollups([(item_id, 50.00, moment), (item_id, 70.00, moment + timedelta(minutes=5))])
+            update_rollups([(item_id, 40.00, moment + timedelta(minutes=10)), (item_id, 60.00, moment + timedelta(minutes=20))])
+            db.session.commit()
+            
+            buckets = PriceRollup.query.filter_by(item_id=item_id).all()
+            self.assertEqual(sorted(b.resolution for b in buckets), ['day', 'hour', 'week'])
+            for bucket in buckets:
+                self.assertEqual((bucket.open_price, bucket.high_price, bucket.low_price, bucket.close_price, bucket.count),
+                                 (50.00, 70.00, 40.00, 60.00, 4))
+    
+    def test_rebuild_rollups_from_runs(self):
+        """Test rebuilding rollups from a run that held its price for a week"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={'name': 'Steady Item', 'user_id': self.test_user_id}
+        )
+        item_id = json.loads(response.data)['item']['id']
+        
+        with app.app_context():
+            db.session.add(PriceHistory(item_id=item_id, price=30.00, recorded_at=datetime(2024, 5, 6),
+                                        last_seen=datetime(2024, 5, 12), observation_count=7))
+            db.session.commit()
+            rebuild_rollups([item_id])
+            
+            days = PriceRollup.query.filter_by(item_id=item_id, resolution='day').order_by(PriceRollup.bucket_start).all()
+            self.assertEqual([(day.bucket_start.day, day.count) for day in days], [(day, 1) for day in range(6, 13)])
+            week = PriceRollup.query.filter_by(item_id=item_id, resolution='week').one()
+            self.assertEqual(week.count, 7)
+    
+    def test_upgrade_schema(self):
+        """Test bringing a database created before the newer columns and indexes up to date"""
+        response = self.client.post(
+            '/api/wishlist/',
+            json={'name': 'Old Item', 'current_price': 100.00, 'user_id': self.test_user_id}
+        )
+        item_id = json.loads(response.data)['item']['id']
+        self.client.post(f'/api/prices/update/{item_id}', json={'price': 80.00})
+        
+        # Roll the database back to the older layout
+        with app.app_context():
+            for name in ('ix_wishlist_item_user_drop', 'ix_wishlist_item_drop'):
+                db.session.execute(db.text(f'DROP INDEX {name}'))
+            db.session.execute(db.text('ALTER TABLE wishlist_item DROP COLUMN price_drop_pct'))
+            db.session.execute(db.text('ALTER TABLE price_history DROP COLUMN observation_count'))
+            ddl = db.session.execute(db.text("SELECT sql FROM sqlite_master WHERE name = 'notification'")).scalar()
+            for name in ('ix_notification_user_read_created', 'ix_notification_user_created'):
+                db.session.execute(db.text(f'DROP INDEX {name}'))
+            db.session.execute(db.text('ALTER TABLE notification RENAME TO notification_new'))
+            db.session.execute(db.text(ddl.replace('item_id INTEGER,', 'item_id INTEGER NOT NULL,')))
+            db.session.execute(db.text('INSERT INTO notification SELECT * FROM notification_new'))
+            db.session.execute(db.text('DROP TABLE notification_new'))
+            db.session.commit()
+        
+        result = app.test_cli_runner().invoke(args=['wishlist', 'upgrade-schema'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        for change in ('added column wishlist_item.price_drop_pct', 'added column price_history.observation_count',
+                       'made notification.item_id nullable', 'created index ix_wishlist_item_drop',
+                       'created index ix_notification_user_created', 'Recomputed price drops for 1 items'):
+            self.assertIn(change, result.output)
+        self.assertNotIn('ix_wishlist_item_fulltext', result.output)
+        
+        with app.app_context():
+            item = WishlistItem.query.get(item_id)
+            self.assertEqual(item.price_drop_pct, 20)
+            self.assertEqual({row.observation_count for row in PriceHistory.query.filter_by(item_id=item_id)}, {1})
+            self.assertGreater(Notification.query.filter_by(item_id=item_id).count(), 0)
+            db.session.add(Notification(user_id=self.test_user_id, type='digest', message='Digest'))
+            db.session.commit()
+        
+        # An up-to-date database is left alone
+        result = app.test_cli_runner().invoke(args=['wishlist', 'upgrade-schema'])
+        self.assertEqual(result.output.strip(), 'The schema is up to date')
+    
 
 if __name__ == '__main__':
     unittest.main()